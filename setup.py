@@ -15,6 +15,9 @@ setup(
         "asyncio-glib",
         "http-parser",
     ],
+    extras_require={
+        "msgpack": ["msgpack"],
+    },
     test_suite="tests",
     tests_require=[
         "aiohttp",
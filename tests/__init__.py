@@ -1,6 +1,7 @@
 import gi
 gi.require_version('Gst', '1.0')
 gi.require_version('GstNet', '1.0')
+gi.require_version('GstController', '1.0')
 from gi.repository import Gst
 
 Gst.init(None)
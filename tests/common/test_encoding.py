@@ -0,0 +1,66 @@
+import unittest
+
+from videowhisk.common import encoding, messages
+
+
+class EncodingTests(unittest.TestCase):
+
+    def setUp(self):
+        # Exercise the pure Python MessagePack implementation
+        self.real_msgpack = encoding.msgpack
+        encoding.msgpack = None
+
+    def tearDown(self):
+        encoding.msgpack = self.real_msgpack
+
+    def test_pack_values(self):
+        values = [None, True, False, 0, 127, 128, 65536, 2**40, -1, -33,
+                  -2**40, 1.5, "", "x" * 40, "y" * 300, "é",
+                  [], [1, "two", None], list(range(20)),
+                  {"a": 1}, {"k{}".format(i): i for i in range(20)}]
+        for value in values:
+            self.assertEqual(encoding.unpack(encoding.pack(value)), value)
+
+    def test_pack_tuple(self):
+        self.assertEqual(encoding.unpack(encoding.pack(("host", 42))),
+                         ["host", 42])
+
+    def test_pack_known_encoding(self):
+        self.assertEqual(encoding.pack(["a", 1, None]), b"\x93\xa1a\x01\xc0")
+
+    def test_unpack_truncated(self):
+        with self.assertRaises(encoding.EncodingError):
+            encoding.unpack(b"\x93\xa1a")
+        with self.assertRaises(encoding.EncodingError):
+            encoding.unpack(b"\x01\x02")
+
+    def test_message_fields(self):
+        self.assertEqual(messages.message_fields(messages.VideoSourceAdded),
+                         ("channel", "remote_addr"))
+        self.assertEqual(messages.message_fields(messages.AudioMixStatus),
+                         ("active_source", "volumes"))
+
+    def test_msgpack_message(self):
+        msg = messages.VideoSourceAdded("channel", ("address", 42))
+        data = encoding.MSGPACK.encode(msg)
+        self.assertEqual(encoding.unpack(data),
+                         ["video-source-added", "channel", ["address", 42]])
+        msg2 = encoding.MSGPACK.decode(data)
+        self.assertIsInstance(msg2, messages.VideoSourceAdded)
+        self.assertEqual(msg2.channel, "channel")
+        self.assertEqual(msg2.remote_addr, ("address", 42))
+
+    def test_msgpack_smaller_than_json(self):
+        msg = messages.VideoMixStatus("picture-in-picture", "a", "b")
+        self.assertLess(len(encoding.MSGPACK.encode(msg)),
+                        len(encoding.JSON.encode(msg)))
+
+    def test_msgpack_wrong_field_count(self):
+        with self.assertRaises(encoding.EncodingError):
+            encoding.MSGPACK.decode(encoding.pack(["set-audio-source"]))
+
+    def test_choose_encoding(self):
+        self.assertIs(encoding.choose_encoding(["cbor", "msgpack", "json"]),
+                      encoding.MSGPACK)
+        self.assertIs(encoding.choose_encoding(["json"]), encoding.JSON)
+        self.assertIs(encoding.choose_encoding(["cbor"]), None)
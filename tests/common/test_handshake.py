@@ -0,0 +1,56 @@
+import asyncio
+import socket
+import unittest
+
+from videowhisk.common import handshake
+
+
+class HandshakeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.sock, self.peer = socket.socketpair()
+        self.addCleanup(self.sock.close)
+        self.addCleanup(self.peer.close)
+        self.sock.setblocking(False)
+
+    def read(self):
+        return self.loop.run_until_complete(
+            handshake.read(self.loop, self.sock))
+
+    def test_read_handshake(self):
+        self.peer.sendall(handshake.encode({"session": "abc"}) + b"data")
+        self.assertEqual(self.read(), {"session": "abc"})
+        self.assertEqual(self.sock.recv(100), b"data")
+
+    def test_no_handshake(self):
+        # A Matroska stream starts with the EBML magic number
+        self.peer.sendall(b"\x1a\x45\xdf\xa3data")
+        self.assertEqual(self.read(), None)
+        # Nothing was consumed from the stream
+        self.assertEqual(self.sock.recv(100), b"\x1a\x45\xdf\xa3data")
+
+    def test_partial_magic(self):
+        self.peer.sendall(handshake.MAGIC[:2])
+        self.loop.call_later(0.05, self.peer.sendall,
+                             handshake.encode({})[2:])
+        self.assertEqual(self.read(), {})
+
+    def test_connection_closed(self):
+        self.peer.close()
+        self.assertEqual(self.read(), None)
+
+    def test_truncated_handshake(self):
+        self.peer.sendall(handshake.encode({"session": "abc"})[:-2])
+        self.peer.close()
+        with self.assertRaises(handshake.HandshakeError):
+            self.read()
+
+    def test_bad_handshake(self):
+        self.peer.sendall(handshake.MAGIC + b"\x00\x00\x00\x02[]")
+        with self.assertRaises(handshake.HandshakeError):
+            self.read()
+        self.peer.sendall(handshake.MAGIC + b"\xff\xff\xff\xff")
+        with self.assertRaises(handshake.HandshakeError):
+            self.read()
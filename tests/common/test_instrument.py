@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+
+from videowhisk.common import instrument
+
+
+class InstrumentTests(unittest.TestCase):
+
+    def setUp(self):
+        instrument.enable()
+        self.addCleanup(setattr, instrument, "_enabled", False)
+        self.addCleanup(instrument._histograms.clear)
+
+    def test_histogram(self):
+        hist = instrument.Histogram()
+        hist.add(0.5e-6)
+        hist.add(3e-6)
+        hist.add(10)
+        summary = hist.summary()
+        self.assertEqual(summary["count"], 3)
+        self.assertEqual(summary["max_us"], 10e6)
+        self.assertEqual(summary["buckets"], [[1, 1], [4, 1], [None, 1]])
+
+    def test_timed(self):
+        @instrument.timed
+        def callback(value):
+            return value * 2
+        self.assertEqual(callback(21), 42)
+        self.assertEqual(callback(1), 2)
+        report = instrument.report()
+        name = callback.__qualname__
+        self.assertEqual(report[name]["count"], 2)
+
+    def test_timed_disabled(self):
+        instrument._enabled = False
+        def callback():
+            pass
+        self.assertIs(instrument.timed(callback), callback)
+        self.assertIsNone(instrument.report())
+
+    def test_timed_consumer(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        async def consumer(queue):
+            total = 0
+            while True:
+                value = await queue.get()
+                if value is None:
+                    return total
+                total += value
+                queue.task_done()
+
+        queue = asyncio.Queue()
+        for value in [1, 2, 3, None]:
+            queue.put_nowait(value)
+        result = loop.run_until_complete(
+            instrument.timed_consumer("consumer", consumer, queue))
+        self.assertEqual(result, 6)
+        self.assertEqual(instrument.report()["consumer"]["count"], 3)
+
+        # Messages are counted once handled, and cancelling works
+        queue = asyncio.Queue()
+        task = loop.create_task(
+            instrument.timed_consumer("waiting", consumer, queue))
+        loop.run_until_complete(asyncio.sleep(0))
+        queue.put_nowait(1)
+        loop.run_until_complete(queue.join())
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            loop.run_until_complete(task)
+        self.assertEqual(instrument.report()["waiting"]["count"], 1)
@@ -5,6 +5,28 @@ from videowhisk.common import messages
 
 class MessagesTest(unittest.TestCase):
 
+    def test_negotiate(self):
+        msg = messages.Negotiate(["msgpack", "json"])
+        self.assertEqual(msg.encodings, ["msgpack", "json"])
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.Negotiate)
+        self.assertEqual(msg2.encodings, ["msgpack", "json"])
+
+    def test_subscribe(self):
+        msg = messages.Subscribe(["video-mix-status"], ["channel"])
+        self.assertEqual(msg.message_types, ["video-mix-status"])
+        self.assertEqual(msg.channels, ["channel"])
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.Subscribe)
+        self.assertEqual(msg2.message_types, ["video-mix-status"])
+        self.assertEqual(msg2.channels, ["channel"])
+
+        msg = messages.deserialise(messages.Subscribe().serialise())
+        self.assertEqual(msg.message_types, None)
+        self.assertEqual(msg.channels, None)
+
     def test_mixer_config(self):
         msg = messages.MixerConfig(
             ("control", 42), ("clock", 43), ("avsource", 44),
@@ -64,6 +86,50 @@ class MessagesTest(unittest.TestCase):
         self.assertEqual(msg2.active_source, "active")
         self.assertEqual(msg2.volumes, {"source1": 1.0, "source2": 0.0})
 
+    def test_audio_mix_status_delta(self):
+        msg = messages.AudioMixStatusDelta(
+            "active", {"source1": 0.5}, ["source2"])
+        self.assertEqual(msg.active_source, "active")
+        self.assertEqual(msg.volumes, {"source1": 0.5})
+        self.assertEqual(msg.removed, ["source2"])
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.AudioMixStatusDelta)
+        self.assertEqual(msg2.active_source, "active")
+        self.assertEqual(msg2.volumes, {"source1": 0.5})
+        self.assertEqual(msg2.removed, ["source2"])
+
+    def test_audio_mix_status_apply_delta(self):
+        status = messages.AudioMixStatus(
+            "source2", {"source1": 1.0, "source2": 0.0})
+        status2 = status.apply_delta(messages.AudioMixStatusDelta(
+            "source1", {"source1": 0.5, "source3": 1.0}, ["source2"]))
+        self.assertEqual(status2.active_source, "source1")
+        self.assertEqual(status2.volumes, {"source1": 0.5, "source3": 1.0})
+        # The original status is unchanged
+        self.assertEqual(status.volumes, {"source1": 1.0, "source2": 0.0})
+
+    def test_audio_levels(self):
+        msg = messages.AudioLevels({"source1": [-20.0, -21.0]},
+                                   {"source1": [-6.0, -7.0]})
+        self.assertEqual(msg.rms, {"source1": [-20.0, -21.0]})
+        self.assertEqual(msg.peak, {"source1": [-6.0, -7.0]})
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.AudioLevels)
+        self.assertEqual(msg2.rms, {"source1": [-20.0, -21.0]})
+        self.assertEqual(msg2.peak, {"source1": [-6.0, -7.0]})
+
+    def test_set_audio_volume(self):
+        msg = messages.SetAudioVolume("channel", 0.5)
+        self.assertEqual(msg.channel, "channel")
+        self.assertEqual(msg.volume, 0.5)
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.SetAudioVolume)
+        self.assertEqual(msg2.channel, "channel")
+        self.assertEqual(msg2.volume, 0.5)
+
     def test_set_audio_source(self):
         msg = messages.SetAudioSource("active")
         self.assertEqual(msg.active_source, "active")
@@ -83,6 +149,34 @@ class MessagesTest(unittest.TestCase):
         self.assertEqual(msg2.composite_mode, "mode")
         self.assertEqual(msg2.source_a, "a")
         self.assertEqual(msg2.source_b, "b")
+        self.assertEqual(msg2.slots, {"a": "a", "b": "b"})
+        self.assertEqual(msg2.switch_time, None)
+
+    def test_video_mix_status_switch_time(self):
+        msg = messages.VideoMixStatus("mode", "a", "b", None, 1000000000)
+        msg2 = messages.deserialise(msg.serialise())
+        self.assertEqual(msg2.switch_time, 1000000000)
+
+    def test_video_mix_status_slots(self):
+        msg = messages.VideoMixStatus(
+            "quad", "a", None, {"a": "a", "b": None, "c": "c", "d": None})
+        self.assertEqual(msg.slots, {"a": "a", "b": None, "c": "c", "d": None})
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertEqual(msg2.source_a, "a")
+        self.assertEqual(msg2.source_b, None)
+        self.assertEqual(msg2.slots,
+                         {"a": "a", "b": None, "c": "c", "d": None})
+
+    def test_set_video_layout(self):
+        msg = messages.SetVideoLayout("quad", {"a": "source1", "c": None})
+        self.assertEqual(msg.composite_mode, "quad")
+        self.assertEqual(msg.slots, {"a": "source1", "c": None})
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.SetVideoLayout)
+        self.assertEqual(msg2.composite_mode, "quad")
+        self.assertEqual(msg2.slots, {"a": "source1", "c": None})
 
     def test_set_video_source(self):
         msg = messages.SetVideoSource("mode", "a", "b")
@@ -95,3 +189,59 @@ class MessagesTest(unittest.TestCase):
         self.assertEqual(msg2.composite_mode, "mode")
         self.assertEqual(msg2.source_a, "a")
         self.assertEqual(msg2.source_b, "b")
+        self.assertEqual(msg2.transition, "cut")
+        self.assertEqual(msg2.duration, 0)
+
+    def test_set_video_source_transition(self):
+        msg = messages.SetVideoSource("mode", "a", "b", "fade", 500)
+        msg2 = messages.deserialise(msg.serialise())
+        self.assertEqual(msg2.transition, "fade")
+        self.assertEqual(msg2.duration, 500)
+
+    def test_reload_config(self):
+        msg = messages.ReloadConfig()
+        data = msg.serialise()
+        self.assertEqual(data, {"type": "reload-config"})
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.ReloadConfig)
+
+    def test_clock_stats(self):
+        msg = messages.ClockStats(("127.0.0.1", 4242), True, 350000,
+                                  -1000, 2000, 1.0)
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.ClockStats)
+        self.assertEqual(msg2.remote_addr, ("127.0.0.1", 4242))
+        self.assertEqual(msg2.synced, True)
+        self.assertEqual(msg2.rtt, 350000)
+        self.assertEqual(msg2.offset, -1000)
+        self.assertEqual(msg2.discontinuity, 2000)
+        self.assertEqual(msg2.rate, 1.0)
+
+    def test_frame_stats(self):
+        channels = {
+            "c0.video_0.mix": dict(kind="video", frames=300, repeated=2,
+                                   dropped=1, gaps=0),
+            "audiomix.output": dict(kind="audio", duration=10000000000,
+                                    underrun=20000000, overrun=0),
+        }
+        msg = messages.FrameStats(channels)
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.FrameStats)
+        self.assertEqual(msg2.channels, channels)
+
+    def test_source_stats(self):
+        streams = {"c0.video_0": dict(buffers=300, rate=30.0)}
+        msg = messages.SourceStats("c0", ("127.0.0.1", 4242), 1000000,
+                                   250000.0, streams, 1500000, None)
+        data = msg.serialise()
+        msg2 = messages.deserialise(data)
+        self.assertIsInstance(msg2, messages.SourceStats)
+        self.assertEqual(msg2.name, "c0")
+        self.assertEqual(msg2.remote_addr, ("127.0.0.1", 4242))
+        self.assertEqual(msg2.bytes, 1000000)
+        self.assertEqual(msg2.byte_rate, 250000.0)
+        self.assertEqual(msg2.streams, streams)
+        self.assertEqual(msg2.rtt, 1500000)
+        self.assertEqual(msg2.out_of_order, None)
@@ -1,7 +1,7 @@
 import asyncio
 import unittest
 
-from videowhisk.common import messages, protocol
+from videowhisk.common import encoding, messages, protocol
 
 
 class TestClientProtocol(protocol.ControlProtocol):
@@ -28,6 +28,21 @@ class TestServerProtocol(protocol.ControlProtocol):
         self.transport.close()
 
 
+class NegotiatingClientProtocol(TestClientProtocol):
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.request_encoding()
+        self.send_message(messages.SetAudioSource("active"))
+
+
+class EchoServerProtocol(protocol.ControlProtocol):
+
+    def message_received(self, msg):
+        self.send_message(msg)
+        self.transport.close()
+
+
 class ProtocolTests(unittest.TestCase):
 
     def setUp(self):
@@ -62,3 +77,48 @@ class ProtocolTests(unittest.TestCase):
 
         server.close()
         self.loop.run_until_complete(server.wait_closed())
+
+    def test_negotiate_encoding(self):
+        server_protocols = []
+        def make_server_protocol():
+            p = EchoServerProtocol()
+            server_protocols.append(p)
+            return p
+        server = self.loop.run_until_complete(self.loop.create_server(
+            make_server_protocol, "127.0.0.1", 0))
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+
+        async def client():
+            transport, protocol = await self.loop.create_connection(
+                lambda: NegotiatingClientProtocol(self.loop.create_future()),
+                '127.0.0.1', port)
+            await protocol.disconnect_future
+            return protocol
+
+        protocol = self.loop.run_until_complete(client())
+        self.assertIs(server_protocols[0].encoding, encoding.MSGPACK)
+        self.assertIs(protocol.encoding, encoding.MSGPACK)
+        # The Negotiate reply is consumed by the protocol
+        self.assertEqual(len(protocol.received_messages), 1)
+        self.assertIsInstance(protocol.received_messages[0],
+                              messages.SetAudioSource)
+        self.assertEqual(protocol.received_messages[0].active_source,
+                         "active")
+
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+
+    def test_msgpack_length_flag(self):
+        p = protocol.ControlProtocol()
+        msg = messages.SetAudioSource("active")
+        self.assertEqual(p.encode_message(msg)[0] & 0x80, 0)
+        p.encoding = encoding.MSGPACK
+        data = p.encode_message(msg)
+        self.assertEqual(data[0] & 0x80, 0x80)
+
+        received = []
+        p.message_received = received.append
+        p.data_received(data)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].active_source, "active")
@@ -0,0 +1,39 @@
+import socket
+import struct
+import unittest
+
+from videowhisk.common import tcpinfo
+
+
+class TcpInfoTests(unittest.TestCase):
+
+    def test_parse(self):
+        data = bytearray(232)
+        struct.pack_into("=I", data, 68, 1500)
+        struct.pack_into("=I", data, 92, 2500)
+        struct.pack_into("=I", data, 100, 7)
+        struct.pack_into("=Q", data, 128, 123456789)
+        struct.pack_into("=I", data, 224, 3)
+        info = tcpinfo.parse(bytes(data))
+        self.assertEqual(info["rtt"], 1500)
+        self.assertEqual(info["rcv_rtt"], 2500)
+        self.assertEqual(info["total_retrans"], 7)
+        self.assertEqual(info["bytes_received"], 123456789)
+        self.assertEqual(info["rcv_ooopack"], 3)
+
+    def test_parse_short(self):
+        # Older kernels return fewer fields
+        info = tcpinfo.parse(bytes(104))
+        self.assertEqual(info["total_retrans"], 0)
+        self.assertNotIn("bytes_received", info)
+        self.assertNotIn("rcv_ooopack", info)
+
+    @unittest.skipUnless(hasattr(socket, "TCP_INFO"), "needs TCP_INFO")
+    def test_read(self):
+        with socket.socket() as listener:
+            listener.bind(("127.0.0.1", 0))
+            listener.listen(1)
+            with socket.create_connection(listener.getsockname()) as sock:
+                info = tcpinfo.read(sock)
+        self.assertIn("rtt", info)
+        self.assertIsNone(tcpinfo.read(sock))
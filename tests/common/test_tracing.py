@@ -0,0 +1,64 @@
+import os
+import unittest
+from unittest import mock
+
+from gi.repository import Gst
+
+from videowhisk.common import tracing
+
+
+class TracingTests(unittest.TestCase):
+
+    def test_split_tracers(self):
+        self.assertEqual(
+            tracing._split_tracers(
+                "latency(flags=pipeline+element), proctime,queuelevel"),
+            ["latency(flags=pipeline+element)", "proctime", "queuelevel"])
+
+    def test_parse_known_args(self):
+        self.assertEqual(tracing.parse_known_args(["--host", "foo"]), None)
+        self.assertEqual(tracing.parse_known_args(["--trace=proctime"]),
+                         "proctime")
+        self.assertEqual(tracing.parse_known_args(["--trace"]),
+                         ",".join(tracing.DEFAULT_TRACERS))
+
+    def test_start_needs_enable(self):
+        # Tracers set up outside enable() don't get a log function
+        with mock.patch.dict(os.environ, GST_TRACERS="proctime"):
+            tracing.start()
+        self.assertIsNone(tracing._collector)
+        self.assertIsNone(tracing.report())
+        tracing.stop()
+
+    def add_record(self, collector, record):
+        structure, _ = Gst.Structure.from_string(record)
+        collector.add_record(structure)
+
+    def test_collector(self):
+        collector = tracing.TraceCollector()
+        self.add_record(collector, "proctime, element=(string)queue0, "
+                        "time=(string)0:00:00.000002000;")
+        self.add_record(collector, "proctime, element=(string)queue0, "
+                        "time=(string)0:00:00.000004000;")
+        self.add_record(collector, "latency, src-element-id=(string)0x1, "
+                        "src-element=(string)src0, src=(string)src, "
+                        "sink-element-id=(string)0x2, "
+                        "sink-element=(string)sink0, sink=(string)sink, "
+                        "time=(guint64)5000, ts=(guint64)1;")
+        self.add_record(collector, "queuelevel, queue=(string)queue0, "
+                        "size_buffers=(uint)3, max_size_buffers=(uint)200;")
+        stats = collector.snapshot()
+        self.assertEqual(stats["queue0"]["proctime"]["time"],
+                         dict(count=2, mean=3000, max=4000, last=4000))
+        self.assertEqual(stats["queue0"]["queuelevel"]["size_buffers"],
+                         dict(count=1, mean=3, max=3, last=3))
+        self.assertEqual(
+            list(stats["src0"]["latency -> sink0"].keys()), ["time"])
+
+    def test_match_element(self):
+        elements = {"queue1": None, "queue10": None}
+        self.assertEqual(tracing._match_element("queue10_src", elements),
+                         "queue10")
+        self.assertEqual(tracing._match_element("queue1.src", elements),
+                         "queue1")
+        self.assertEqual(tracing._match_element("tee0_src", elements), None)
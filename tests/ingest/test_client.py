@@ -23,3 +23,17 @@ class ClientTests(unittest.TestCase):
         self.assertEqual(args.video_test, ["smpte"])
         self.assertEqual(args.audio, ["default"])
         self.assertEqual(args.audio_test, ["white-noise"])
+
+    def test_parse_names(self):
+        cli = client.Client(None)
+
+        args = cli.parse_args(["ingest"])
+        self.assertEqual(args.name, None)
+        self.assertEqual(args.label, [])
+
+        args = cli.parse_args(["ingest", "--name", "stage",
+                               "--label", "video_0=wide",
+                               "--label=audio_0=lectern"])
+        self.assertEqual(args.name, "stage")
+        self.assertEqual(args.label, [("video_0", "wide"),
+                                      ("audio_0", "lectern")])
@@ -1,7 +1,11 @@
+import asyncio
+import socket
+import types
 import unittest
 
 from gi.repository import Gst
 
+from videowhisk.common import messages
 from videowhisk.ingest import pipeline
 
 
@@ -50,3 +54,51 @@ image/jpeg, width=(int)320, height=(int)180, pixel-aspect-ratio=(fraction)1/1, f
         """)
         caps = pipeline.choose_video_caps(source_caps, target_caps)
         self.assertEqual(caps.to_string(), "video/x-raw, interlace-mode=(string)progressive, format=(string)YUY2, width=(int)1280, height=(int)720, pixel-aspect-ratio=(fraction)1/1, framerate=(fraction)10/1")
+
+    def test_element_labels(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        sock, peer = socket.socketpair()
+        self.addCleanup(sock.close)
+        self.addCleanup(peer.close)
+        cfg = types.SimpleNamespace(
+            video_caps="video/x-raw,width=320,height=180,framerate=30/1",
+            audio_caps="audio/x-raw,format=S16LE,channels=2,rate=48000")
+        ingest = pipeline.IngestPipeline(loop)
+        ingest.make_pipeline(cfg, sock, Gst.SystemClock.obtain(),
+                             labels={"video_0": "wide"},
+                             video_test=["smpte"], audio_test=["sine"])
+        try:
+            labels = ingest.element_channels()
+            self.assertEqual(sorted(set(labels.values())),
+                             ["audio_0", "wide"])
+            self.assertEqual(len(labels), 4)
+        finally:
+            ingest.destroy_pipeline()
+
+    def test_expected_channels(self):
+        self.assertEqual(
+            pipeline.expected_channels("cam", None, 1, 2),
+            {"cam.video_0", "cam.audio_0", "cam.audio_1"})
+        self.assertEqual(
+            pipeline.expected_channels(
+                "cam", {"video_0": "wide", "audio_0": "mic"}, 2, 1),
+            {"cam.wide", "cam.video_1", "cam.mic"})
+
+    def test_format_source_stats(self):
+        msg = messages.SourceStats(
+            "c0", ("127.0.0.1", 4242), 1000000, 250000.0,
+            {"c0.video_0": dict(buffers=300, rate=30.0)}, 1500000, 2)
+        self.assertEqual(
+            pipeline.format_source_stats(
+                msg, {"rtt": 1500, "total_retrans": 4}),
+            "Server receiving 250 kB/s (c0.video_0 30.0/s), rtt 1.5 ms, "
+            "4 retransmits, 2 out of order at server")
+        self.assertEqual(
+            pipeline.format_source_stats(msg, None),
+            "Server receiving 250 kB/s (c0.video_0 30.0/s), "
+            "2 out of order at server")
+        msg.streams = {}
+        msg.out_of_order = 0
+        self.assertEqual(pipeline.format_source_stats(msg, None),
+                         "Server receiving 250 kB/s")
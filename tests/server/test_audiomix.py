@@ -18,6 +18,7 @@ class AudioMixTests(unittest.TestCase):
         self.config = config.Config()
         self.bus = messagebus.MessageBus(self.loop)
         self.amix = audiomix.AudioMix(self.config, self.bus, self.loop)
+        self.loop.run_until_complete(self.amix.start())
 
     def tearDown(self):
         self.loop.run_until_complete(self.amix.close())
@@ -41,13 +42,16 @@ class AudioMixTests(unittest.TestCase):
                 message = await queue.get()
                 future.set_result(message)
                 queue.task_done()
-        self.bus.add_consumer(messages.AudioMixStatus, consumer)
+        self.bus.add_consumer(messages.AudioMixStatusDelta, consumer)
 
         self.make_audio_source()
         self.loop.run_until_complete(future)
         message = future.result()
         self.assertEqual(message.active_source, None)
         self.assertEqual(message.volumes, {"source.audio": 1.0})
+        self.assertEqual(message.removed, [])
+        self.assertEqual(self.amix.make_audio_mix_status().volumes,
+                         {"source.audio": 1.0})
 
         future = self.loop.create_future()
         self.loop.create_task(self.bus.post(messages.AudioSourceRemoved("source.audio", "127.0.0.1")))
@@ -55,6 +59,8 @@ class AudioMixTests(unittest.TestCase):
         message = future.result()
         self.assertEqual(message.active_source, None)
         self.assertEqual(message.volumes, {})
+        self.assertEqual(message.removed, ["source.audio"])
+        self.assertEqual(self.amix.make_audio_mix_status().volumes, {})
 
     def test_set_audio_source(self):
         future = self.loop.create_future()
@@ -63,7 +69,7 @@ class AudioMixTests(unittest.TestCase):
                 message = await queue.get()
                 future.set_result(message)
                 queue.task_done()
-        self.bus.add_consumer(messages.AudioMixStatus, consumer)
+        self.bus.add_consumer(messages.AudioMixStatusDelta, consumer)
 
         # Create sources
         self.make_audio_source("source.audio1")
@@ -96,3 +102,102 @@ class AudioMixTests(unittest.TestCase):
         self.assertEqual(message.active_source, None)
         self.assertEqual(self.amix._sources["source.audio1"].mute, True)
         self.assertEqual(self.amix._sources["source.audio2"].mute, True)
+
+    def test_set_audio_volume(self):
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                future.set_result(message)
+                queue.task_done()
+        self.bus.add_consumer(messages.AudioMixStatusDelta, consumer)
+
+        self.make_audio_source("source.audio1")
+        self.loop.run_until_complete(future)
+        future = self.loop.create_future()
+        self.make_audio_source("source.audio2")
+        self.loop.run_until_complete(future)
+
+        future = self.loop.create_future()
+        self.loop.create_task(self.bus.post(
+            messages.SetAudioVolume("source.audio2", 0.5)))
+        self.loop.run_until_complete(future)
+        message = future.result()
+        # Only the changed source is included in the delta
+        self.assertEqual(message.volumes, {"source.audio2": 0.5})
+        self.assertEqual(message.removed, [])
+        self.assertEqual(self.amix._sources["source.audio2"].volume, 0.5)
+        self.assertEqual(
+            self.amix._sources["source.audio2"]._sink_pad.props.volume, 0.5)
+        self.assertEqual(self.amix.make_audio_mix_status().volumes,
+                         {"source.audio1": 1.0, "source.audio2": 0.5})
+
+        # Invalid volumes are ignored, and the mixer carries on
+        future = self.loop.create_future()
+        for volume in ["loud", None, -1, 11]:
+            self.loop.create_task(self.bus.post(
+                messages.SetAudioVolume("source.audio2", volume)))
+        self.loop.create_task(self.bus.post(
+            messages.SetAudioVolume("source.audio1", 2.0)))
+        self.loop.run_until_complete(future)
+        self.assertEqual(future.result().volumes, {"source.audio1": 2.0})
+        self.assertEqual(self.amix._sources["source.audio2"].volume, 0.5)
+
+    def test_valid_volume(self):
+        self.assertTrue(audiomix.valid_volume(0))
+        self.assertTrue(audiomix.valid_volume(1.5))
+        self.assertTrue(audiomix.valid_volume(10))
+        self.assertFalse(audiomix.valid_volume(10.5))
+        self.assertFalse(audiomix.valid_volume(-0.1))
+        self.assertFalse(audiomix.valid_volume(float("nan")))
+        self.assertFalse(audiomix.valid_volume(True))
+        self.assertFalse(audiomix.valid_volume("1"))
+        self.assertFalse(audiomix.valid_volume(None))
+
+    def test_full_status_interval(self):
+        received = []
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                received.append(message)
+                if isinstance(message, messages.AudioMixStatus):
+                    future.set_result(None)
+                queue.task_done()
+        self.bus.add_consumer((messages.AudioMixStatus,
+                               messages.AudioMixStatusDelta), consumer)
+
+        self.make_audio_source("source.audio")
+        async def post_messages():
+            for i in range(audiomix.FULL_STATUS_INTERVAL):
+                await self.bus.post(messages.SetAudioVolume(
+                    "source.audio", i / 100))
+        self.loop.create_task(post_messages())
+        self.loop.run_until_complete(future)
+
+        self.assertEqual(len(received), audiomix.FULL_STATUS_INTERVAL + 1)
+        for message in received[:-1]:
+            self.assertIsInstance(message, messages.AudioMixStatusDelta)
+        self.assertEqual(received[-1].volumes,
+                         {"source.audio": (audiomix.FULL_STATUS_INTERVAL - 1) / 100})
+
+    def test_audio_levels(self):
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                if ("source.audio" in message.rms and
+                        audiomix.OUTPUT_LEVEL in message.rms and
+                        not future.done()):
+                    future.set_result(message)
+                queue.task_done()
+        self.bus.add_consumer(messages.AudioLevels, consumer)
+
+        self.make_audio_source()
+        self.loop.run_until_complete(future)
+        message = future.result()
+        # One level per audio channel
+        self.assertEqual(len(message.rms["source.audio"]), 2)
+        self.assertEqual(len(message.peak["source.audio"]), 2)
+        self.assertGreater(message.peak["source.audio"][0], audiomix.MIN_LEVEL)
+        self.assertEqual(len(message.rms[audiomix.OUTPUT_LEVEL]), 2)
@@ -23,6 +23,7 @@ host = 127.0.0.1
         self.bus = messagebus.MessageBus(self.loop)
         self.server = avoutput.AVOutputServer(
             self.config, self.bus, self.loop)
+        self.loop.run_until_complete(self.server.start())
 
     def tearDown(self):
         self.loop.run_until_complete(self.server.close())
@@ -80,3 +81,69 @@ host = 127.0.0.1
         self.loop.run_until_complete(make_request())
         self.assertEqual(headers["Content-Type"], "video/x-matroska")
         self.assertEqual(body[:4], b"\x1A\x45\xDF\xA3")
+
+    def test_client_stats(self):
+        self.make_video_source()
+        stats = None
+        async def make_request():
+            nonlocal stats
+            async with aiohttp.ClientSession() as session:
+                url = "http://127.0.0.1:{}/source.video".format(
+                    self.server.local_port())
+                async with session.get(url) as response:
+                    await response.content.read(100)
+                    monitor = self.server.get_monitor("source.video")
+                    stats = monitor.get_all_client_stats()
+        self.loop.run_until_complete(make_request())
+        self.assertEqual(len(stats), 1)
+        self.assertGreater(stats[0].bytes_sent, 0)
+        self.assertEqual(stats[0].dropped_buffers, 0)
+        self.assertIsNotNone(stats[0].bytes_queued)
+
+    def test_metrics(self):
+        self.loop.run_until_complete(self.server.close())
+        self.server = avoutput.AVOutputServer(
+            self.config, self.bus, self.loop,
+            lambda: {"tracers": None, "answer": 42})
+        headers = None
+        body = None
+        async def make_request():
+            nonlocal headers, body
+            async with aiohttp.ClientSession() as session:
+                url = "http://127.0.0.1:{}/metrics".format(
+                    self.server.local_port())
+                async with session.get(url) as response:
+                    headers = response.headers
+                    body = await response.json()
+        self.loop.run_until_complete(make_request())
+        self.assertEqual(headers["Content-Type"], "application/json")
+        self.assertEqual(body, {"tracers": None, "answer": 42})
+
+    def test_pipelines(self):
+        self.make_video_source()
+        snapshot = graph = None
+        async def make_request():
+            nonlocal snapshot, graph
+            # Wait for the monitor to be created
+            await self.bus._post_queue.join()
+            async with aiohttp.ClientSession() as session:
+                url = "http://127.0.0.1:{}/pipelines".format(
+                    self.server.local_port())
+                async with session.get(url) as response:
+                    snapshot = await response.json()
+                url = "http://127.0.0.1:{}/pipelines/monitor.output.dot".format(
+                    self.server.local_port())
+                async with session.get(url) as response:
+                    graph = await response.text()
+        self.loop.run_until_complete(make_request())
+        self.assertIn("monitor.output", snapshot)
+        self.assertIn("monitor.source.video", snapshot)
+        monitor = snapshot["monitor.source.video"]
+        factories = [el["factory"] for el in monitor["elements"]]
+        self.assertIn("intervideosrc", factories)
+        self.assertIn("multifdsink", factories)
+        for el in monitor["elements"]:
+            self.assertEqual(el["channel"], "source.video")
+            if el["factory"] == "queue":
+                self.assertIn("current-level-buffers", el["queue"])
+        self.assertTrue(graph.startswith("digraph"))
@@ -1,11 +1,12 @@
 import asyncio
 import signal
+import socket
 import unittest
 
 import asyncio_glib
 from gi.repository import Gst
 
-from videowhisk.common import messages
+from videowhisk.common import handshake, messages
 from videowhisk.server import avsource, config, messagebus
 
 class AVSourceTests(unittest.TestCase):
@@ -169,6 +170,201 @@ host = 127.0.0.1
         self.assertIsInstance(received[1], messages.VideoSourceRemoved)
         self.assertEqual(received[1].channel, "c0.video_0")
 
+    def test_convert_sources(self):
+        self.loop.run_until_complete(self.server.close())
+        self.config.read_string("""
+[server]
+convert_sources = 1
+""")
+        self.server = avsource.AVSourceServer(
+            self.config, self.bus, self.loop)
+
+        received = []
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                received.append(message)
+                if len(received) == 2:
+                    future.set_result(None)
+                queue.task_done()
+        self.bus.add_consumer(messages.SourceMessage, consumer)
+
+        # The audio matches the mixer caps, while the video is converted
+        sender = self.make_sender("""
+            audiotestsrc freq=440 ! {} ! mux.
+            videotestsrc !
+                video/x-raw,format=I420,width=640,height=360,framerate=15/1 !
+                mux.
+        """.format(self.config.audio_caps.to_string()))
+        sender.set_state(Gst.State.PLAYING)
+        self.loop.run_until_complete(future)
+        self.assertIsInstance(received[0], messages.AudioSourceAdded)
+        self.assertIsInstance(received[1], messages.VideoSourceAdded)
+        self.assertEqual(received[1].channel, "c0.video_0")
+        converted = self.server.converted_sources()
+        self.assertEqual(list(converted.keys()), ["c0.video_0"])
+        self.assertIn("width=(int)640", converted["c0.video_0"])
+        self.assertFalse(self.server.acquire_converter())
+
+        # Closing the connection frees the converter
+        received.clear()
+        future = self.loop.create_future()
+        sender.set_state(Gst.State.NULL)
+        self.loop.run_until_complete(future)
+        self.assertEqual(self.server.converted_sources(), {})
+        self.assertTrue(self.server.acquire_converter())
+        self.server.release_converter()
+
+    def make_session_sender(self, source, session, **header):
+        sock = socket.create_connection(
+            ("127.0.0.1", self.server.local_port()))
+        self.addCleanup(sock.close)
+        header["session"] = session
+        sock.sendall(handshake.encode(header))
+        pipeline = Gst.parse_launch("""
+            {}
+            matroskamux name=mux !
+            fdsink fd={}
+        """.format(source, sock.fileno()))
+        self.addCleanup(pipeline.set_state, Gst.State.NULL)
+        return sock, pipeline
+
+    def test_resume_session(self):
+        received = []
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                received.append(message)
+                if not future.done():
+                    future.set_result(None)
+                queue.task_done()
+        self.bus.add_consumer(messages.SourceMessage, consumer)
+
+        source = "videotestsrc ! {} ! mux.".format(
+            self.config.video_caps.to_string())
+        sock, sender = self.make_session_sender(source, "token")
+        sender.set_state(Gst.State.PLAYING)
+        self.loop.run_until_complete(future)
+        self.assertEqual(len(received), 1)
+        self.assertIsInstance(received[0], messages.VideoSourceAdded)
+        self.assertEqual(received[0].channel, "c0.video_0")
+
+        # Drop the connection, and reconnect with the same session
+        sender.set_state(Gst.State.NULL)
+        sock.close()
+        sock, sender = self.make_session_sender(source, "token")
+        sender.set_state(Gst.State.PLAYING)
+        self.loop.run_until_complete(asyncio.sleep(1.0))
+        self.assertEqual(len(received), 1)
+        msgs = self.server.make_source_messages()
+        self.assertEqual(len(msgs), 1)
+        self.assertEqual(msgs[0].channel, "c0.video_0")
+
+        # Without a reconnect, the channel is removed after the
+        # grace period
+        future = self.loop.create_future()
+        sender.set_state(Gst.State.NULL)
+        sock.close()
+        self.loop.run_until_complete(future)
+        self.assertEqual(len(received), 2)
+        self.assertIsInstance(received[1], messages.VideoSourceRemoved)
+        self.assertEqual(received[1].channel, "c0.video_0")
+        self.assertEqual(self.server.make_source_messages(), [])
+
+    def test_named_sources(self):
+        received = []
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                received.append(message)
+                if len(received) == 2:
+                    future.set_result(None)
+                queue.task_done()
+        self.bus.add_consumer(messages.SourceMessage, consumer)
+
+        source = """
+            audiotestsrc freq=440 ! {} ! mux.
+            videotestsrc ! {} ! mux.
+        """.format(self.config.audio_caps.to_string(),
+                   self.config.video_caps.to_string())
+        sock, sender = self.make_session_sender(
+            source, "token", name="stage", streams={"video_0": "wide"})
+        sender.set_state(Gst.State.PLAYING)
+        self.loop.run_until_complete(future)
+        self.assertEqual(received[0].channel, "stage.audio_0")
+        self.assertEqual(received[1].channel, "stage.wide")
+        conn = self.server.find_connection("stage")
+        self.assertIsNotNone(conn)
+        self.assertIs(self.server.find_source("stage.wide"), conn)
+        self.assertIs(self.server.find_source("stage.audio_0"), conn)
+        self.assertIsNone(self.server.find_source("c0.video_0"))
+
+        # A second connection can not take the same name
+        sock2, sender2 = self.make_session_sender(
+            source, "other", name="stage")
+        sender2.set_state(Gst.State.PLAYING)
+        self.loop.run_until_complete(asyncio.sleep(0.5))
+        self.assertEqual(len(received), 2)
+        self.assertIs(self.server.find_connection("stage"), conn)
+
+    def test_check_names(self):
+        check = self.server._check_names
+        self.assertEqual(check({}, "c0", None), ("c0", {}))
+        self.assertEqual(
+            check({"name": "stage", "streams": {"video_0": "wide"}},
+                  "c0", None),
+            ("stage", {"video_0": "wide"}))
+        # Anonymous and pipeline names are reserved
+        for name in ["c3", "audiomix", "videomix", "ingest", "a.b", 42]:
+            with self.assertRaises(ValueError):
+                check({"name": name}, "c0", None)
+        # Labels may not clash with another stream's name
+        for streams in [{"video_0": "audio_0"},
+                        {"video_0": "audio_1", "audio_1": "mic"},
+                        {"video_0": "x", "audio_0": "x"}]:
+            with self.assertRaises(ValueError):
+                check({"streams": streams}, "c0", None)
+        self.assertEqual(check({"streams": {"video_0": "video_0"}},
+                               "c0", None), ("c0", {"video_0": "video_0"}))
+
+    def test_source_stats(self):
+        self.loop.run_until_complete(self.server.close())
+        self.config.read_string("""
+[server]
+source_stats_interval = 100
+stream_stats = yes
+""")
+        self.server = avsource.AVSourceServer(
+            self.config, self.bus, self.loop)
+
+        received = []
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                if message.streams.get("c0.video_0", {}).get("buffers"):
+                    received.append(message)
+                    if not future.done():
+                        future.set_result(None)
+                queue.task_done()
+        self.bus.add_consumer(messages.SourceStats, consumer)
+
+        sender = self.make_sender("""
+            videotestsrc ! {} ! mux.
+        """.format(self.config.video_caps.to_string()))
+        sender.set_state(Gst.State.PLAYING)
+        self.loop.run_until_complete(asyncio.wait_for(future, 10))
+        stats = received[0]
+        self.assertEqual(stats.name, "c0")
+        self.assertEqual(stats.remote_addr[0], "127.0.0.1")
+        self.assertGreater(stats.bytes, 0)
+        self.assertGreater(stats.byte_rate, 0)
+        self.assertEqual(list(stats.streams), ["c0.video_0"])
+        self.assertGreater(stats.streams["c0.video_0"]["rate"], 0)
+
     def test_get_source_messages(self):
         future = self.loop.create_future()
         async def consumer(queue):
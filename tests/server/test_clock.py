@@ -3,7 +3,8 @@ import unittest
 
 from gi.repository import Gst
 
-from videowhisk.server import clock, config
+from videowhisk.common import messages
+from videowhisk.server import clock, config, messagebus
 
 
 class ClockTests(unittest.TestCase):
@@ -26,3 +27,41 @@ host = 127.0.0.1
         server = clock.ClockServer(self.config)
         self.assertNotEqual(server.local_port(), 0)
         self.loop.run_until_complete(server.close())
+
+    def test_clock_monitor(self):
+        bus = messagebus.MessageBus(self.loop)
+        monitor = clock.ClockMonitor(bus)
+        addr = ("127.0.0.1", 4242)
+        monitor.add_stats(messages.ClockStats(
+            addr, False, 400000, 1000000, 5000, 1.0), 100.0)
+        monitor.add_stats(messages.ClockStats(
+            addr, True, 200000, 1010000, -8000, 1.0), 110.0)
+
+        quality = monitor.get_clock_quality(now=111.0)
+        self.assertEqual(list(quality.keys()), [addr])
+        q = quality[addr]
+        self.assertEqual(q.synced, True)
+        self.assertEqual(q.samples, 2)
+        self.assertEqual(q.rtt_average, 300000)
+        self.assertEqual(q.rtt_max, 400000)
+        self.assertEqual(q.offset, 1010000)
+        # 10us of drift over 10 seconds
+        self.assertAlmostEqual(q.drift_ppm, 1.0)
+        self.assertEqual(q.max_discontinuity, 8000)
+        self.assertEqual(q.age, 1.0)
+
+        # Clients that stop reporting are dropped
+        quality = monitor.get_clock_quality(
+            now=110.0 + clock.CLOCK_STATS_TIMEOUT + 1)
+        self.assertEqual(quality, {})
+
+        # Addresses that stopped reporting are forgotten as new
+        # reports arrive
+        monitor.add_stats(messages.ClockStats(
+            addr, True, 200000, 1010000, 0, 1.0), 200.0)
+        addr2 = ("127.0.0.1", 4243)
+        monitor.add_stats(messages.ClockStats(
+            addr2, True, 200000, 1010000, 0, 1.0),
+            200.0 + clock.CLOCK_STATS_TIMEOUT + 1)
+        self.assertEqual(list(monitor._history), [addr2])
+        self.loop.run_until_complete(bus.close())
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 
 from gi.repository import Gst
@@ -34,37 +36,56 @@ class ConfigTests(unittest.TestCase):
         self.assertEqual(cfg.clock_addr, ("0.0.0.0", 0))
         self.assertEqual(cfg.avsource_addr, ("0.0.0.0", 0))
         self.assertEqual(cfg.avoutput_addr, ("0.0.0.0", 0))
+        self.assertEqual(cfg.audio_level_interval, 50 * Gst.MSECOND)
+        self.assertFalse(cfg.frame_stats)
+        self.assertFalse(cfg.stream_stats)
 
         self.assertEqual(sorted(cfg.composite_modes.keys()),
-                         ["fullscreen", "picture-in-picture", "side-by-side-equal", "side-by-side-preview"])
+                         ["fullscreen", "picture-in-picture", "quad", "side-by-side-equal", "side-by-side-preview", "three-up"])
 
         fullscreen = cfg.composite_modes["fullscreen"]
-        self.assertEqual(fullscreen.a.xpos, 0)
-        self.assertEqual(fullscreen.a.width, 1920)
-        self.assertEqual(fullscreen.a.ypos, 0)
-        self.assertEqual(fullscreen.a.height, 1080)
-        self.assertEqual(fullscreen.a.alpha, 1.0)
-        self.assertEqual(fullscreen.a.zorder, 1)
-        self.assertEqual(fullscreen.b.xpos, 0)
-        self.assertEqual(fullscreen.b.width, 0)
-        self.assertEqual(fullscreen.b.ypos, 0)
-        self.assertEqual(fullscreen.b.height, 0)
-        self.assertEqual(fullscreen.b.alpha, 0.0)
-        self.assertEqual(fullscreen.a.zorder, 1)
+        self.assertEqual(fullscreen.slots["a"].xpos, 0)
+        self.assertEqual(fullscreen.slots["a"].width, 1920)
+        self.assertEqual(fullscreen.slots["a"].ypos, 0)
+        self.assertEqual(fullscreen.slots["a"].height, 1080)
+        self.assertEqual(fullscreen.slots["a"].alpha, 1.0)
+        self.assertEqual(fullscreen.slots["a"].zorder, 1)
+        self.assertEqual(fullscreen.slots["b"].xpos, 0)
+        self.assertEqual(fullscreen.slots["b"].width, 0)
+        self.assertEqual(fullscreen.slots["b"].ypos, 0)
+        self.assertEqual(fullscreen.slots["b"].height, 0)
+        self.assertEqual(fullscreen.slots["b"].alpha, 0.0)
+        self.assertEqual(fullscreen.slots["a"].zorder, 1)
 
         pip = cfg.composite_modes["picture-in-picture"]
-        self.assertEqual(pip.a.xpos, 0)
-        self.assertEqual(pip.a.width, 1920)
-        self.assertEqual(pip.a.xpos, 0)
-        self.assertEqual(pip.a.height, 1080)
-        self.assertEqual(pip.a.alpha, 1.0)
-        self.assertEqual(pip.a.zorder, 1)
-        self.assertEqual(pip.b.xpos, 1421)
-        self.assertEqual(pip.b.width, 480)
-        self.assertEqual(pip.b.ypos, 800)
-        self.assertEqual(pip.b.height, 270)
-        self.assertEqual(pip.b.alpha, 1.0)
-        self.assertEqual(pip.b.zorder, 2)
+        self.assertEqual(pip.slots["a"].xpos, 0)
+        self.assertEqual(pip.slots["a"].width, 1920)
+        self.assertEqual(pip.slots["a"].xpos, 0)
+        self.assertEqual(pip.slots["a"].height, 1080)
+        self.assertEqual(pip.slots["a"].alpha, 1.0)
+        self.assertEqual(pip.slots["a"].zorder, 1)
+        self.assertEqual(pip.slots["b"].xpos, 1421)
+        self.assertEqual(pip.slots["b"].width, 480)
+        self.assertEqual(pip.slots["b"].ypos, 800)
+        self.assertEqual(pip.slots["b"].height, 270)
+        self.assertEqual(pip.slots["b"].alpha, 1.0)
+        self.assertEqual(pip.slots["b"].zorder, 2)
+
+        quad = cfg.composite_modes["quad"]
+        self.assertEqual(list(quad.slots.keys()), ["a", "b", "c", "d"])
+        self.assertEqual(quad.slots["a"], config.CompositeInput(
+            xpos=0, width=960, ypos=0, height=540, zorder=1, alpha=1.0))
+        self.assertEqual(quad.slots["d"], config.CompositeInput(
+            xpos=960, width=960, ypos=540, height=540, zorder=1, alpha=1.0))
+
+        policy = cfg.get_monitor_policy("output")
+        self.assertEqual(policy.sync_method, 1)
+        self.assertEqual(policy.recover_policy, 3)
+        self.assertEqual(policy.units_format, Gst.Format.TIME)
+        self.assertEqual(policy.units_soft_max, 1000 * Gst.MSECOND)
+        self.assertEqual(policy.units_max, 2000 * Gst.MSECOND)
+        self.assertEqual(policy.time_min, -1)
+        self.assertEqual(policy.burst_value, 0)
 
     def test_read_string(self):
         cfg = config.Config()
@@ -82,3 +103,134 @@ control_port = 2000
         self.assertEqual(cfg.clock_addr, ("127.0.0.1", 0))
         self.assertEqual(cfg.avsource_addr, ("127.0.0.1", 0))
         self.assertEqual(cfg.avoutput_addr, ("127.0.0.1", 0))
+
+    def test_mix_settings(self):
+        cfg = config.Config()
+        self.assertTrue(cfg.mix_caps.is_equal(cfg.video_caps))
+        self.assertEqual(cfg.mix_threads, 0)
+        self.assertEqual(cfg.mix_latency, 0)
+        self.assertEqual(cfg.mix_start_time_selection, "zero")
+
+        cfg.read_string("""
+[server]
+mix_format = AYUV
+mix_threads = 4
+mix_latency = 40
+mix_start_time_selection = first
+""")
+        struct = cfg.mix_caps.get_structure(0)
+        self.assertEqual(struct.get_value("format"), "AYUV")
+        self.assertEqual(struct.get_value("width"), 1920)
+        self.assertEqual(cfg.video_caps.get_structure(0).get_value("format"),
+                         "YUY2")
+        self.assertEqual(cfg.mix_threads, 4)
+        self.assertEqual(cfg.mix_latency, 40 * Gst.MSECOND)
+        self.assertEqual(cfg.mix_start_time_selection, "first")
+
+        with self.assertRaises(ValueError):
+            cfg.read_string("""
+[server]
+mix_start_time_selection = never
+""")
+
+    def test_monitor_policy_overrides(self):
+        cfg = config.Config()
+        cfg.read_string("""
+[monitor.video]
+units_format = buffers
+units_max = 30
+units_soft_max = 10
+
+[monitor.output]
+sync_method = burst-with-keyframe
+burst_value = 500
+""")
+        default = cfg.get_monitor_policy("c0.audio_0", "audio")
+        self.assertEqual(default, cfg.monitor_policies[None])
+
+        video = cfg.get_monitor_policy("c0.video_0", "video")
+        self.assertEqual(video.units_format, Gst.Format.BUFFERS)
+        self.assertEqual(video.units_max, 30)
+        self.assertEqual(video.units_soft_max, 10)
+        self.assertEqual(video.recover_policy, default.recover_policy)
+
+        output = cfg.get_monitor_policy("output", "output")
+        self.assertEqual(output.sync_method, 5)
+        self.assertEqual(output.burst_format, Gst.Format.TIME)
+        self.assertEqual(output.burst_value, 500 * Gst.MSECOND)
+        self.assertEqual(output.units_max, default.units_max)
+
+    def test_monitor_policy_bad_enum(self):
+        cfg = config.Config()
+        with self.assertRaises(ValueError):
+            cfg.read_string("""
+[monitor]
+sync_method = whenever
+""")
+
+    def write_config(self, data):
+        fd, filename = tempfile.mkstemp(suffix=".cfg")
+        self.addCleanup(os.remove, filename)
+        with os.fdopen(fd, "w") as fp:
+            fp.write(data)
+        return filename
+
+    def test_reload(self):
+        filename = self.write_config("""
+[composite.extra]
+a.left = 0
+a.width = 50%
+a.top = 0
+a.height = 50%
+""")
+        cfg = config.Config()
+        cfg.read_file(filename)
+        cfg.read_string("""
+[server]
+host = 127.0.0.1
+""")
+        self.assertIn("extra", cfg.composite_modes)
+        self.assertEqual(cfg.reload(), set())
+
+        with open(filename, "w") as fp:
+            fp.write("""
+[composite.extra]
+a.left = 0
+a.width = 25%
+a.top = 0
+a.height = 25%
+
+[composite.quad]
+disabled = true
+""")
+        self.assertEqual(cfg.reload(), {"extra", "quad"})
+        self.assertEqual(cfg.composite_modes["extra"].slots["a"].width, 480)
+        self.assertNotIn("quad", cfg.composite_modes)
+        # Settings read from strings are kept
+        self.assertEqual(cfg.control_addr, ("127.0.0.1", 0))
+
+    def test_reload_rejects_caps_change(self):
+        filename = self.write_config("")
+        cfg = config.Config()
+        cfg.read_file(filename)
+        with open(filename, "w") as fp:
+            fp.write("""
+[server]
+video_caps = video/x-raw,format=I420,width=100,height=100,framerate=25/1,pixel-aspect-ratio=1/1,interlace-mode=progressive
+""")
+        with self.assertRaises(ValueError):
+            cfg.reload()
+        self.assertEqual(cfg.video_caps.get_structure(0).get_value("width"),
+                         1920)
+
+    def test_reload_rejects_no_composite_modes(self):
+        filename = self.write_config("")
+        cfg = config.Config()
+        cfg.read_file(filename)
+        modes = sorted(cfg.composite_modes)
+        with open(filename, "w") as fp:
+            for name in modes:
+                fp.write("[composite.{}]\ndisabled = true\n".format(name))
+        with self.assertRaises(ValueError):
+            cfg.reload()
+        self.assertEqual(sorted(cfg.composite_modes), modes)
@@ -30,7 +30,11 @@ class ControlTests(unittest.TestCase):
 [server]
 host = 127.0.0.1
 """)
-        self.server = control.ControlServer(self.config, self.bus, self.create_initial_messages, self.loop)
+        self.source_addresses = set()
+        self.server = control.ControlServer(
+            self.config, self.bus, self.create_initial_messages, self.loop,
+            self.source_addresses.__contains__)
+        self.loop.run_until_complete(self.server.start())
         self.initial_messages = []
 
     def tearDown(self):
@@ -69,6 +73,37 @@ host = 127.0.0.1
         self.assertEqual(received[0].source_a, "a")
         self.assertEqual(received[0].source_b, "b")
 
+    def test_clock_stats_need_source(self):
+        received = []
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                received.append(message)
+                future.set_result(None)
+                queue.task_done()
+        self.bus.add_consumer(messages.ClockStats, consumer)
+
+        disconnect_future = self.loop.create_future()
+        transport, protocol = self.loop.run_until_complete(
+            self.loop.create_connection(
+                lambda: TestClientProtocol(disconnect_future),
+                '127.0.0.1', self.server.local_port()))
+        self.addCleanup(transport.close)
+        self.source_addresses.add(("127.0.0.1", 4242))
+        self.source_addresses.add(("192.0.2.1", 4242))
+
+        def stats(remote_addr):
+            return messages.ClockStats(remote_addr, True, 350000, 0, 0, 1.0)
+        # Unknown sources, and sources on other hosts, are ignored
+        protocol.send_message(stats(("127.0.0.1", 4243)))
+        protocol.send_message(stats(("192.0.2.1", 4242)))
+        protocol.send_message(stats(("127.0.0.1", 4242)))
+        self.loop.run_until_complete(future)
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].remote_addr, ("127.0.0.1", 4242))
+
     def test_send_to_client(self):
         disconnect_future = self.loop.create_future()
         transport, protocol = self.loop.run_until_complete(
@@ -107,3 +142,51 @@ host = 127.0.0.1
         self.assertIsInstance(protocol.received[0], messages.VideoSourceAdded)
         self.assertIsInstance(protocol.received[1], messages.VideoSourceAdded)
         self.assertIsInstance(protocol.received[2], messages.VideoMixStatus)
+
+    def test_subscribe(self):
+        disconnect_future = self.loop.create_future()
+        transport, protocol = self.loop.run_until_complete(
+            self.loop.create_connection(
+                lambda: TestClientProtocol(disconnect_future),
+                '127.0.0.1', self.server.local_port()))
+        self.addCleanup(transport.close)
+
+        protocol.send_message(messages.Subscribe(
+            ["video-mix-status", "video-source-added"], ["v1"]))
+        async def wait_for_subscription():
+            while not any(p.subscription is not None
+                          for p in self.server._connections):
+                await asyncio.sleep(0.01)
+        self.loop.run_until_complete(wait_for_subscription())
+
+        async def post_messages():
+            await self.bus.post(messages.VideoSourceAdded("v1", ("host", 42)))
+            await self.bus.post(messages.VideoSourceAdded("v2", ("host", 43)))
+            await self.bus.post(messages.AudioSourceAdded("v1", ("host", 42)))
+            await self.bus.post(messages.VideoMixStatus("fullscreen", "v2", None))
+        self.loop.run_until_complete(post_messages())
+        self.loop.run_until_complete(self.server.close())
+        self.loop.run_until_complete(disconnect_future)
+
+        self.assertEqual(len(protocol.received), 2)
+        self.assertIsInstance(protocol.received[0], messages.VideoSourceAdded)
+        self.assertEqual(protocol.received[0].channel, "v1")
+        self.assertIsInstance(protocol.received[1], messages.VideoMixStatus)
+
+    def test_subscription_matches(self):
+        sub = control.Subscription(None, None)
+        self.assertTrue(sub.matches(messages.SetAudioSource("a")))
+
+        sub = control.Subscription(["video-mix-status"], None)
+        self.assertTrue(sub.matches(
+            messages.VideoMixStatus("fullscreen", "a", None)))
+        self.assertFalse(sub.matches(messages.SetAudioSource("a")))
+
+        sub = control.Subscription(None, ["a"])
+        self.assertTrue(sub.matches(
+            messages.VideoSourceAdded("a", ("host", 42))))
+        self.assertFalse(sub.matches(
+            messages.VideoSourceAdded("b", ("host", 42))))
+        # Messages not about a single channel are not filtered
+        self.assertTrue(sub.matches(
+            messages.VideoMixStatus("fullscreen", "b", None)))
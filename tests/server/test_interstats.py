@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from gi.repository import Gst
+
+from videowhisk.common import messages
+from videowhisk.server import config, interstats, messagebus
+
+
+class InterChannelTests(unittest.TestCase):
+
+    def advance(self, channel, sink, src):
+        channel.sink_count += sink
+        channel.src_count += src
+        channel.update()
+
+    def test_video_balanced(self):
+        channel = interstats.InterChannel("c0.video_0.mix", "video")
+        for i in range(10):
+            # Frames counted either side of an update even out
+            self.advance(channel, 30, 31 if i % 2 else 29)
+        self.assertEqual(channel.repeated, 0)
+        self.assertEqual(channel.dropped, 0)
+
+    def test_video_repeated_and_dropped(self):
+        channel = interstats.InterChannel("c0.video_0.mix", "video")
+        self.advance(channel, 30, 30)
+        self.advance(channel, 25, 30)
+        self.assertEqual(channel.repeated, 5)
+        self.assertEqual(channel.dropped, 0)
+        self.advance(channel, 30, 20)
+        self.assertEqual(channel.repeated, 5)
+        self.assertEqual(channel.dropped, 10)
+        self.assertEqual(channel.summary(), dict(
+            kind="video", frames=80, repeated=5, dropped=10, gaps=0))
+
+    def test_ignores_start_and_stop(self):
+        channel = interstats.InterChannel("c0.video_0.mix", "video")
+        # The consumer started a second before the producer
+        self.advance(channel, 0, 30)
+        self.advance(channel, 10, 30)
+        self.assertEqual(channel.repeated, 0)
+        # The producer went away
+        self.advance(channel, 0, 30)
+        self.assertEqual(channel.repeated, 0)
+        self.assertEqual(channel.dropped, 0)
+
+    def test_audio_overrun(self):
+        channel = interstats.InterChannel("c0.audio_0.mix", "audio")
+        channel._max_duration = 10 * Gst.MSECOND
+        self.advance(channel, Gst.SECOND, Gst.SECOND)
+        self.advance(channel, Gst.SECOND, Gst.SECOND - 15 * Gst.MSECOND)
+        self.assertEqual(channel.dropped, 0)
+        self.advance(channel, Gst.SECOND, Gst.SECOND - 15 * Gst.MSECOND)
+        self.assertEqual(channel.dropped, 30 * Gst.MSECOND)
+        channel.gap_count = 40 * Gst.MSECOND
+        summary = channel.summary()
+        self.assertEqual(summary["underrun"], 40 * Gst.MSECOND)
+        self.assertEqual(summary["overrun"], 30 * Gst.MSECOND)
+
+
+class FrameStatsMonitorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.SelectorEventLoop()
+        self.config = config.Config()
+        self.config.read_string("""
+[server]
+frame_stats = yes
+frame_stats_interval = 10
+""")
+        self.bus = messagebus.MessageBus(self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.bus.close())
+        self.loop.close()
+
+    def test_monitor(self):
+        monitor = interstats.FrameStatsMonitor(
+            self.config, self.bus, self.loop)
+        monitor.get_channel("c0.video_0.mix", "video")
+        monitor.get_channel("c0.video_0.monitor", "video")
+        monitor.get_channel("videomix.output", "video")
+        stats = self.loop.create_future()
+
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                if not stats.done():
+                    stats.set_result(message)
+                queue.task_done()
+        self.bus.add_consumer(messages.FrameStats, consumer)
+
+        msg = self.loop.run_until_complete(asyncio.wait_for(stats, 5))
+        self.assertEqual(sorted(msg.channels), [
+            "c0.video_0.mix", "c0.video_0.monitor", "videomix.output"])
+
+        async def remove_source():
+            await self.bus.post(messages.VideoSourceRemoved(
+                "c0.video_0", ("127.0.0.1", 4242)))
+            await self.bus._post_queue.join()
+        self.loop.run_until_complete(remove_source())
+        self.assertEqual(list(monitor.report()), ["videomix.output"])
+        self.loop.run_until_complete(monitor.close())
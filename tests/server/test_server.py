@@ -1,5 +1,7 @@
 import asyncio
+import os
 import signal
+import tempfile
 import unittest
 
 import aiohttp
@@ -21,6 +23,7 @@ class ServerTests(unittest.TestCase):
 host = 127.0.0.1
 """)
         self.server = server.Server(self.config, self.loop)
+        self.loop.run_until_complete(self.server.start())
 
     def tearDown(self):
         self.loop.run_until_complete(self.server.close())
@@ -72,7 +75,7 @@ host = 127.0.0.1
         async def mixer_consumer(queue):
             while True:
                 message = await queue.get()
-                if isinstance(message, messages.AudioMixStatus):
+                if isinstance(message, messages.AudioMixStatusDelta):
                     if message.active_source == "c2.audio_0":
                         amix_future.set_result(None)
                 if isinstance(message, messages.VideoMixStatus):
@@ -82,7 +85,7 @@ host = 127.0.0.1
                         vmix_future.set_result(None)
                 queue.task_done()
         self.server.bus.add_consumer(
-            (messages.AudioMixStatus, messages.VideoMixStatus),
+            (messages.AudioMixStatusDelta, messages.VideoMixStatus),
             mixer_consumer)
 
         self.loop.create_task(self.server.bus.post(
@@ -110,6 +113,41 @@ host = 127.0.0.1
         self.assertEqual(headers["Content-Type"], "video/x-matroska")
         self.assertEqual(body[:4], b"\x1A\x45\xDF\xA3")
 
+    def test_reload_config(self):
+        # Switch to a mode that will be removed by the reload
+        status_future = self.loop.create_future()
+        config_future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                if isinstance(message, messages.MixerConfig):
+                    config_future.set_result(message)
+                elif not status_future.done():
+                    status_future.set_result(message)
+                queue.task_done()
+        self.server.bus.add_consumer(
+            (messages.MixerConfig, messages.VideoMixStatus), consumer)
+        self.loop.create_task(self.server.bus.post(
+            messages.SetVideoSource("quad", None, None)))
+        self.loop.run_until_complete(status_future)
+        self.assertEqual(status_future.result().composite_mode, "quad")
+
+        fd, filename = tempfile.mkstemp(suffix=".cfg")
+        self.addCleanup(os.remove, filename)
+        os.close(fd)
+        self.config.read_file(filename)
+        with open(filename, "w") as fp:
+            fp.write("""
+[composite.quad]
+disabled = true
+""")
+        status_future = self.loop.create_future()
+        self.loop.create_task(self.server.bus.post(messages.ReloadConfig()))
+        self.loop.run_until_complete(config_future)
+        self.assertNotIn("quad", config_future.result().composite_modes)
+        self.loop.run_until_complete(status_future)
+        self.assertEqual(status_future.result().composite_mode, "fullscreen")
+
     def test_make_initial_messages(self):
         source_future = self.loop.create_future()
         async def source_consumer(queue):
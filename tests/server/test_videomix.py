@@ -18,18 +18,19 @@ class VideoMixTests(unittest.TestCase):
         self.config = config.Config()
         self.bus = messagebus.MessageBus(self.loop)
         self.vmix = videomix.VideoMix(self.config, self.bus, self.loop)
+        self.loop.run_until_complete(self.vmix.start())
 
     def tearDown(self):
         self.loop.run_until_complete(self.vmix.close())
         self.loop.run_until_complete(self.bus.close())
         self.loop.close()
 
-    def make_video_source(self, channel="source.video"):
+    def make_video_source(self, channel="source.video", pattern="smpte"):
         pipeline = Gst.parse_launch("""
-            videotestsrc !
+            videotestsrc pattern={} !
             {} !
             intervideosink channel={}.mix
-        """.format(self.config.video_caps.to_string(), channel))
+        """.format(pattern, self.config.video_caps.to_string(), channel))
         pipeline.set_state(Gst.State.PLAYING)
         self.addCleanup(pipeline.set_state, Gst.State.NULL)
         self.loop.create_task(self.bus.post(messages.VideoSourceAdded(channel, "127.0.0.1")))
@@ -56,6 +57,40 @@ class VideoMixTests(unittest.TestCase):
         self.loop.run_until_complete(future)
         message = future.result()
         self.assertNotIn("source.video", self.vmix._sources)
+        # The source's elements are removed in the background
+        self.loop.run_until_complete(
+            asyncio.gather(*self.vmix._closing_tasks))
+        self.assertEqual(self.vmix._mixer.sinkpads, [])
+
+    def test_source_added_before_start(self):
+        self.loop.run_until_complete(self.vmix.close())
+        self.vmix = videomix.VideoMix(self.config, self.bus, self.loop)
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                if not future.done():
+                    future.set_result(message)
+                queue.task_done()
+        self.bus.add_consumer(messages.VideoMixStatus, consumer)
+
+        # The message waits until the pipeline is playing
+        self.make_video_source()
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertNotIn("source.video", self.vmix._sources)
+        self.loop.run_until_complete(self.vmix.start())
+        self.loop.run_until_complete(future)
+        self.assertIn("source.video", self.vmix._sources)
+
+    def test_close_before_start(self):
+        self.loop.run_until_complete(self.vmix.close())
+        self.vmix = videomix.VideoMix(self.config, self.bus, self.loop)
+        self.make_video_source()
+        # Messages are discarded, so the bus can still be closed
+        self.loop.run_until_complete(self.vmix.close())
+        self.loop.run_until_complete(
+            asyncio.wait_for(self.bus.close(), 5))
+        self.assertEqual(self.vmix._sources, {})
 
     def test_set_video_source(self):
         future = self.loop.create_future()
@@ -129,3 +164,284 @@ class VideoMixTests(unittest.TestCase):
         self.assertEqual(source_video3.ypos, 800)
         self.assertEqual(source_video3.height, 270)
         self.assertEqual(source_video3.zorder, 2)
+
+    def test_set_video_layout(self):
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                future.set_result(message)
+                queue.task_done()
+        self.bus.add_consumer(messages.VideoMixStatus, consumer)
+
+        for i in range(1, 6):
+            self.make_video_source("source.video{}".format(i))
+            self.loop.run_until_complete(future)
+            future = self.loop.create_future()
+        sources = [self.vmix._sources["source.video{}".format(i)]
+                   for i in range(1, 6)]
+
+        self.loop.create_task(self.bus.post(messages.SetVideoLayout(
+            "quad", {"a": "source.video1", "b": "source.video2",
+                     "c": "source.video3", "d": "source.video4"})))
+        self.loop.run_until_complete(future)
+        message = future.result()
+        self.assertEqual(message.composite_mode, "quad")
+        self.assertEqual(message.slots, {
+            "a": "source.video1", "b": "source.video2",
+            "c": "source.video3", "d": "source.video4"})
+        self.assertEqual(message.source_a, "source.video1")
+        self.assertEqual(message.source_b, "source.video2")
+
+        for source in sources[:4]:
+            self.assertEqual(source.alpha, 1.0)
+            self.assertEqual(source.width, 960)
+            self.assertEqual(source.height, 540)
+        self.assertEqual(sources[4].alpha, 0.0)
+        self.assertEqual((sources[3].xpos, sources[3].ypos), (960, 540))
+
+        # Replace one slot, clear another, and leave the rest alone
+        future = self.loop.create_future()
+        self.loop.create_task(self.bus.post(messages.SetVideoLayout(
+            "quad", {"b": "source.video5", "c": None})))
+        self.loop.run_until_complete(future)
+        message = future.result()
+        self.assertEqual(message.slots, {
+            "a": "source.video1", "b": "source.video5",
+            "c": None, "d": "source.video4"})
+        self.assertEqual(sources[1].alpha, 0.0)
+        self.assertEqual(sources[2].alpha, 0.0)
+        self.assertEqual(sources[4].alpha, 1.0)
+        self.assertEqual((sources[4].xpos, sources[4].ypos), (960, 0))
+
+        # Switching to a mode with fewer slots hides the extra sources
+        future = self.loop.create_future()
+        self.loop.create_task(self.bus.post(messages.SetVideoLayout(
+            "picture-in-picture", {})))
+        self.loop.run_until_complete(future)
+        message = future.result()
+        self.assertEqual(message.slots, {
+            "a": "source.video1", "b": "source.video5"})
+        self.assertEqual(sources[0].width, 1920)
+        self.assertEqual(sources[3].alpha, 0.0)
+        self.assertEqual(sources[4].width, 480)
+
+        # Layouts with unknown modes or slots are ignored
+        for mode, slots in [("no-such-mode", {"a": "source.video3"}),
+                            ("picture-in-picture", {"c": "source.video3"}),
+                            ("picture-in-picture", {"a": 42})]:
+            future = self.loop.create_future()
+            with self.assertLogs("videowhisk.server.videomix", "WARNING"):
+                self.loop.create_task(self.bus.post(
+                    messages.SetVideoLayout(mode, slots)))
+                self.loop.run_until_complete(future)
+            message = future.result()
+            self.assertEqual(message.composite_mode, "picture-in-picture")
+            self.assertEqual(message.slots, {
+                "a": "source.video1", "b": "source.video5"})
+
+    def test_remove_source_clears_slot(self):
+        future = self.loop.create_future()
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                future.set_result(message)
+                queue.task_done()
+        self.bus.add_consumer(messages.VideoMixStatus, consumer)
+
+        self.make_video_source("source.video1")
+        self.loop.run_until_complete(future)
+        future = self.loop.create_future()
+        self.loop.create_task(self.bus.post(messages.SetVideoSource(
+            "fullscreen", "source.video1", None)))
+        self.loop.run_until_complete(future)
+        self.assertEqual(future.result().source_a, "source.video1")
+
+        future = self.loop.create_future()
+        self.loop.create_task(self.bus.post(messages.VideoSourceRemoved(
+            "source.video1", "127.0.0.1")))
+        self.loop.run_until_complete(future)
+        self.assertEqual(future.result().slots, {"a": None, "b": None})
+
+    def test_prescale_small_slots(self):
+        self.make_red_blue_sources()
+        red = self.vmix._sources["source.red"]
+        blue = self.vmix._sources["source.blue"]
+        self.post_and_wait(messages.SetVideoSource(
+            "picture-in-picture", "source.red", "source.blue"))
+        self.assertEqual(red.scale_size, (1920, 1080))
+        self.assertEqual(blue.scale_size, (480, 270))
+
+        # The compositor receives frames at the slot size
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+        caps = blue._sink_pad.get_current_caps()
+        self.assertEqual(caps.get_structure(0).get_value("width"), 480)
+        self.assertEqual(caps.get_structure(0).get_value("height"), 270)
+
+        # Hidden sources keep their size, while visible ones grow
+        self.post_and_wait(messages.SetVideoSource(
+            "fullscreen", "source.blue", None))
+        self.assertEqual(red.scale_size, (1920, 1080))
+        self.assertEqual(blue.scale_size, (1920, 1080))
+        self.assertEqual((blue.width, blue.height), (1920, 1080))
+
+    def test_mix_format(self):
+        self.loop.run_until_complete(self.vmix.close())
+        self.config.read_string("""
+[server]
+mix_format = AYUV
+""")
+        self.vmix = videomix.VideoMix(self.config, self.bus, self.loop)
+        self.loop.run_until_complete(self.vmix.start())
+        self.make_red_blue_sources()
+        self.post_and_wait(messages.SetVideoSource(
+            "fullscreen", "source.red", None))
+
+        # The compositor blends in AYUV, but the output is still YUY2
+        caps = self.vmix._mixer.get_static_pad("src").get_current_caps()
+        self.assertEqual(caps.get_structure(0).get_value("format"), "AYUV")
+        frames = self.capture_frames([(960, 540)])
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+        self.assertTrue(frames and all(c > 100 for (pts, (c,)) in frames))
+
+    def capture_frames(self, points):
+        """Record the output frames' redness at the given pixels.
+
+        Returns a list of (pts, [V - U, ...]) for each YUY2 frame,
+        which is strongly positive for red and negative for blue.
+        """
+        frames = []
+        def chroma(data, x, y):
+            offset = y * 1920 * 2 + (x // 2) * 4
+            return data[offset + 3] - data[offset + 1]
+        def probe(pad, info):
+            buf = info.get_buffer()
+            ok, mapinfo = buf.map(Gst.MapFlags.READ)
+            try:
+                frames.append((buf.pts, [chroma(mapinfo.data, x, y)
+                                         for (x, y) in points]))
+            finally:
+                buf.unmap(mapinfo)
+            return Gst.PadProbeReturn.OK
+        # Probe the output after any format conversion
+        sink, = [el for el in self.vmix._pipeline.iterate_elements()
+                 if el.get_factory().get_name() == "intervideosink"]
+        sinkpad = sink.get_static_pad("sink")
+        probe_id = sinkpad.add_probe(Gst.PadProbeType.BUFFER, probe)
+        self.addCleanup(sinkpad.remove_probe, probe_id)
+        return frames
+
+    def make_red_blue_sources(self):
+        self.status = None
+        async def consumer(queue):
+            while True:
+                message = await queue.get()
+                if self.status is not None and not self.status.done():
+                    self.status.set_result(message)
+                queue.task_done()
+        self.bus.add_consumer(messages.VideoMixStatus, consumer)
+
+        for colour in ["red", "blue"]:
+            self.status = self.loop.create_future()
+            self.make_video_source("source." + colour, colour)
+            self.loop.run_until_complete(self.status)
+
+    def post_and_wait(self, message):
+        self.status = self.loop.create_future()
+        self.loop.create_task(self.bus.post(message))
+        return self.loop.run_until_complete(self.status)
+
+    def test_switch_is_frame_accurate(self):
+        self.make_red_blue_sources()
+        self.post_and_wait(messages.SetVideoSource(
+            "side-by-side-equal", "source.red", "source.blue"))
+
+        frames = self.capture_frames([(480, 540), (1440, 540)])
+        status = self.post_and_wait(messages.SetVideoSource(
+            "side-by-side-equal", "source.blue", "source.red"))
+        self.assertEqual(status.slots, {"a": "source.blue", "b": "source.red"})
+        self.assertIsNotNone(status.switch_time)
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+
+        # Every frame shows either the old or new layout, and the
+        # layout changes exactly at the reported switch time.
+        self.assertGreater(len(frames), 2)
+        for pts, (left, right) in list(frames):
+            if pts < status.switch_time:
+                self.assertTrue(left > 0 and right < 0)
+            else:
+                self.assertTrue(left < 0 and right > 0)
+        self.assertIn(status.switch_time, [pts for (pts, _) in frames])
+
+    def test_fade_transition(self):
+        self.make_red_blue_sources()
+        self.post_and_wait(messages.SetVideoSource(
+            "fullscreen", "source.red", None))
+
+        frames = self.capture_frames([(960, 540)])
+        status = self.post_and_wait(messages.SetVideoSource(
+            "fullscreen", "source.blue", None, "fade", 300))
+        self.assertIsNotNone(status.switch_time)
+        self.loop.run_until_complete(asyncio.sleep(0.6))
+        end_time = status.switch_time + 300 * Gst.MSECOND
+
+        # The picture changes gradually from red to blue
+        before = [c for (pts, (c,)) in frames if pts < status.switch_time]
+        during = [c for (pts, (c,)) in frames
+                  if status.switch_time < pts < end_time]
+        after = [c for (pts, (c,)) in frames if pts >= end_time]
+        self.assertTrue(all(c > 100 for c in before))
+        self.assertTrue(any(-100 < c < 100 for c in during))
+        self.assertEqual(during, sorted(during, reverse=True))
+        self.assertTrue(after and all(c < -100 for c in after))
+        self.assertEqual(self.vmix._sources["source.red"].alpha, 0.0)
+        self.assertEqual(self.vmix._sources["source.blue"].alpha, 1.0)
+
+    def test_invalid_duration(self):
+        self.make_red_blue_sources()
+        self.post_and_wait(messages.SetVideoSource(
+            "fullscreen", "source.red", None))
+        # Bad durations cut to the new source
+        for duration in [-100, "slow", None, float("inf"), float("nan")]:
+            status = self.post_and_wait(messages.SetVideoSource(
+                "fullscreen", "source.blue", None, "fade", duration))
+            self.assertEqual(status.source_a, "source.blue")
+            self.assertEqual(self.vmix._sources["source.blue"].alpha, 1.0)
+            self.post_and_wait(messages.SetVideoSource(
+                "fullscreen", "source.red", None))
+
+    def test_switch_does_not_block(self):
+        self.make_red_blue_sources()
+        # The second switch is handled before the first takes effect,
+        # replacing it.
+        self.status = self.loop.create_future()
+        async def post():
+            await self.bus.post(messages.SetVideoSource(
+                "fullscreen", "source.blue", None))
+            await self.bus.post(messages.SetVideoSource(
+                "fullscreen", "source.red", None))
+        self.loop.create_task(post())
+        status = self.loop.run_until_complete(self.status)
+        self.assertEqual(status.source_a, "source.red")
+        self.assertIsNotNone(status.switch_time)
+        self.assertEqual(self.vmix._sources["source.red"].alpha, 1.0)
+        self.assertEqual(self.vmix._sources["source.blue"].alpha, 0.0)
+
+    def test_cancel_transition(self):
+        self.make_red_blue_sources()
+        self.post_and_wait(messages.SetVideoSource(
+            "fullscreen", "source.red", None))
+        self.post_and_wait(messages.SetVideoSource(
+            "fullscreen", "source.blue", None, "slide", 5000))
+
+        # Cut back to the red source before the slide completes
+        frames = self.capture_frames([(960, 540)])
+        status = self.post_and_wait(messages.SetVideoSource(
+            "fullscreen", "source.red", None))
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+        after = [c for (pts, (c,)) in frames if pts >= status.switch_time]
+        self.assertTrue(after and all(c > 100 for c in after))
+        red = self.vmix._sources["source.red"]
+        blue = self.vmix._sources["source.blue"]
+        self.assertEqual((red.xpos, red.width, red.alpha), (0, 1920, 1.0))
+        self.assertEqual(blue.alpha, 0.0)
@@ -0,0 +1,33 @@
+import argparse
+import logging
+import sys
+
+# We need to initialise gst-python before importing our own code
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstNet', '1.0')
+gi.require_version('GstController', '1.0')
+from gi.repository import Gst
+Gst.init(None)
+
+from . import (codec, compositor, controlplane, fanout, ingestload, startup,
+               teardown)
+
+
+logging.basicConfig(level=logging.INFO)
+
+parser = argparse.ArgumentParser(prog="python3 -m videowhisk.bench")
+subparsers = parser.add_subparsers(title="benchmarks")
+codec.add_parser(subparsers)
+compositor.add_parser(subparsers)
+ingestload.add_parser(subparsers)
+fanout.add_parser(subparsers)
+controlplane.add_parser(subparsers)
+startup.add_parser(subparsers)
+teardown.add_parser(subparsers)
+
+args = parser.parse_args(sys.argv[1:])
+if not hasattr(args, "func"):
+    parser.print_help()
+    sys.exit(2)
+sys.exit(args.func(args))
@@ -0,0 +1,110 @@
+"""Benchmark encoding and decoding of control protocol messages."""
+
+import json
+import time
+
+from ..common import encoding, messages
+
+
+def _sample_messages():
+    """Return a representative instance of every message type."""
+    volumes = {"c{}.audio_0".format(i): 1.0 for i in range(16)}
+    samples = [
+        messages.Negotiate(["msgpack", "json"]),
+        messages.Subscribe(["video-mix-status"], ["c0.video_0"]),
+        messages.MixerConfig(
+            ("192.168.1.10", 4000), ("192.168.1.10", 4001),
+            ("192.168.1.10", 4002), "http://192.168.1.10:4003",
+            ["fullscreen", "picture-in-picture", "side-by-side-equal",
+             "side-by-side-preview"],
+            "video/x-raw,format=YUY2,width=1920,height=1080,"
+            "framerate=30/1,pixel-aspect-ratio=1/1,"
+            "interlace-mode=progressive",
+            "audio/x-raw,format=S16LE,channels=2,layout=interleaved,"
+            "rate=48000"),
+        messages.AudioSourceAdded("c0.audio_0", ("192.168.1.20", 41234)),
+        messages.AudioSourceRemoved("c0.audio_0", ("192.168.1.20", 41234)),
+        messages.VideoSourceAdded("c0.video_0", ("192.168.1.20", 41234)),
+        messages.VideoSourceRemoved("c0.video_0", ("192.168.1.20", 41234)),
+        messages.AudioMixStatus("c0.audio_0", volumes),
+        messages.AudioMixStatusDelta("c0.audio_0", {"c0.audio_0": 0.5}, []),
+        messages.AudioLevels(
+            {channel: [-20.5, -21.0] for channel in volumes},
+            {channel: [-6.5, -7.0] for channel in volumes}),
+        messages.SetAudioSource("c0.audio_0"),
+        messages.SetAudioVolume("c0.audio_0", 0.5),
+        messages.VideoMixStatus(
+            "picture-in-picture", "c0.video_0", "c1.video_0"),
+        messages.SetVideoSource(
+            "picture-in-picture", "c0.video_0", "c1.video_0"),
+        messages.SetVideoLayout(
+            "quad", {"a": "c0.video_0", "b": "c1.video_0",
+                     "c": "c2.video_0", "d": "c3.video_0"}),
+        messages.ReloadConfig(),
+        messages.ClockStats(
+            ("192.168.1.20", 41234), True, 350000, -1500000000000, 12000,
+            1.0000021),
+        messages.FrameStats({
+            "c0.video_0.mix": dict(kind="video", frames=9000, repeated=3,
+                                   dropped=1, gaps=0),
+            "c0.audio_0.mix": dict(kind="audio", duration=300000000000,
+                                   underrun=20000000, overrun=0),
+        }),
+        messages.SourceStats(
+            "c0", ("192.168.1.20", 41234), 1250000000, 3750000.0,
+            {"c0.video_0": dict(buffers=9000, rate=30.0),
+             "c0.audio_0": dict(buffers=15000, rate=50.0)},
+            1200000, 3),
+    ]
+    by_type = {msg.message_type: msg for msg in samples}
+    missing = set(messages._message_class_by_type) - set(by_type)
+    if missing:
+        raise RuntimeError("No sample message for {}".format(
+            ", ".join(sorted(missing))))
+    return [by_type[t] for t in sorted(by_type)]
+
+
+def _time_per_call(func, arg, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations
+
+
+def run_benchmark(iterations):
+    results = []
+    for msg in _sample_messages():
+        for enc in encoding.encodings.values():
+            data = enc.encode(msg)
+            results.append(dict(
+                message_type=msg.message_type,
+                encoding=enc.name,
+                size=len(data),
+                encode_us=_time_per_call(enc.encode, msg, iterations) * 1e6,
+                decode_us=_time_per_call(enc.decode, data, iterations) * 1e6,
+            ))
+    return results
+
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "codec", help="Control protocol message encoding")
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--json", type=str, metavar="FILE",
+                        help="Write results as JSON to FILE")
+    parser.set_defaults(func=main)
+
+
+def main(args):
+    results = run_benchmark(args.iterations)
+    print("msgpack implementation: {}".format(
+        "C extension" if encoding.msgpack is not None else "pure Python"))
+    print("{:<22} {:<8} {:>6} {:>11} {:>11}".format(
+        "message", "encoding", "bytes", "encode (us)", "decode (us)"))
+    for r in results:
+        print("{message_type:<22} {encoding:<8} {size:>6} "
+              "{encode_us:>11.2f} {decode_us:>11.2f}".format(**r))
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+    return 0
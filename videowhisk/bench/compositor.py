@@ -0,0 +1,137 @@
+"""Benchmark video mixing over blending formats and thread counts.
+
+Each run mixes the sources of a composite mode from non-live test
+sources as fast as possible, using the same compositor and converter
+settings as the server's VideoMix, and measures the achieved frame
+rate and the CPU time spent per output frame.
+"""
+
+import itertools
+import json
+import resource
+import time
+
+from gi.repository import Gst
+
+from ..server import config, videomix
+
+
+SIZES = {
+    "1080p30": (1920, 1080),
+    "2160p30": (3840, 2160),
+}
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_config(size, mix_format, threads):
+    width, height = SIZES[size]
+    cfg = config.Config()
+    cfg.read_string("""
+[server]
+video_caps = video/x-raw,format=YUY2,width={},height={},framerate=30/1,pixel-aspect-ratio=1/1,interlace-mode=progressive
+mix_format = {}
+mix_threads = {}
+convert_threads = {}
+""".format(width, height, mix_format, threads, threads))
+    return cfg
+
+
+def make_pipeline(cfg, mode, frames):
+    pipeline = Gst.Pipeline()
+    mixer = videomix.VideoMix.make_mixer(cfg)
+    sink = Gst.ElementFactory.make("fakesink")
+    sink.props.sync = False
+    pipeline.add(mixer, sink)
+    if cfg.mix_caps.is_equal(cfg.video_caps):
+        mixer.link_filtered(sink, cfg.video_caps)
+    else:
+        convert = Gst.ElementFactory.make("videoconvert")
+        convert.props.n_threads = cfg.convert_threads
+        pipeline.add(convert)
+        mixer.link_filtered(convert, cfg.mix_caps)
+        convert.link_filtered(sink, cfg.video_caps)
+
+    for i, settings in enumerate(cfg.composite_modes[mode].slots.values()):
+        source = Gst.ElementFactory.make("videotestsrc")
+        source.props.num_buffers = frames
+        source.props.pattern = i
+        queue = Gst.ElementFactory.make("queue")
+        pipeline.add(source, queue)
+        source.link_filtered(queue, cfg.video_caps)
+        queue.link(mixer)
+        pad = queue.get_static_pad("src").get_peer()
+        for prop, value in zip(settings._fields, settings):
+            pad.set_property(prop, value)
+    return pipeline
+
+
+def run_one(size, mix_format, threads, mode, frames):
+    cfg = make_config(size, mix_format, threads)
+    pipeline = make_pipeline(cfg, mode, frames)
+    # Preroll first, so element setup isn't counted
+    pipeline.set_state(Gst.State.PAUSED)
+    pipeline.get_state(Gst.CLOCK_TIME_NONE)
+
+    start_cpu = _cpu_time()
+    start = time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    elapsed = time.perf_counter() - start
+    cpu = _cpu_time() - start_cpu
+    pipeline.set_state(Gst.State.NULL)
+    if message.type == Gst.MessageType.ERROR:
+        error, debug = message.parse_error()
+        raise RuntimeError("{}: {}".format(error.message, debug))
+
+    return dict(
+        size=size,
+        mix_format=cfg.mix_caps.get_structure(0).get_value("format"),
+        threads=threads,
+        mode=mode,
+        frames=frames,
+        fps=frames / elapsed,
+        cpu_ms_per_frame=cpu / frames * 1000,
+    )
+
+
+def run_benchmark(sizes, formats, threads, mode, frames):
+    return [run_one(size, mix_format, n, mode, frames)
+            for (size, mix_format, n) in itertools.product(
+                    sizes, formats, threads)]
+
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "compositor", help="Video mixing formats and thread counts")
+    parser.add_argument("--sizes", nargs="+", choices=sorted(SIZES),
+                        default=sorted(SIZES))
+    parser.add_argument("--formats", nargs="+",
+                        default=["", "I420", "AYUV"],
+                        help="Mixing formats (empty for the output format)")
+    parser.add_argument("--threads", nargs="+", type=int,
+                        default=[1, 2, 4, 0])
+    parser.add_argument("--mode", type=str, default="quad",
+                        help="Composite mode to mix")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--json", type=str, metavar="FILE",
+                        help="Write results as JSON to FILE")
+    parser.set_defaults(func=main)
+
+
+def main(args):
+    results = run_benchmark(
+        args.sizes, args.formats, args.threads, args.mode, args.frames)
+    print("{:<8} {:<7} {:>7} {:>8} {:>14}".format(
+        "size", "format", "threads", "fps", "cpu (ms/frame)"))
+    for r in results:
+        print("{size:<8} {mix_format:<7} {threads:>7} {fps:>8.1f} "
+              "{cpu_ms_per_frame:>14.2f}".format(**r))
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+    return 0
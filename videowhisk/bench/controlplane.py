@@ -0,0 +1,313 @@
+"""Benchmark control plane latency and throughput.
+
+A server runs in this process with test sources from ingest clients,
+and a number of control clients connect to it.  Each client sends
+SetAudioVolume and SetVideoSource requests at a fixed rate, and every
+client watches the status messages to see when each request has taken
+effect.  A request's round trip time is measured until its status has
+reached the first client, and until it has reached all of them.
+
+Requests are matched to status messages by the state they set: every
+volume request sets a distinct volume, while video requests cycle
+through the combinations of composite mode and sources.  The time
+messages spend between being posted on the server's MessageBus and
+being taken from a consumer's queue is measured too.
+"""
+
+import asyncio
+import itertools
+import json
+import platform
+import random
+import time
+
+import asyncio_glib
+from gi.repository import Gst
+
+from ..common import messages, protocol
+from ..server import server
+from . import ingestload
+
+
+# Seconds to wait for a request's status after the run has finished
+SETTLE_TIME = 2
+
+# Distinct volumes used by volume requests before repeating
+VOLUME_STEPS = 9973
+
+
+class Request:
+    __slots__ = ("key", "sent", "arrivals")
+
+    def __init__(self, key, sent):
+        self.key = key
+        self.sent = sent
+        self.arrivals = {}
+
+
+class RequestTracker:
+    """Matches status messages received by clients to requests."""
+
+    def __init__(self, num_clients):
+        self._num_clients = num_clients
+        self._pending = []
+        self.completed = []
+
+    def add(self, key):
+        self._pending.append(Request(key, time.perf_counter()))
+
+    def status_received(self, client_id, keys):
+        now = time.perf_counter()
+        for key in keys:
+            # The oldest request this client hasn't yet seen
+            for request in self._pending:
+                if request.key == key and client_id not in request.arrivals:
+                    request.arrivals[client_id] = now
+                    if len(request.arrivals) == self._num_clients:
+                        self._pending.remove(request)
+                        self.completed.append(request)
+                    break
+
+    @property
+    def lost(self):
+        return len(self._pending)
+
+
+def status_keys(message):
+    if isinstance(message, (messages.AudioMixStatus,
+                            messages.AudioMixStatusDelta)):
+        return [("volume", channel, volume)
+                for channel, volume in message.volumes.items()]
+    elif isinstance(message, messages.VideoMixStatus):
+        return [("video", message.composite_mode, message.source_a,
+                 message.source_b)]
+    return []
+
+
+class BenchClient(protocol.ControlProtocol):
+
+    def __init__(self, client_id, tracker, encoding):
+        super().__init__()
+        self.client_id = client_id
+        self._tracker = tracker
+        self._encoding = encoding
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        if self._encoding != "json":
+            self.request_encoding()
+
+    def message_received(self, msg):
+        keys = status_keys(msg)
+        if keys:
+            self._tracker.status_received(self.client_id, keys)
+
+
+class BusTimer:
+    """Measures the time between posting and consuming bus messages."""
+
+    def __init__(self, bus):
+        self.hops = []
+        self._posted = {}
+        self._post = bus.post
+        bus.post = self.post
+        bus.add_consumer(messages.Message, self.consume)
+
+    async def post(self, message):
+        self._posted[id(message)] = time.perf_counter()
+        await self._post(message)
+
+    async def consume(self, queue):
+        while True:
+            message = await queue.get()
+            posted = self._posted.pop(id(message), None)
+            if posted is not None:
+                self.hops.append(time.perf_counter() - posted)
+            queue.task_done()
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(v * 1000 for v in values)
+    def pick(p):
+        return values[min(int(len(values) * p), len(values) - 1)]
+    return dict(p50=pick(0.5), p95=pick(0.95), p99=pick(0.99),
+                max=values[-1], count=len(values))
+
+
+async def wait_for_sources(loop, srv, count):
+    """Start count ingest clients with an audio and video source each."""
+    ready = loop.create_future()
+    audio, video = [], []
+
+    async def consumer(queue):
+        while True:
+            message = await queue.get()
+            if isinstance(message, messages.AudioSourceAdded):
+                audio.append(message.channel)
+            elif isinstance(message, messages.VideoSourceAdded):
+                video.append(message.channel)
+            if (len(audio) == len(video) == count and not ready.done()):
+                ready.set_result(None)
+            queue.task_done()
+    srv.bus.add_consumer(messages.SourceMessage, consumer)
+
+    procs = [ingestload.start_client(srv.control.local_port(), i, 1, 1)
+             for i in range(count)]
+    await asyncio.wait_for(ready, ingestload.CONNECT_TIMEOUT)
+    return procs, sorted(audio), sorted(video)
+
+
+async def send_requests(client, tracker, requests, rate, duration):
+    end = time.perf_counter() + duration
+    interval = 1 / rate
+    # Spread the clients' requests out over the interval
+    await asyncio.sleep(random.uniform(0, interval))
+    while time.perf_counter() < end:
+        key, msg = next(requests)
+        tracker.add(key)
+        client.send_message(msg)
+        await asyncio.sleep(interval)
+
+
+def make_requests(srv, audio, video, video_fraction):
+    """Yield (key, message) pairs for the requests to send."""
+    modes = sorted(srv.config.composite_modes)
+    video_targets = itertools.cycle(
+        [(mode, a, b) for mode in modes
+         for (a, b) in itertools.permutations(video, 2)])
+    for seq in itertools.count():
+        if random.random() < video_fraction:
+            mode, a, b = next(video_targets)
+            yield (("video", mode, a, b),
+                   messages.SetVideoSource(mode, a, b))
+        else:
+            channel = audio[seq % len(audio)]
+            volume = (seq % VOLUME_STEPS + 1) / (VOLUME_STEPS + 1)
+            yield (("volume", channel, volume),
+                   messages.SetAudioVolume(channel, volume))
+
+
+async def measure(loop, srv, clients, rate, video_fraction, encoding,
+                  sources, duration):
+    bus_timer = BusTimer(srv.bus)
+    procs, audio, video = await wait_for_sources(loop, srv, sources)
+    try:
+        tracker = RequestTracker(clients)
+        conns = []
+        for i in range(clients):
+            _, client = await loop.create_connection(
+                lambda: BenchClient(i, tracker, encoding),
+                "127.0.0.1", srv.control.local_port())
+            conns.append(client)
+        # Let the initial messages arrive
+        await asyncio.sleep(1)
+        bus_timer.hops.clear()
+
+        requests = make_requests(srv, audio, video, video_fraction)
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            send_requests(client, tracker, requests, rate, duration)
+            for client in conns])
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(SETTLE_TIME)
+        for client in conns:
+            client.transport.close()
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+    result = dict(
+        clients=clients,
+        rate=rate,
+        video_fraction=video_fraction,
+        encoding=encoding,
+        sent=len(tracker.completed) + tracker.lost,
+        completed=len(tracker.completed),
+        lost=tracker.lost,
+        completed_per_sec=len(tracker.completed) / elapsed,
+        bus_hop_ms=percentiles(bus_timer.hops),
+    )
+    for kind in ("volume", "video"):
+        done = [r for r in tracker.completed if r.key[0] == kind]
+        result["{}_first_ms".format(kind)] = percentiles(
+            [min(r.arrivals.values()) - r.sent for r in done])
+        result["{}_all_ms".format(kind)] = percentiles(
+            [max(r.arrivals.values()) - r.sent for r in done])
+    return result
+
+
+def run_one(clients, rate, video_fraction, encoding, sources, duration):
+    cfg = ingestload.make_config(1280, 720, 30)
+    loop = asyncio_glib.GLibEventLoop()
+    srv = server.Server(cfg, loop)
+    try:
+        loop.run_until_complete(srv.start())
+        return loop.run_until_complete(measure(
+            loop, srv, clients, rate, video_fraction, encoding, sources,
+            duration))
+    finally:
+        loop.run_until_complete(srv.close())
+        loop.close()
+
+
+def run_benchmark(clients, rate, video_fraction, encoding, sources,
+                  duration):
+    return dict(
+        python=platform.python_version(),
+        gstreamer=Gst.version_string(),
+        runs=[run_one(n, rate, video_fraction, encoding, sources, duration)
+              for n in clients])
+
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "control", help="Control plane latency and throughput")
+    parser.add_argument("--clients", nargs="+", type=int,
+                        default=[1, 10, 50],
+                        help="Numbers of control clients, one run each")
+    parser.add_argument("--rate", type=float, default=5,
+                        help="Requests per second sent by each client")
+    parser.add_argument("--video-fraction", type=float, default=0.2,
+                        help="Fraction of requests that are SetVideoSource")
+    parser.add_argument("--encoding", choices=["json", "msgpack"],
+                        default="json")
+    parser.add_argument("--sources", type=int, default=2,
+                        help="Ingest clients (at least 2)")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="Seconds to send requests for")
+    parser.add_argument("--json", type=str, metavar="FILE",
+                        help="Write the report as JSON to FILE")
+    parser.set_defaults(func=main)
+
+
+def _format_ms(stats, field):
+    if stats is None:
+        return "-"
+    return "{:.1f}".format(stats[field])
+
+
+def main(args):
+    if args.sources < 2:
+        print("At least 2 sources are needed to switch between")
+        return 2
+    report = run_benchmark(args.clients, args.rate, args.video_fraction,
+                           args.encoding, args.sources, args.duration)
+    print("{:>7} {:>9} {:>5} {:>12} {:>12} {:>12} {:>12} {:>10}".format(
+        "clients", "completed", "lost", "vol p50 (ms)", "vol p99 (ms)",
+        "vid p50 (ms)", "vid p99 (ms)", "bus p99 (ms)"))
+    for r in report["runs"]:
+        print("{:>7} {:>9} {:>5} {:>12} {:>12} {:>12} {:>12} {:>10}".format(
+            r["clients"], r["completed"], r["lost"],
+            _format_ms(r["volume_all_ms"], "p50"),
+            _format_ms(r["volume_all_ms"], "p99"),
+            _format_ms(r["video_all_ms"], "p50"),
+            _format_ms(r["video_all_ms"], "p99"),
+            _format_ms(r["bus_hop_ms"], "p99")))
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(report, fp, indent=2)
+    return 0
@@ -0,0 +1,179 @@
+"""Benchmark serving many HTTP viewers from the AVOutputServer.
+
+The server runs in this process with test sources from ingest
+processes, while the viewers run in a videowhisk.bench.viewers
+process.  Viewers are spread over the mixer output and the source
+monitors, and some can be made to read slowly.  The report gives the
+aggregate egress throughput, the server's CPU use, and each client's
+lag and buffers dropped by the multifdsink.
+"""
+
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import asyncio_glib
+from gi.repository import Gst
+
+from ..common import messages
+from ..server import server
+from . import ingestload, viewers
+
+
+# Seconds to let the monitors start streaming before adding viewers
+WARMUP = 2
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def wait_for_sources(loop, srv, count):
+    """Start count ingest clients, and wait for their video sources."""
+    added = loop.create_future()
+    channels = []
+
+    async def consumer(queue):
+        while True:
+            message = await queue.get()
+            if isinstance(message, messages.VideoSourceAdded):
+                channels.append(message.channel)
+                if len(channels) == count and not added.done():
+                    added.set_result(None)
+            queue.task_done()
+    srv.bus.add_consumer(messages.VideoSourceAdded, consumer)
+
+    procs = [ingestload.start_client(srv.control.local_port(), i, 1, 1)
+             for i in range(count)]
+    if count > 0:
+        await asyncio.wait_for(added, ingestload.CONNECT_TIMEOUT)
+    return procs, sorted(channels)
+
+
+def client_stats(srv, paths):
+    stats = []
+    for path in sorted(set(paths)):
+        for s in srv.outputs.get_monitor(path).get_all_client_stats():
+            if s is None:
+                continue
+            stats.append(dict(path=path, bytes_sent=s.bytes_sent,
+                              dropped_buffers=s.dropped_buffers,
+                              lag_ms=(s.lag / Gst.MSECOND
+                                      if s.lag is not None else None),
+                              bytes_queued=s.bytes_queued))
+    return stats
+
+
+async def measure(loop, srv, clients, sources, rate, slow, slow_rate,
+                  duration):
+    procs, channels = await wait_for_sources(loop, srv, sources)
+    paths = ["output"] + channels
+    try:
+        await asyncio.sleep(WARMUP)
+        start_cpu = _cpu_time()
+        start = time.perf_counter()
+        viewer_proc = subprocess.Popen(
+            [sys.executable, "-m", "videowhisk.bench.viewers",
+             "--port", str(srv.outputs.local_port()),
+             "--paths"] + paths + [
+             "--clients", str(clients), "--rate", str(rate),
+             "--slow", str(slow), "--slow-rate", str(slow_rate),
+             "--duration", str(duration)],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        # Read the report as it is written: it can be larger than the
+        # pipe's buffer.
+        output = loop.run_in_executor(None, viewer_proc.communicate)
+
+        # Sample the sink statistics while the viewers are connected
+        await asyncio.sleep(duration * 0.9)
+        stats = client_stats(srv, paths)
+        stdout, _ = await output
+        elapsed = time.perf_counter() - start
+        cpu = _cpu_time() - start_cpu
+        readers = json.loads(stdout)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+    lags = sorted(s["lag_ms"] for s in stats if s["lag_ms"] is not None)
+    return dict(
+        clients=clients,
+        slow_clients=slow,
+        paths=paths,
+        egress_mbit_per_sec=sum(r["bytes"] for r in readers) * 8 / 1e6 /
+            elapsed,
+        cpu_percent=cpu / elapsed * 100,
+        connected=len(stats),
+        disconnected=sum(1 for r in readers if r["disconnected"]),
+        dropped_buffers=sum(s["dropped_buffers"] for s in stats),
+        max_lag_ms=lags[-1] if lags else None,
+        median_lag_ms=lags[len(lags) // 2] if lags else None,
+        per_client=stats,
+        readers=readers,
+    )
+
+
+def run_one(clients, sources, rate, slow, slow_rate, duration):
+    cfg = ingestload.make_config(1920, 1080, 30)
+    loop = asyncio_glib.GLibEventLoop()
+    srv = server.Server(cfg, loop)
+    try:
+        loop.run_until_complete(srv.start())
+        return loop.run_until_complete(measure(
+            loop, srv, clients, sources, rate, slow, slow_rate, duration))
+    finally:
+        loop.run_until_complete(srv.close())
+        loop.close()
+
+
+def run_benchmark(clients, sources, rate, slow, slow_rate, duration):
+    viewers.raise_fd_limit()
+    return [run_one(n, sources, rate, min(slow, n), slow_rate, duration)
+            for n in clients]
+
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "fanout", help="Serving many HTTP viewers")
+    parser.add_argument("--clients", nargs="+", type=int,
+                        default=[1, 10, 100, 1000],
+                        help="Numbers of viewers to run, one run each")
+    parser.add_argument("--sources", type=int, default=1,
+                        help="Ingest clients whose monitors are viewed")
+    parser.add_argument("--rate", type=int, default=0,
+                        help="Bytes per second read by each viewer "
+                        "(0 for unlimited)")
+    parser.add_argument("--slow", type=int, default=0,
+                        help="Number of viewers that read slowly")
+    parser.add_argument("--slow-rate", type=int, default=10000,
+                        help="Bytes per second read by slow viewers")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="Seconds to run the viewers for")
+    parser.add_argument("--json", type=str, metavar="FILE",
+                        help="Write results as JSON to FILE")
+    parser.set_defaults(func=main)
+
+
+def main(args):
+    results = run_benchmark(args.clients, args.sources, args.rate,
+                            args.slow, args.slow_rate, args.duration)
+    print("{:>7} {:>5} {:>12} {:>8} {:>7} {:>8} {:>12}".format(
+        "clients", "slow", "egress (Mb/s)", "cpu (%)", "dropped",
+        "removed", "max lag (ms)"))
+    for r in results:
+        print("{clients:>7} {slow_clients:>5} {egress_mbit_per_sec:>13.1f} "
+              "{cpu_percent:>8.1f} {dropped_buffers:>7} {disconnected:>8} "
+              "{max_lag:>12}".format(
+                  max_lag=("{:.1f}".format(r["max_lag_ms"])
+                           if r["max_lag_ms"] is not None else "-"),
+                  **r))
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+    return 0
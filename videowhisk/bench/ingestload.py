@@ -0,0 +1,218 @@
+"""Load the server with many synthetic ingest clients.
+
+The server runs in this process, while each client is a real
+videowhisk.ingest process sending test sources, so connects through
+the same control/handshake/avsource path as a production ingest node.
+Once every source has arrived, the server's CPU use and memory are
+measured along with the rate each source is received at and the
+frames it dropped (gaps in the buffer timestamps).
+"""
+
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import asyncio_glib
+from gi.repository import Gst
+
+from ..common import messages
+from ..server import config, server
+
+
+# Seconds to wait for every client's sources to arrive
+CONNECT_TIMEOUT = 60
+
+# Seconds to let the sources settle before measuring
+WARMUP = 2
+
+
+class SourceLoad:
+    """Counts the buffers of one source reaching its mixer sink.
+
+    Updated from the source's streaming thread, and only read once
+    the measurement is over.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.buffers = 0
+        self.bytes = 0
+        self.dropped = 0
+        self._next_pts = None
+
+    def reset(self):
+        self.buffers = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def probe(self, pad, info):
+        buf = info.get_buffer()
+        self.buffers += 1
+        self.bytes += buf.get_size()
+        if buf.pts != Gst.CLOCK_TIME_NONE and buf.duration > 0:
+            if self._next_pts is not None:
+                missing = (buf.pts - self._next_pts) // buf.duration
+                self.dropped += max(missing, 0)
+            self._next_pts = buf.pts + buf.duration
+        return Gst.PadProbeReturn.OK
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Fall back to the peak, which ru_maxrss reports in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_config(width, height, framerate):
+    cfg = config.Config()
+    cfg.read_string("""
+[server]
+host = 127.0.0.1
+video_caps = video/x-raw,format=YUY2,width={},height={},framerate={}/1,pixel-aspect-ratio=1/1,interlace-mode=progressive
+""".format(width, height, framerate))
+    return cfg
+
+
+def start_client(control_port, index, videos, audios):
+    args = [sys.executable, "-m", "videowhisk.ingest",
+            "--host", "127.0.0.1", "--port", str(control_port),
+            "--name", "load{}".format(index)]
+    args.extend(["--video-test"] * videos)
+    args.extend(["--audio-test"] * audios)
+    return subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+
+def attach_probe(srv, channel):
+    """Count the buffers of channel as they reach its mix sink."""
+    conn = srv.sources.find_source(channel)
+    load = SourceLoad(channel)
+    for sink in conn.pipeline.iterate_sinks():
+        if sink.props.channel == "{}.mix".format(channel):
+            sink.get_static_pad("sink").add_probe(
+                Gst.PadProbeType.BUFFER, load.probe)
+    return load
+
+
+async def measure(loop, srv, cfg, clients, videos, audios, duration):
+    expected = clients * (videos + audios)
+    loads = {}
+    all_added = loop.create_future()
+
+    async def consumer(queue):
+        while True:
+            message = await queue.get()
+            if isinstance(message, (messages.VideoSourceAdded,
+                                    messages.AudioSourceAdded)):
+                loads[message.channel] = attach_probe(srv, message.channel)
+                if len(loads) == expected and not all_added.done():
+                    all_added.set_result(None)
+            queue.task_done()
+    srv.bus.add_consumer(messages.SourceMessage, consumer)
+
+    start = time.perf_counter()
+    procs = [start_client(srv.control.local_port(), i, videos, audios)
+             for i in range(clients)]
+    try:
+        await asyncio.wait_for(all_added, CONNECT_TIMEOUT)
+        connect_time = time.perf_counter() - start
+        await asyncio.sleep(WARMUP)
+
+        for load in loads.values():
+            load.reset()
+        start_cpu = _cpu_time()
+        start = time.perf_counter()
+        await asyncio.sleep(duration)
+        elapsed = time.perf_counter() - start
+        cpu = _cpu_time() - start_cpu
+        rss = _rss_bytes()
+        sources = [dict(channel=load.channel,
+                        buffers_per_sec=load.buffers / elapsed,
+                        kbit_per_sec=load.bytes * 8 / elapsed / 1000,
+                        dropped=load.dropped)
+                   for load in (loads[c] for c in sorted(loads))]
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+    return dict(
+        clients=clients,
+        sources=expected,
+        caps=cfg.video_caps.to_string(),
+        connect_sec=connect_time,
+        cpu_percent=cpu / elapsed * 100,
+        rss_mb=rss / 1e6,
+        dropped=sum(s["dropped"] for s in sources),
+        per_source=sources,
+    )
+
+
+def run_one(clients, width, height, framerate, videos, audios, duration):
+    cfg = make_config(width, height, framerate)
+    loop = asyncio_glib.GLibEventLoop()
+    srv = server.Server(cfg, loop)
+    try:
+        loop.run_until_complete(srv.start())
+        return loop.run_until_complete(measure(
+            loop, srv, cfg, clients, videos, audios, duration))
+    finally:
+        loop.run_until_complete(srv.close())
+        loop.close()
+
+
+def run_benchmark(clients, width, height, framerate, videos, audios,
+                  duration):
+    return [run_one(n, width, height, framerate, videos, audios, duration)
+            for n in clients]
+
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "ingest", help="Server load from many ingest clients")
+    parser.add_argument("--clients", nargs="+", type=int,
+                        default=[1, 2, 4, 8],
+                        help="Numbers of clients to run, one run each")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--videos", type=int, default=1,
+                        help="Video streams per client")
+    parser.add_argument("--audios", type=int, default=1,
+                        help="Audio streams per client")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="Seconds to measure for")
+    parser.add_argument("--json", type=str, metavar="FILE",
+                        help="Write results as JSON to FILE")
+    parser.set_defaults(func=main)
+
+
+def main(args):
+    results = run_benchmark(args.clients, args.width, args.height,
+                            args.framerate, args.videos, args.audios,
+                            args.duration)
+    print("{:>7} {:>7} {:>8} {:>8} {:>8}".format(
+        "clients", "sources", "cpu (%)", "rss (MB)", "dropped"))
+    for r in results:
+        print("{clients:>7} {sources:>7} {cpu_percent:>8.1f} "
+              "{rss_mb:>8.1f} {dropped:>8}".format(**r))
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+    return 0
@@ -0,0 +1,166 @@
+"""Benchmark how quickly a restarted server is back on air.
+
+Each run starts a server process, like restarting the mixer would,
+and measures the time until its control and AV source ports accept
+connections, and until the output monitor sends the first frame of
+the mix.  A frame has been sent once the Matroska stream from
+/output contains a Cluster, as the header alone is written before
+any media.  The server is then stopped with SIGINT, and the time it
+takes to exit is reported too.
+"""
+
+import json
+import os
+import platform
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from gi.repository import Gst
+
+
+# Seconds to wait for each stage before giving up on a run
+STARTUP_TIMEOUT = 30
+
+# Seconds between connection attempts
+POLL_INTERVAL = 0.002
+
+# EBML ID of a Matroska Cluster element
+CLUSTER_ID = b"\x1f\x43\xb6\x75"
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_config_file(directory, width, height, framerate):
+    ports = dict(control_port=_free_port(), clock_port=_free_port(),
+                 avsource_port=_free_port(), avoutput_port=_free_port())
+    path = os.path.join(directory, "startup.cfg")
+    with open(path, "w") as fp:
+        fp.write("""
+[server]
+host = 127.0.0.1
+video_caps = video/x-raw,format=YUY2,width={},height={},framerate={}/1,pixel-aspect-ratio=1/1,interlace-mode=progressive
+""".format(width, height, framerate))
+        for key, port in sorted(ports.items()):
+            fp.write("{} = {}\n".format(key, port))
+    return path, ports
+
+
+def wait_for_accept(port, deadline):
+    """Return once a TCP connection to port succeeds."""
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port)):
+                return
+        except ConnectionRefusedError:
+            if time.perf_counter() > deadline:
+                raise TimeoutError("Port {} never accepted".format(port))
+            time.sleep(POLL_INTERVAL)
+
+
+def _read_first_frame(port, deadline):
+    """Request /output, returning whether a Cluster was received."""
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.settimeout(max(deadline - time.perf_counter(), 0.1))
+        sock.sendall(b"GET /output HTTP/1.0\r\n\r\n")
+        data = b""
+        while CLUSTER_ID not in data:
+            block = sock.recv(65536)
+            if not block:
+                return False
+            data += block
+            if data.startswith(b"HTTP/") and b" 200 " not in data[:16]:
+                # The output monitor doesn't exist yet
+                return False
+        return True
+
+
+def wait_for_first_frame(port, deadline):
+    while not _read_first_frame(port, deadline):
+        if time.perf_counter() > deadline:
+            raise TimeoutError("No output frame")
+        time.sleep(POLL_INTERVAL)
+
+
+def run_one(config_path, ports):
+    start = time.perf_counter()
+    deadline = start + STARTUP_TIMEOUT
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "videowhisk.server", config_path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        wait_for_accept(ports["control_port"], deadline)
+        control = time.perf_counter() - start
+        wait_for_accept(ports["avsource_port"], deadline)
+        avsource = time.perf_counter() - start
+        wait_for_first_frame(ports["avoutput_port"], deadline)
+        first_frame = time.perf_counter() - start
+    finally:
+        stop = time.perf_counter()
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(STARTUP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    return dict(control_accept_ms=control * 1000,
+                avsource_accept_ms=avsource * 1000,
+                first_frame_ms=first_frame * 1000,
+                shutdown_ms=(time.perf_counter() - stop) * 1000)
+
+
+def _summarise(runs, field):
+    values = [run[field] for run in runs]
+    return dict(min=min(values), median=statistics.median(values),
+                max=max(values))
+
+
+def run_benchmark(runs, width, height, framerate):
+    with tempfile.TemporaryDirectory() as directory:
+        config_path, ports = make_config_file(
+            directory, width, height, framerate)
+        results = [run_one(config_path, ports) for _ in range(runs)]
+    fields = ["control_accept_ms", "avsource_accept_ms", "first_frame_ms",
+              "shutdown_ms"]
+    return dict(
+        python=platform.python_version(),
+        gstreamer=Gst.version_string(),
+        width=width, height=height, framerate=framerate,
+        summary={field: _summarise(results, field) for field in fields},
+        runs=results)
+
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "startup", help="Time until a new server accepts and outputs video")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="Number of times to start the server")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--json", type=str, metavar="FILE",
+                        help="Write the report as JSON to FILE")
+    parser.set_defaults(func=main)
+
+
+def main(args):
+    report = run_benchmark(args.runs, args.width, args.height,
+                           args.framerate)
+    print("{:<20} {:>10} {:>10} {:>10}".format(
+        "", "min (ms)", "median", "max"))
+    for field, stats in report["summary"].items():
+        print("{:<20} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            field, stats["min"], stats["median"], stats["max"]))
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(report, fp, indent=2)
+    return 0
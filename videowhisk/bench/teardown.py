@@ -0,0 +1,193 @@
+"""Benchmark how the control plane copes with many sources leaving.
+
+A server runs in this process with test sources from ingest clients.
+One client stays connected while the others are killed at the same
+moment, as when a network switch fails.  A control client keeps
+setting the volume of the surviving source throughout, and a task
+measures how late the event loop wakes it up.  The report compares
+control round trips before the disconnects with those during the
+teardown, and gives the time taken until the mixers have been told
+about every removal and until they have removed every source.
+"""
+
+import asyncio
+import json
+import platform
+import time
+
+import asyncio_glib
+from gi.repository import Gst
+
+from ..common import messages
+from ..server import server
+from . import controlplane, ingestload
+
+
+# Seconds of requests before the disconnects
+BASELINE = 2
+
+# Seconds to keep sending requests after the disconnects
+TEARDOWN_WINDOW = 5
+
+# Seconds the event loop lag task sleeps between samples
+LAG_INTERVAL = 0.001
+
+
+class LoopLag:
+    """Records how late the event loop resumes a sleeping task."""
+
+    def __init__(self, loop):
+        self.samples = []
+        self._task = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.samples.append(
+                (start, time.perf_counter() - start - LAG_INTERVAL))
+
+    def between(self, start, end):
+        return [lag for (t, lag) in self.samples if start <= t < end]
+
+    def cancel(self):
+        self._task.cancel()
+
+
+def watch_removals(loop, srv, count):
+    """Return a future completed once count sources were removed."""
+    removed = loop.create_future()
+    seen = 0
+
+    async def consumer(queue):
+        nonlocal seen
+        while True:
+            message = await queue.get()
+            if isinstance(message, (messages.AudioSourceRemoved,
+                                    messages.VideoSourceRemoved)):
+                seen += 1
+                if seen == count and not removed.done():
+                    removed.set_result(time.perf_counter())
+            queue.task_done()
+    srv.bus.add_consumer(messages.SourceMessage, consumer)
+    return removed
+
+
+async def wait_for_mixers(srv):
+    """Wait until the mixers have finished removing sources."""
+    while srv.audiomix._closing_tasks or srv.videomix._closing_tasks:
+        await asyncio.sleep(LAG_INTERVAL)
+    return time.perf_counter()
+
+
+async def measure(loop, srv, disconnects, rate):
+    procs, audio, video = await controlplane.wait_for_sources(
+        loop, srv, disconnects + 1)
+    try:
+        survivor = [channel for channel in audio
+                    if channel.startswith("load0.")]
+        removed = watch_removals(loop, srv, 2 * disconnects)
+        tracker = controlplane.RequestTracker(1)
+        _, client = await loop.create_connection(
+            lambda: controlplane.BenchClient(0, tracker, "json"),
+            "127.0.0.1", srv.control.local_port())
+        await asyncio.sleep(1)
+        lag = LoopLag(loop)
+
+        requests = controlplane.make_requests(srv, survivor, video, 0)
+        sender = loop.create_task(controlplane.send_requests(
+            client, tracker, requests, rate, BASELINE + TEARDOWN_WINDOW))
+        await asyncio.sleep(BASELINE)
+
+        killed = time.perf_counter()
+        for proc in procs[1:]:
+            proc.kill()
+        all_removed = await asyncio.wait_for(
+            removed, ingestload.CONNECT_TIMEOUT)
+        drained = await wait_for_mixers(srv)
+        await sender
+        await asyncio.sleep(controlplane.SETTLE_TIME)
+        lag.cancel()
+        client.transport.close()
+    finally:
+        for proc in procs:
+            proc.kill()
+        for proc in procs:
+            proc.wait()
+
+    def round_trips(start, end):
+        return [max(r.arrivals.values()) - r.sent
+                for r in tracker.completed if start <= r.sent < end]
+
+    return dict(
+        disconnects=disconnects,
+        rate=rate,
+        removed_ms=(all_removed - killed) * 1000,
+        drained_ms=(drained - killed) * 1000,
+        lost=tracker.lost,
+        baseline_rtt_ms=controlplane.percentiles(
+            round_trips(killed - BASELINE, killed)),
+        teardown_rtt_ms=controlplane.percentiles(
+            round_trips(killed, drained)),
+        baseline_loop_lag_ms=controlplane.percentiles(
+            lag.between(killed - BASELINE, killed)),
+        teardown_loop_lag_ms=controlplane.percentiles(
+            lag.between(killed, drained)),
+    )
+
+
+def run_benchmark(disconnects, rate):
+    cfg = ingestload.make_config(1280, 720, 30)
+    # Remove disconnected sources straight away
+    cfg.read_string("""
+[server]
+source_grace_period = 0
+""")
+    loop = asyncio_glib.GLibEventLoop()
+    srv = server.Server(cfg, loop)
+    try:
+        loop.run_until_complete(srv.start())
+        result = loop.run_until_complete(measure(
+            loop, srv, disconnects, rate))
+    finally:
+        loop.run_until_complete(srv.close())
+        loop.close()
+    result.update(python=platform.python_version(),
+                  gstreamer=Gst.version_string())
+    return result
+
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "teardown", help="Control plane stall while sources disconnect")
+    parser.add_argument("--disconnects", type=int, default=50,
+                        help="Ingest clients to kill at once")
+    parser.add_argument("--rate", type=float, default=50,
+                        help="Control requests per second")
+    parser.add_argument("--json", type=str, metavar="FILE",
+                        help="Write the report as JSON to FILE")
+    parser.set_defaults(func=main)
+
+
+def _format_ms(stats, field):
+    if stats is None:
+        return "-"
+    return "{:.1f}".format(stats[field])
+
+
+def main(args):
+    report = run_benchmark(args.disconnects, args.rate)
+    print("{} sources removed in {:.1f} ms, mixers drained in {:.1f} ms".format(
+        report["disconnects"], report["removed_ms"], report["drained_ms"]))
+    print("{:<10} {:>12} {:>12} {:>13} {:>13}".format(
+        "", "rtt p50 (ms)", "rtt max (ms)", "lag p99 (ms)", "lag max (ms)"))
+    for phase in ("baseline", "teardown"):
+        rtt = report["{}_rtt_ms".format(phase)]
+        lag = report["{}_loop_lag_ms".format(phase)]
+        print("{:<10} {:>12} {:>12} {:>13} {:>13}".format(
+            phase, _format_ms(rtt, "p50"), _format_ms(rtt, "max"),
+            _format_ms(lag, "p99"), _format_ms(lag, "max")))
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(report, fp, indent=2)
+    return 0
@@ -0,0 +1,116 @@
+"""Simulated HTTP viewers for the fan-out benchmark.
+
+Run as "python3 -m videowhisk.bench.viewers", this opens many
+connections to the server's monitor URLs, reads from each at a
+limited rate, and prints a JSON list describing every client.  It is
+a separate process so its CPU use isn't counted against the server,
+and it doesn't need GStreamer.
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import time
+
+
+# Bytes read per recv from each client's stream
+READ_SIZE = 65536
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def read_stream(host, port, path, rate, duration):
+    """Read path for duration seconds, at up to rate bytes per second.
+
+    A rate of 0 reads as fast as possible.
+    """
+    result = dict(path=path, bytes=0, status=None, disconnected=False,
+                  first_byte_sec=None)
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError as exc:
+        result["error"] = str(exc)
+        return result
+    try:
+        writer.write("GET /{} HTTP/1.1\r\nHost: {}\r\n\r\n".format(
+            path, host).encode("ASCII"))
+        headers = await reader.readuntil(b"\r\n\r\n")
+        result["status"] = int(headers.split(b" ", 2)[1])
+        end = start + duration
+        # Read rate limited streams in tenths of a second's worth
+        block = READ_SIZE if rate <= 0 else max(min(READ_SIZE, rate // 10), 1)
+        while True:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            if rate > 0:
+                # Sleep until reading another block stays within rate
+                due = start + (result["bytes"] + block) / rate
+                if due > now:
+                    await asyncio.sleep(min(due, end) - now)
+                    continue
+            data = await asyncio.wait_for(reader.read(block), end - now)
+            if not data:
+                result["disconnected"] = True
+                break
+            if result["first_byte_sec"] is None:
+                result["first_byte_sec"] = time.perf_counter() - start
+            result["bytes"] += len(data)
+    except asyncio.TimeoutError:
+        pass
+    except (OSError, asyncio.IncompleteReadError, ValueError) as exc:
+        result["disconnected"] = True
+        result["error"] = str(exc)
+    finally:
+        writer.close()
+    result["duration"] = time.perf_counter() - start
+    return result
+
+
+async def run_viewers(host, port, paths, clients, rate, slow, slow_rate,
+                      duration):
+    """Start clients spread over paths, the first slow of them slow."""
+    tasks = []
+    for i in range(clients):
+        path = paths[i % len(paths)]
+        client_rate = slow_rate if i < slow else rate
+        tasks.append(read_stream(host, port, path, client_rate, duration))
+    results = await asyncio.gather(*tasks)
+    for i, result in enumerate(results):
+        result["slow"] = i < slow
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m videowhisk.bench.viewers")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--paths", nargs="+", default=["output"])
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--rate", type=int, default=0,
+                        help="Bytes per second read by each client")
+    parser.add_argument("--slow", type=int, default=0,
+                        help="Number of slow clients")
+    parser.add_argument("--slow-rate", type=int, default=10000,
+                        help="Bytes per second read by slow clients")
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args(argv)
+
+    raise_fd_limit()
+    results = asyncio.run(run_viewers(
+        args.host, args.port, args.paths, args.clients, args.rate,
+        args.slow, args.slow_rate, args.duration))
+    json.dump(results, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -15,6 +15,7 @@ class ControlClient(protocol.ControlProtocol):
         self.video_sources = {}
         self.audio_status = None
         self.video_status = None
+        self.clock_stats = {}
 
     def message_received(self, msg):
         if isinstance(msg, messages.MixerConfig):
@@ -29,8 +30,13 @@ class ControlClient(protocol.ControlProtocol):
             self.video_sources.pop(msg.channel, None)
         elif isinstance(msg, messages.AudioMixStatus):
             self.audio_status = msg
+        elif isinstance(msg, messages.AudioMixStatusDelta):
+            if self.audio_status is not None:
+                self.audio_status = self.audio_status.apply_delta(msg)
         elif isinstance(msg, messages.VideoMixStatus):
             self.video_status = msg
+        elif isinstance(msg, messages.ClockStats):
+            self.clock_stats[msg.remote_addr] = msg
 
     def connection_lost(self, exc):
         self.loop.stop()
@@ -81,8 +87,18 @@ class Shell:
         for name in sorted(self.protocol.video_sources.keys()):
             print(name)
 
+    async def do_list_clocks(self, args):
+        for addr, stats in sorted(self.protocol.clock_stats.items()):
+            print("{}:{} synced={} rtt={:.3f}ms offset={:.3f}ms "
+                  "discont={:.3f}ms".format(
+                      addr[0], addr[1], stats.synced, stats.rtt / 1e6,
+                      stats.offset / 1e6, stats.discontinuity / 1e6))
+
     async def do_set_video(self, args):
-        mode, source_a, source_b = args
+        mode, source_a, source_b = args[:3]
+        # Optional transition name and duration in milliseconds
+        transition = args[3] if len(args) > 3 else "cut"
+        duration = int(args[4]) if len(args) > 4 else 0
         if mode not in self.protocol.mixer_cfg.composite_modes:
             raise RuntimeError("unknown composite mode {}".format(mode))
         if source_a == '-':
@@ -94,7 +110,24 @@ class Shell:
         elif source_b not in self.protocol.video_sources:
             raise RuntimeError("unknown video source {}".format(source_b))
         self.protocol.send_message(messages.SetVideoSource(
-            mode, source_a, source_b))
+            mode, source_a, source_b, transition, duration))
+
+    async def do_set_layout(self, args):
+        mode = args.pop(0)
+        if mode not in self.protocol.mixer_cfg.composite_modes:
+            raise RuntimeError("unknown composite mode {}".format(mode))
+        slots = {}
+        for arg in args:
+            slot, source = arg.split("=", 1)
+            if source == '-':
+                source = None
+            elif source not in self.protocol.video_sources:
+                raise RuntimeError("unknown video source {}".format(source))
+            slots[slot] = source
+        self.protocol.send_message(messages.SetVideoLayout(mode, slots))
+
+    async def do_reload(self, args):
+        self.protocol.send_message(messages.ReloadConfig())
 
     async def do_set_audio(self, args):
         source, = args
@@ -103,3 +136,10 @@ class Shell:
         elif source not in self.protocol.audio_sources:
             raise RuntimeError("unknown audio source {}".format(source))
         self.protocol.send_message(messages.SetAudioSource(source))
+
+    async def do_set_volume(self, args):
+        source, volume = args
+        if source not in self.protocol.audio_sources:
+            raise RuntimeError("unknown audio source {}".format(source))
+        self.protocol.send_message(messages.SetAudioVolume(
+            source, float(volume)))
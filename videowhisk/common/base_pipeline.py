@@ -1,11 +1,13 @@
 from gi.repository import Gst
 
+from . import tracing
+
 
 class BasePipeline:
 
     def __init__(self, name=None):
         super().__init__()
-        self.__pipeline_name = None
+        self.__pipeline_name = name
         self.__bus_eos_id = 0
         self.__bus_error_id = 0
         self.pipeline = None
@@ -17,8 +19,10 @@ class BasePipeline:
         bus.add_signal_watch()
         self.__bus_eos_id = bus.connect("message::eos", self.__on_eos)
         self.__bus_error_id = bus.connect("message::error", self.__on_error)
+        tracing.register_pipeline(self.pipeline, self.element_channels)
 
     def destroy_pipeline(self):
+        tracing.unregister_pipeline(self.pipeline)
         self.pipeline.set_state(Gst.State.NULL)
         bus = self.pipeline.get_bus()
         bus.remove_watch()
@@ -28,9 +32,23 @@ class BasePipeline:
             bus.disconnect(self.__bus_error_id)
         self.pipeline = None
 
+    async def destroy_pipeline_async(self, loop):
+        """Destroy the pipeline without blocking the event loop.
+
+        Stopping a pipeline waits for its streaming threads, so the
+        state change is made in a worker thread first.
+        """
+        await loop.run_in_executor(
+            None, self.pipeline.set_state, Gst.State.NULL)
+        self.destroy_pipeline()
+
     def set_clock(self):
         raise NotImplementedError()
 
+    def element_channels(self):
+        """Return a dict mapping element names to the channel they carry."""
+        return {}
+
     def __on_eos(self, bus, msg):
         self.on_bus_eos()
 
@@ -0,0 +1,243 @@
+"""Wire encodings for control protocol messages.
+
+Two encodings are supported: JSON objects (the default, understood by
+every client), and a compact MessagePack encoding where a message is
+an array holding the message type followed by its fields in a fixed
+order.  The msgpack module is used if available, falling back to a
+pure Python implementation of the subset of MessagePack we need.
+"""
+
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from . import messages
+
+
+class EncodingError(ValueError):
+    pass
+
+
+class JSONEncoding:
+    name = "json"
+
+    def encode(self, message):
+        return json.dumps(message.serialise()).encode("UTF-8")
+
+    def decode(self, data):
+        return messages.deserialise(json.loads(data))
+
+
+class MsgpackEncoding:
+    name = "msgpack"
+
+    def encode(self, message):
+        data = message.serialise()
+        fields = messages.message_fields(type(message))
+        return pack([data["type"]] + [data[f] for f in fields])
+
+    def decode(self, data):
+        values = unpack(data)
+        if not isinstance(values, list) or len(values) == 0:
+            raise EncodingError("Expected an array holding a message")
+        cls = messages.message_class(values[0])
+        fields = messages.message_fields(cls)
+        if len(values) != len(fields) + 1:
+            raise EncodingError("Wrong number of fields for {}".format(
+                cls.message_type))
+        data = dict(zip(fields, values[1:]))
+        data["type"] = values[0]
+        return cls.deserialise(data)
+
+
+JSON = JSONEncoding()
+MSGPACK = MsgpackEncoding()
+
+# Supported encodings, in order of preference
+encodings = {
+    MSGPACK.name: MSGPACK,
+    JSON.name: JSON,
+}
+
+
+def choose_encoding(names):
+    """Return the first of the named encodings that we support."""
+    for name in names:
+        if name in encodings:
+            return encodings[name]
+    return None
+
+
+def pack(obj):
+    """Encode an object as MessagePack."""
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    out = []
+    _pack(obj, out)
+    return b"".join(out)
+
+
+def unpack(data):
+    """Decode a MessagePack encoded object."""
+    if msgpack is not None:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except (msgpack.UnpackException, ValueError) as exc:
+            raise EncodingError(str(exc)) from exc
+    try:
+        obj, offset = _unpack(data, 0)
+    except (IndexError, struct.error) as exc:
+        raise EncodingError("Truncated message") from exc
+    if offset != len(data):
+        raise EncodingError("Trailing data after message")
+    return obj
+
+
+_uint8 = struct.Struct(">B")
+_uint16 = struct.Struct(">H")
+_uint32 = struct.Struct(">I")
+_int64 = struct.Struct(">q")
+_float64 = struct.Struct(">d")
+
+
+def _pack(obj, out):
+    if obj is None:
+        out.append(b"\xc0")
+    elif obj is True:
+        out.append(b"\xc3")
+    elif obj is False:
+        out.append(b"\xc2")
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(_uint8.pack(obj))
+        elif -32 <= obj < 0:
+            out.append(_uint8.pack(obj & 0xff))
+        elif 0 <= obj < 0x100:
+            out.append(b"\xcc" + _uint8.pack(obj))
+        elif 0 <= obj < 0x10000:
+            out.append(b"\xcd" + _uint16.pack(obj))
+        elif 0 <= obj < 0x100000000:
+            out.append(b"\xce" + _uint32.pack(obj))
+        else:
+            out.append(b"\xd3" + _int64.pack(obj))
+    elif isinstance(obj, float):
+        out.append(b"\xcb" + _float64.pack(obj))
+    elif isinstance(obj, str):
+        data = obj.encode("UTF-8")
+        _pack_header(len(data), 0xa0, 32, b"\xd9", b"\xda", b"\xdb", out)
+        out.append(data)
+    elif isinstance(obj, (list, tuple)):
+        _pack_header(len(obj), 0x90, 16, None, b"\xdc", b"\xdd", out)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _pack_header(len(obj), 0x80, 16, None, b"\xde", b"\xdf", out)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise EncodingError("Can not encode {!r}".format(obj))
+
+
+def _pack_header(length, fix_tag, fix_limit, tag8, tag16, tag32, out):
+    if length < fix_limit:
+        out.append(_uint8.pack(fix_tag | length))
+    elif tag8 is not None and length < 0x100:
+        out.append(tag8 + _uint8.pack(length))
+    elif length < 0x10000:
+        out.append(tag16 + _uint16.pack(length))
+    else:
+        out.append(tag32 + _uint32.pack(length))
+
+
+def _unpack(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag < 0x80:
+        return tag, offset
+    elif tag >= 0xe0:
+        return tag - 0x100, offset
+    elif tag <= 0x8f:
+        return _unpack_map(data, offset, tag & 0x0f)
+    elif tag <= 0x9f:
+        return _unpack_array(data, offset, tag & 0x0f)
+    elif tag <= 0xbf:
+        return _unpack_str(data, offset, tag & 0x1f)
+    elif tag == 0xc0:
+        return None, offset
+    elif tag == 0xc2:
+        return False, offset
+    elif tag == 0xc3:
+        return True, offset
+    elif tag in _fixed_formats:
+        fmt = _fixed_formats[tag]
+        (value,) = fmt.unpack_from(data, offset)
+        return value, offset + fmt.size
+    elif tag in _str_lengths:
+        fmt = _str_lengths[tag]
+        (length,) = fmt.unpack_from(data, offset)
+        return _unpack_str(data, offset + fmt.size, length)
+    elif tag in _array_lengths:
+        fmt = _array_lengths[tag]
+        (length,) = fmt.unpack_from(data, offset)
+        return _unpack_array(data, offset + fmt.size, length)
+    elif tag in _map_lengths:
+        fmt = _map_lengths[tag]
+        (length,) = fmt.unpack_from(data, offset)
+        return _unpack_map(data, offset + fmt.size, length)
+    raise EncodingError("Unsupported MessagePack type 0x{:02x}".format(tag))
+
+
+def _unpack_str(data, offset, length):
+    end = offset + length
+    if end > len(data):
+        raise EncodingError("Truncated message")
+    return data[offset:end].decode("UTF-8"), end
+
+
+def _unpack_array(data, offset, length):
+    items = []
+    for i in range(length):
+        item, offset = _unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def _unpack_map(data, offset, length):
+    items = {}
+    for i in range(length):
+        key, offset = _unpack(data, offset)
+        value, offset = _unpack(data, offset)
+        items[key] = value
+    return items, offset
+
+
+_fixed_formats = {
+    0xca: struct.Struct(">f"),
+    0xcb: _float64,
+    0xcc: _uint8,
+    0xcd: _uint16,
+    0xce: _uint32,
+    0xcf: struct.Struct(">Q"),
+    0xd0: struct.Struct(">b"),
+    0xd1: struct.Struct(">h"),
+    0xd2: struct.Struct(">i"),
+    0xd3: _int64,
+}
+_str_lengths = {
+    0xd9: _uint8,
+    0xda: _uint16,
+    0xdb: _uint32,
+}
+_array_lengths = {
+    0xdc: _uint16,
+    0xdd: _uint32,
+}
+_map_lengths = {
+    0xde: _uint16,
+    0xdf: _uint32,
+}
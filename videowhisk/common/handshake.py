@@ -0,0 +1,76 @@
+"""Optional handshake sent by ingest clients before their AV stream.
+
+The handshake is the magic bytes b"VWHS", a 4 byte big endian length,
+and a JSON object of that length.  Senders that start directly with
+the Matroska stream (whose EBML header can never match the magic)
+send no handshake.
+"""
+
+import asyncio
+import json
+import socket
+import struct
+
+MAGIC = b"VWHS"
+MAX_SIZE = 65536
+
+_length = struct.Struct(">I")
+
+
+class HandshakeError(ValueError):
+    pass
+
+
+def encode(header):
+    data = json.dumps(header).encode("UTF-8")
+    return MAGIC + _length.pack(len(data)) + data
+
+
+async def read(loop, sock):
+    """Read a handshake from the non-blocking socket sock.
+
+    Returns the decoded header, or None if the stream has no
+    handshake, in which case nothing is consumed from the socket.
+    """
+    while True:
+        await _wait_readable(loop, sock)
+        data = sock.recv(len(MAGIC), socket.MSG_PEEK)
+        if not MAGIC.startswith(data) or len(data) == 0:
+            return None
+        if data == MAGIC:
+            break
+        # Only part of the magic has arrived so far
+        await asyncio.sleep(0.01)
+
+    await _recv_exactly(loop, sock, len(MAGIC))
+    (length,) = _length.unpack(
+        await _recv_exactly(loop, sock, _length.size))
+    if length > MAX_SIZE:
+        raise HandshakeError("Handshake too large: {} bytes".format(length))
+    try:
+        header = json.loads(await _recv_exactly(loop, sock, length))
+    except ValueError as exc:
+        raise HandshakeError("Bad handshake: {}".format(exc)) from exc
+    if not isinstance(header, dict):
+        raise HandshakeError("Handshake is not an object")
+    return header
+
+
+async def _wait_readable(loop, sock):
+    fut = loop.create_future()
+    loop.add_reader(sock.fileno(),
+                    lambda: fut.done() or fut.set_result(None))
+    try:
+        await fut
+    finally:
+        loop.remove_reader(sock.fileno())
+
+
+async def _recv_exactly(loop, sock, length):
+    data = b""
+    while len(data) < length:
+        chunk = await loop.sock_recv(sock, length - len(data))
+        if not chunk:
+            raise HandshakeError("Connection closed during handshake")
+        data += chunk
+    return data
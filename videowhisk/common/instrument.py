@@ -0,0 +1,163 @@
+"""Opt-in timing of Python callbacks on the media hot paths.
+
+Pad probes and signal handlers run Python on GStreamer's streaming
+threads, and message bus consumers run on the event loop.  When
+instrumentation is enabled, functions decorated with timed() record
+how long each call takes, and consumers run with timed_consumer() how
+long each message takes to handle, in a histogram per callback.  A
+sampling thread also estimates how long threads wait to reacquire the
+GIL.
+
+enable() must be called before the instrumented modules are
+imported: timed() leaves functions untouched otherwise, so there is
+no cost when instrumentation is off.
+"""
+
+import functools
+import threading
+import time
+
+
+# Upper bounds of the histogram buckets in microseconds.  Durations
+# above the last bound are counted in an overflow bucket.
+BUCKETS_US = [2 ** i for i in range(21)]
+
+# Seconds the GIL sampling thread sleeps between samples
+GIL_SAMPLE_INTERVAL = 0.005
+
+_enabled = False
+_histograms = {}
+_lock = threading.Lock()
+_sampler = None
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def enabled():
+    return _enabled
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--instrument", action="store_true",
+        help="Time Python callbacks, reported at /metrics")
+
+
+class Histogram:
+    __slots__ = ("_lock", "count", "total", "max", "buckets")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_US) + 1)
+
+    def add(self, seconds):
+        us = seconds * 1e6
+        index = 0
+        while index < len(BUCKETS_US) and us > BUCKETS_US[index]:
+            index += 1
+        with self._lock:
+            self.count += 1
+            self.total += us
+            if us > self.max:
+                self.max = us
+            self.buckets[index] += 1
+
+    def summary(self):
+        with self._lock:
+            bounds = BUCKETS_US + [None]
+            return dict(
+                count=self.count,
+                mean_us=self.total / self.count if self.count else None,
+                max_us=self.max,
+                buckets=[[bound, n] for bound, n in zip(bounds, self.buckets)
+                         if n != 0])
+
+
+def histogram(name):
+    hist = _histograms.get(name)
+    if hist is None:
+        with _lock:
+            hist = _histograms.setdefault(name, Histogram())
+    return hist
+
+
+def timed(func):
+    """Decorator recording the duration of each call to func."""
+    if not _enabled:
+        return func
+    hist = histogram(func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            hist.add(time.perf_counter() - start)
+    return wrapper
+
+
+class _TimedQueue:
+    """Times each message from get() returning it until task_done()."""
+
+    __slots__ = ("_queue", "_hist", "_start")
+
+    def __init__(self, queue, hist):
+        self._queue = queue
+        self._hist = hist
+        self._start = None
+
+    async def get(self):
+        message = await self._queue.get()
+        self._start = time.perf_counter()
+        return message
+
+    def task_done(self):
+        self._queue.task_done()
+        if self._start is not None:
+            self._hist.add(time.perf_counter() - self._start)
+            self._start = None
+
+
+async def timed_consumer(name, consumer, queue):
+    """Run consumer(queue), recording how long each message takes.
+
+    The time waiting for the next message isn't counted, but any time
+    the consumer spends awaiting while handling a message is.
+    """
+    return await consumer(_TimedQueue(queue, histogram(name)))
+
+
+def _sample_gil():
+    # Sleeping releases the GIL: any delay in waking up beyond the
+    # interval is mostly spent waiting for another thread to drop it.
+    hist = histogram("gil_wait")
+    while True:
+        start = time.perf_counter()
+        time.sleep(GIL_SAMPLE_INTERVAL)
+        hist.add(max(time.perf_counter() - start - GIL_SAMPLE_INTERVAL, 0))
+
+
+def start():
+    """Start estimating GIL wait times, if instrumentation is enabled."""
+    global _sampler
+    if not _enabled or _sampler is not None:
+        return
+    _sampler = threading.Thread(target=_sample_gil, name="gil-sampler",
+                                daemon=True)
+    _sampler.start()
+
+
+def report():
+    """Return a summary of each histogram, or None if disabled."""
+    if not _enabled:
+        return None
+    with _lock:
+        histograms = list(_histograms.items())
+    return {name: hist.summary() for name, hist in sorted(histograms)}
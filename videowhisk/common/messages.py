@@ -14,6 +14,57 @@ class Message:
         raise NotImplementedError()
 
 
+class Negotiate(Message):
+    """Negotiate the wire encoding used on a control connection.
+
+    A client lists the encodings it supports in order of preference,
+    and the server replies with the single encoding it has chosen.
+    """
+    __slots__ = ("encodings",)
+    message_type = "negotiate"
+
+    def __init__(self, encodings):
+        self.encodings = encodings
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            encodings=self.encodings,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(list(data["encodings"]))
+
+
+class Subscribe(Message):
+    """Restrict the messages sent to a control connection.
+
+    Only messages whose type is in message_types are sent, and
+    messages about a single channel are only sent if the channel is in
+    channels.  Either restriction can be None to allow everything.
+    """
+    __slots__ = ("message_types", "channels")
+    message_type = "subscribe"
+
+    def __init__(self, message_types=None, channels=None):
+        self.message_types = message_types
+        self.channels = channels
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            message_types=self.message_types,
+            channels=self.channels,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(data["message_types"], data["channels"])
+
+
 class MixerConfig(Message):
     __slots__ = ("control_addr", "clock_addr", "avsource_addr",
                  "avoutput_uri", "composite_modes", "video_caps",
@@ -119,6 +170,68 @@ class AudioMixStatus(Message):
         assert data["type"] == cls.message_type
         return cls(data["active_source"], data["volumes"])
 
+    def apply_delta(self, delta):
+        """Return a new AudioMixStatus updated by an AudioMixStatusDelta."""
+        volumes = dict(self.volumes)
+        for channel in delta.removed:
+            volumes.pop(channel, None)
+        volumes.update(delta.volumes)
+        return AudioMixStatus(delta.active_source, volumes)
+
+
+class AudioMixStatusDelta(Message):
+    """Changes to the audio mixer since the previous status message.
+
+    volumes holds only the sources added or whose volume changed, and
+    removed lists the sources that have gone away.
+    """
+    __slots__ = ("active_source", "volumes", "removed")
+    message_type = "audio-mix-status-delta"
+
+    def __init__(self, active_source, volumes, removed):
+        self.active_source = active_source
+        self.volumes = volumes
+        self.removed = removed
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            active_source=self.active_source,
+            volumes=self.volumes,
+            removed=self.removed,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(data["active_source"], data["volumes"],
+                   list(data["removed"]))
+
+
+class AudioLevels(Message):
+    """RMS and peak levels in dB for each audio channel of each source.
+
+    The levels of the mixer output are included under "output".
+    """
+    __slots__ = ("rms", "peak")
+    message_type = "audio-levels"
+
+    def __init__(self, rms, peak):
+        self.rms = rms
+        self.peak = peak
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            rms=self.rms,
+            peak=self.peak,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(data["rms"], data["peak"])
+
 
 class SetAudioSource(Message):
     __slots__ = ("active_source",)
@@ -139,14 +252,49 @@ class SetAudioSource(Message):
         return cls(data["active_source"])
 
 
+class SetAudioVolume(Message):
+    __slots__ = ("channel", "volume")
+    message_type = "set-audio-volume"
+
+    def __init__(self, channel, volume):
+        self.channel = channel
+        self.volume = volume
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            channel=self.channel,
+            volume=self.volume,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(data["channel"], data["volume"])
+
+
 class VideoMixStatus(Message):
-    __slots__ = ("composite_mode", "source_a", "source_b")
+    """The state of the video mixer.
+
+    slots maps each slot of the composite mode to the channel shown in
+    it (or None).  source_a and source_b mirror slots "a" and "b" for
+    clients that only know about two sources.  switch_time is the
+    stream time of the first output frame rendered with the current
+    layout, if known.
+    """
+    __slots__ = ("composite_mode", "source_a", "source_b", "slots",
+                 "switch_time")
     message_type = "video-mix-status"
 
-    def __init__(self, composite_mode, source_a, source_b):
+    def __init__(self, composite_mode, source_a, source_b, slots=None,
+                 switch_time=None):
         self.composite_mode = composite_mode
         self.source_a = source_a
         self.source_b = source_b
+        if slots is None:
+            slots = dict(a=source_a, b=source_b)
+        self.slots = slots
+        self.switch_time = switch_time
 
     def serialise(self):
         return dict(
@@ -154,22 +302,34 @@ class VideoMixStatus(Message):
             composite_mode=self.composite_mode,
             source_a=self.source_a,
             source_b=self.source_b,
+            slots=self.slots,
+            switch_time=self.switch_time,
         )
 
     @classmethod
     def deserialise(cls, data):
         assert data["type"] == cls.message_type
-        return cls(data["composite_mode"], data["source_a"], data["source_b"])
+        return cls(data["composite_mode"], data["source_a"], data["source_b"],
+                   data.get("slots"), data.get("switch_time"))
 
 
 class SetVideoSource(Message):
-    __slots__ = ("composite_mode", "source_a", "source_b")
+    """Set the composite mode and the channels shown in slots a and b.
+
+    transition names how to animate the change ("cut", "fade" or
+    "slide"), taking duration milliseconds.
+    """
+    __slots__ = ("composite_mode", "source_a", "source_b", "transition",
+                 "duration")
     message_type = "set-video-source"
 
-    def __init__(self, composite_mode, source_a, source_b):
+    def __init__(self, composite_mode, source_a, source_b,
+                 transition="cut", duration=0):
         self.composite_mode = composite_mode
         self.source_a = source_a
         self.source_b = source_b
+        self.transition = transition
+        self.duration = duration
 
     def serialise(self):
         return dict(
@@ -177,28 +337,212 @@ class SetVideoSource(Message):
             composite_mode=self.composite_mode,
             source_a=self.source_a,
             source_b=self.source_b,
+            transition=self.transition,
+            duration=self.duration,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(data["composite_mode"], data["source_a"], data["source_b"],
+                   data.get("transition", "cut"), data.get("duration", 0))
+
+
+class SetVideoLayout(Message):
+    """Set the composite mode and the channels shown in its slots.
+
+    Slots missing from the slots mapping keep their current channel,
+    while slots mapped to None are cleared.
+    """
+    __slots__ = ("composite_mode", "slots")
+    message_type = "set-video-layout"
+
+    def __init__(self, composite_mode, slots):
+        self.composite_mode = composite_mode
+        self.slots = slots
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            composite_mode=self.composite_mode,
+            slots=self.slots,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(data["composite_mode"], data["slots"])
+
+
+class ReloadConfig(Message):
+    """Ask the server to re-read its configuration."""
+    __slots__ = ()
+    message_type = "reload-config"
+
+    def serialise(self):
+        return dict(type=self.message_type)
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls()
+
+
+class ClockStats(Message):
+    """Network clock statistics reported by an ingest client.
+
+    remote_addr is the address the client sends its sources from.
+    rtt is the average round trip time to the clock server and offset
+    the difference between the server clock and the client's local
+    clock, both in nanoseconds.  discontinuity is the largest
+    correction applied to the client's clock since the last report,
+    and rate the clock's current rate relative to the server.
+    """
+    __slots__ = ("remote_addr", "synced", "rtt", "offset", "discontinuity",
+                 "rate")
+    message_type = "clock-stats"
+
+    def __init__(self, remote_addr, synced, rtt, offset, discontinuity, rate):
+        self.remote_addr = remote_addr
+        self.synced = synced
+        self.rtt = rtt
+        self.offset = offset
+        self.discontinuity = discontinuity
+        self.rate = rate
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            remote_addr=self.remote_addr[:2],
+            synced=self.synced,
+            rtt=self.rtt,
+            offset=self.offset,
+            discontinuity=self.discontinuity,
+            rate=self.rate,
         )
 
     @classmethod
     def deserialise(cls, data):
         assert data["type"] == cls.message_type
-        return cls(data["composite_mode"], data["source_a"], data["source_b"])
+        return cls(tuple(data["remote_addr"]), data["synced"], data["rtt"],
+                   data["offset"], data["discontinuity"], data["rate"])
+
+
+class FrameStats(Message):
+    """Frame accounting for each inter channel between pipelines.
+
+    channels maps channel names to a dict of counters.  Video
+    channels count frames output, and frames repeated and dropped
+    because the two pipelines drifted apart.  Audio channels count
+    nanoseconds output, and nanoseconds of underrun (filled with
+    silence) and overrun (discarded).
+    """
+    __slots__ = ("channels",)
+    message_type = "frame-stats"
+
+    def __init__(self, channels):
+        self.channels = channels
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            channels=self.channels,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(data["channels"])
+
+
+class SourceStats(Message):
+    """How fast the server is receiving an ingest client's streams.
+
+    name is the connection's name and remote_addr the address the
+    client sends its sources from.  bytes counts the bytes received
+    on the connection, and byte_rate gives the bytes per second over
+    the last interval.  streams maps each channel to a dict giving the
+    buffers received and the buffers per second, if the server counts
+    them.  rtt is the server's
+    estimate of the round trip time in nanoseconds, and out_of_order
+    counts segments that arrived out of order, a sign of packet loss.
+    Either may be None if the kernel doesn't report them.
+    """
+    __slots__ = ("name", "remote_addr", "bytes", "byte_rate", "streams",
+                 "rtt", "out_of_order")
+    message_type = "source-stats"
+
+    def __init__(self, name, remote_addr, bytes, byte_rate, streams, rtt,
+                 out_of_order):
+        self.name = name
+        self.remote_addr = remote_addr
+        self.bytes = bytes
+        self.byte_rate = byte_rate
+        self.streams = streams
+        self.rtt = rtt
+        self.out_of_order = out_of_order
+
+    def serialise(self):
+        return dict(
+            type=self.message_type,
+            name=self.name,
+            remote_addr=self.remote_addr[:2],
+            bytes=self.bytes,
+            byte_rate=self.byte_rate,
+            streams=self.streams,
+            rtt=self.rtt,
+            out_of_order=self.out_of_order,
+        )
+
+    @classmethod
+    def deserialise(cls, data):
+        assert data["type"] == cls.message_type
+        return cls(data["name"], tuple(data["remote_addr"]), data["bytes"],
+                   data["byte_rate"], data["streams"], data["rtt"],
+                   data["out_of_order"])
 
 
 _message_class_by_type = {
     cls.message_type: cls for cls in [
+        Negotiate,
+        Subscribe,
         MixerConfig,
         AudioSourceAdded,
         AudioSourceRemoved,
         VideoSourceAdded,
         VideoSourceRemoved,
         AudioMixStatus,
+        AudioMixStatusDelta,
+        AudioLevels,
         SetAudioSource,
+        SetAudioVolume,
         VideoMixStatus,
         SetVideoSource,
+        SetVideoLayout,
+        ReloadConfig,
+        ClockStats,
+        FrameStats,
+        SourceStats,
     ]}
 
 
+_message_fields_by_class = {}
+
+
+def message_class(type):
+    return _message_class_by_type[type]
+
+
+def message_fields(cls):
+    """Return the names of a message class's fields in constructor order."""
+    fields = _message_fields_by_class.get(cls)
+    if fields is None:
+        fields = tuple(name for klass in reversed(cls.__mro__)
+                       for name in klass.__dict__.get("__slots__", ()))
+        _message_fields_by_class[cls] = fields
+    return fields
+
+
 def deserialise(data):
     type = data.get("type")
     cls = _message_class_by_type[type]
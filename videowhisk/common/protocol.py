@@ -1,13 +1,15 @@
 import asyncio
-import json
 import logging
 import struct
 
-from . import messages
+from . import encoding, messages
 
 
 log = logging.getLogger(__name__)
 
+# High bit of the length prefix marks MessagePack encoded messages
+_MSGPACK_FLAG = 0x80000000
+
 
 class ControlProtocol(asyncio.Protocol):
     """A simple protocol that sends and receives length prefixed JSON objects
@@ -15,13 +17,21 @@ class ControlProtocol(asyncio.Protocol):
     The format is inspired by the "native messaging" protocol from
     WebExtensions, but always uses big endian encoding for the lengths
     rather than the native byte order.
+
+    Either peer may send a Negotiate message to switch to the more
+    compact MessagePack encoding.  Such messages are marked by setting
+    the high bit of the length, so messages in either encoding can
+    always be decoded.
     """
 
     def __init__(self):
         super().__init__()
         self.have_length = False
         self.message_length = 0
+        self.message_binary = False
         self.buffered = b""
+        self.encoding = encoding.JSON
+        self._negotiating = False
 
     def connection_made(self, transport):
         self.transport = transport
@@ -33,29 +43,67 @@ class ControlProtocol(asyncio.Protocol):
             if self.have_length:
                 if len(self.buffered) < self.message_length:
                     break
-                self._decode_message(self.buffered[:self.message_length])
+                self._decode_message(self.buffered[:self.message_length],
+                                     self.message_binary)
                 self.have_length = False
                 self.buffered = self.buffered[self.message_length:]
                 self.message_length = 0
             else:
                 if len(self.buffered) < 4:
                     break
-                (self.message_length,) = struct.unpack_from(">I", self.buffered)
+                (length,) = struct.unpack_from(">I", self.buffered)
+                self.message_binary = bool(length & _MSGPACK_FLAG)
+                self.message_length = length & ~_MSGPACK_FLAG
                 self.buffered = self.buffered[4:]
                 self.have_length = True
 
-    def _decode_message(self, data):
+    def _decode_message(self, data, binary):
         try:
-            msg = messages.deserialise(json.loads(data))
+            if binary:
+                msg = encoding.MSGPACK.decode(data)
+            else:
+                msg = encoding.JSON.decode(data)
         except Exception:
             log.exception("Error decoding message:")
             return
+        if isinstance(msg, messages.Negotiate):
+            self._negotiate_received(msg)
+            return
         self.message_received(msg)
 
     def message_received(self, message):
         raise NotImplementedError
 
+    def request_encoding(self, names=None):
+        """Ask the peer to switch to one of the named encodings."""
+        if names is None:
+            names = list(encoding.encodings)
+        self._negotiating = True
+        self.send_message(messages.Negotiate(names))
+
+    def _negotiate_received(self, msg):
+        chosen = encoding.choose_encoding(msg.encodings)
+        if chosen is None:
+            log.warning("No supported encoding in %r", msg.encodings)
+            chosen = encoding.JSON
+        if self._negotiating:
+            # This is the reply to our own request
+            self._negotiating = False
+        else:
+            # Reply using the old encoding before switching
+            self.send_message(messages.Negotiate([chosen.name]))
+        self.encoding = chosen
+
+    def encode_message(self, message):
+        """Encode a message for sending with send_encoded()."""
+        encoded = self.encoding.encode(message)
+        length = len(encoded)
+        if self.encoding is encoding.MSGPACK:
+            length |= _MSGPACK_FLAG
+        return struct.pack(">I", length) + encoded
+
+    def send_encoded(self, data):
+        self.transport.write(data)
+
     def send_message(self, message):
-        encoded = json.dumps(message.serialise()).encode("UTF-8")
-        self.transport.write(struct.pack(">I", len(encoded)))
-        self.transport.write(encoded)
+        self.send_encoded(self.encode_message(message))
@@ -0,0 +1,88 @@
+"""Describe the live state of pipelines for debugging.
+
+snapshot_pipeline() returns a JSON serialisable description of a
+pipeline's elements, their state, the caps negotiated on their pads,
+queue levels and the pipeline latency.  dot_graph() returns the same
+topology as a Graphviz DOT graph, like GST_DEBUG_DUMP_DOT_DIR would
+write, but on demand.
+"""
+
+from gi.repository import Gst
+
+from . import tracing
+
+
+# Queue properties reported for queue elements
+_QUEUE_PROPS = ("current-level-buffers", "current-level-bytes",
+                "current-level-time", "max-size-buffers", "max-size-bytes",
+                "max-size-time")
+
+
+def _state_name(element):
+    _, state, pending = element.get_state(0)
+    name = Gst.Element.state_get_name(state)
+    if pending != Gst.State.VOID_PENDING:
+        name += " -> " + Gst.Element.state_get_name(pending)
+    return name
+
+
+def _pad_info(pad):
+    caps = pad.get_current_caps()
+    peer = pad.get_peer()
+    info = dict(
+        name=pad.get_name(),
+        direction=pad.get_direction().value_nick,
+        caps=caps.to_string() if caps is not None else None,
+        peer=None)
+    if peer is not None and peer.get_parent_element() is not None:
+        info["peer"] = "{}.{}".format(
+            peer.get_parent_element().get_name(), peer.get_name())
+    return info
+
+
+def _element_info(element, channel):
+    factory = element.get_factory()
+    info = dict(
+        name=element.get_name(),
+        factory=factory.get_name() if factory is not None else None,
+        state=_state_name(element),
+        channel=channel,
+        pads=[_pad_info(pad) for pad in element.iterate_pads()])
+    if info["factory"] == "queue":
+        info["queue"] = {prop: element.get_property(prop)
+                         for prop in _QUEUE_PROPS}
+    return info
+
+
+def snapshot_pipeline(pipeline, element_channels=None):
+    channels = element_channels() if element_channels else {}
+    result = dict(name=pipeline.get_name(), state=_state_name(pipeline),
+                  latency=None, position=None)
+    query = Gst.Query.new_latency()
+    if pipeline.query(query):
+        live, min_latency, max_latency = query.parse_latency()
+        result["latency"] = dict(live=live, min=min_latency,
+                                 max=(max_latency if max_latency !=
+                                      Gst.CLOCK_TIME_NONE else None))
+    ok, position = pipeline.query_position(Gst.Format.TIME)
+    if ok:
+        result["position"] = position
+    result["elements"] = [
+        _element_info(element, channels.get(element.get_name()))
+        for element in pipeline.iterate_recurse()]
+    return result
+
+
+def snapshot_all():
+    """Return snapshots of every registered pipeline, keyed by name."""
+    return {name: snapshot_pipeline(pipeline, element_channels)
+            for name, (pipeline, element_channels)
+            in sorted(tracing.registered_pipelines().items())}
+
+
+def dot_graph(name):
+    """Return the DOT graph of the named pipeline, or None."""
+    entry = tracing.registered_pipelines().get(name)
+    if entry is None:
+        return None
+    return Gst.debug_bin_to_dot_data(entry[0], Gst.DebugGraphDetails.ALL)
@@ -0,0 +1,49 @@
+"""Read TCP connection statistics with the Linux TCP_INFO socket option.
+
+Which statistics are meaningful depends on the direction data flows.
+The sender of a stream has the smoothed round trip time (rtt) and
+counts the segments it retransmitted (total_retrans).  The receiver
+only has its own estimate of the round trip time (rcv_rtt), counts
+the bytes received (bytes_received), and counts segments that arrived
+out of order (rcv_ooopack), which is mostly down to loss and
+retransmission.  Times are in microseconds.
+"""
+
+import socket
+import struct
+
+
+# Offsets and struct formats of fields of struct tcp_info in
+# linux/tcp.h.  Older kernels return a shorter struct, without the
+# fields at the end.
+_FIELDS = {
+    "rtt": (68, "I"),
+    "rttvar": (72, "I"),
+    "rcv_rtt": (92, "I"),
+    "total_retrans": (100, "I"),
+    "bytes_received": (128, "Q"),
+    "rcv_ooopack": (224, "I"),
+}
+
+_TCP_INFO_SIZE = 232
+
+
+def read(sock):
+    """Return a dict of the fields the kernel provides for sock.
+
+    Returns None if TCP_INFO isn't supported, or sock is closed.
+    """
+    try:
+        data = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO,
+                               _TCP_INFO_SIZE)
+    except (AttributeError, OSError):
+        return None
+    return parse(data)
+
+
+def parse(data):
+    info = {}
+    for name, (offset, fmt) in _FIELDS.items():
+        if offset + struct.calcsize(fmt) <= len(data):
+            info[name] = struct.unpack_from("=" + fmt, data, offset)[0]
+    return info
@@ -0,0 +1,267 @@
+"""Collect GStreamer tracer records into per-pipeline reports.
+
+Tracers have to be chosen before Gst.init() is called, so enable()
+sets up the environment for them.  Once GStreamer is initialised,
+start() installs a log function that parses the records logged by the
+tracers, rather than leaving them to be printed and grepped, and
+stop() removes it again.  Nothing is installed unless enable() was
+given some tracers, as the log function calls into Python for every
+message GStreamer logs.  The records are summarised per element, and
+report() attributes the elements to the pipelines registered with
+register_pipeline(), and where known to the channel they carry.  The
+registry of live pipelines is also used for snapshots of their state.
+
+The latency tracer is part of GStreamer, while proctime, queuelevel
+and interlatency come from GstShark: tracers that aren't installed
+are skipped by GStreamer with a warning.
+"""
+
+import argparse
+import os
+import threading
+
+from gi.repository import Gst
+
+
+DEFAULT_TRACERS = ["latency(flags=pipeline+element)", "proctime",
+                   "queuelevel", "interlatency"]
+
+# Fields naming the element a record describes, in order of preference
+_ELEMENT_FIELDS = ("element", "src-element", "queue", "from_pad", "pad")
+
+# Fields naming the other end of a record describing a path
+_TARGET_FIELDS = ("sink-element", "to_pad")
+
+# Numeric fields that are identifiers or timestamps, not measurements
+_IGNORED_FIELDS = {"ts", "thread-id"}
+
+_enabled = False
+_collector = None
+_quiet = False
+_pipelines = {}
+_lock = threading.Lock()
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--trace", nargs="?", const=",".join(DEFAULT_TRACERS),
+        metavar="TRACERS",
+        help="Enable GStreamer tracers (default: {})".format(
+            ",".join(DEFAULT_TRACERS)))
+
+
+def parse_known_args(argv):
+    """Return the tracers requested in argv, ignoring other options.
+
+    For programs that parse the rest of their arguments after
+    initialising GStreamer.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(parser)
+    args, _ = parser.parse_known_args(argv)
+    return args.trace
+
+
+def _split_tracers(tracers):
+    # Commas separate tracers, except inside a tracer's parameters
+    result = []
+    depth = 0
+    current = ""
+    for c in tracers:
+        if c == "," and depth == 0:
+            result.append(current)
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(c, 0)
+        current += c
+    result.append(current)
+    return [t.strip() for t in result if t.strip()]
+
+
+def enable(tracers):
+    """Enable the comma separated tracers.  Call before Gst.init()."""
+    global _enabled, _quiet
+    if not tracers:
+        return
+    _enabled = True
+    os.environ["GST_TRACERS"] = ";".join(_split_tracers(tracers))
+    debug = os.environ.get("GST_DEBUG")
+    if debug:
+        os.environ["GST_DEBUG"] = debug + ",GST_TRACER:7"
+    else:
+        os.environ["GST_DEBUG"] = "GST_TRACER:7"
+        # Nothing else will be logged, so don't print the records
+        _quiet = True
+
+
+def start():
+    """Start collecting records if tracers were enabled."""
+    global _collector
+    if _collector is not None or not _enabled:
+        return
+    _collector = TraceCollector()
+    Gst.debug_add_log_function(_collector.log, None)
+    if _quiet:
+        Gst.debug_remove_log_function(None)
+
+
+def stop():
+    """Stop collecting records, removing the log function."""
+    global _collector
+    if _collector is None:
+        return
+    # The default log function stays removed when quiet, as it would
+    # print the records the tracers carry on logging.
+    Gst.debug_remove_log_function(_collector.log)
+    _collector = None
+
+
+def register_pipeline(pipeline, element_channels=None):
+    """Include pipeline in reports.
+
+    element_channels is an optional function returning a dict mapping
+    the names of elements in the pipeline to the channel they carry.
+    """
+    with _lock:
+        _pipelines[pipeline.get_name()] = (pipeline, element_channels)
+
+
+def unregister_pipeline(pipeline):
+    with _lock:
+        entry = _pipelines.get(pipeline.get_name())
+        if entry is not None and entry[0] is pipeline:
+            del _pipelines[pipeline.get_name()]
+
+
+def registered_pipelines():
+    """Return a dict mapping names to (pipeline, element_channels)."""
+    with _lock:
+        return dict(_pipelines)
+
+
+def report():
+    """Return the tracer report, or None if tracing is disabled."""
+    if _collector is None:
+        return None
+    pipelines = sorted(registered_pipelines().items())
+    element_stats = _collector.snapshot()
+
+    result = dict(tracers=os.environ["GST_TRACERS"].split(";"),
+                  pipelines={}, unattributed={})
+    owners = {}
+    for name, (pipeline, element_channels) in pipelines:
+        channels = element_channels() if element_channels else {}
+        for element in pipeline.iterate_recurse():
+            owners[element.get_name()] = (name, channels.get(
+                element.get_name()))
+        result["pipelines"][name] = {}
+
+    for element, records in sorted(element_stats.items()):
+        owner = owners.get(element) or owners.get(
+            _match_element(element, owners))
+        if owner is None:
+            result["unattributed"][element] = records
+            continue
+        name, channel = owner
+        result["pipelines"][name][element] = dict(
+            channel=channel, records=records)
+    return result
+
+
+def _match_element(name, elements):
+    """Find the element a pad description like "queue0_src" refers to."""
+    best = None
+    for element in elements:
+        if name.startswith(element) and (best is None or
+                                         len(element) > len(best)):
+            best = element
+    return best
+
+
+def _parse_time(value):
+    """Parse a duration given as a string like "0:00:00.000123456"."""
+    try:
+        hours, minutes, seconds = value.split(":")
+        return round((int(hours) * 3600 + int(minutes) * 60 +
+                      float(seconds)) * Gst.SECOND)
+    except ValueError:
+        return None
+
+
+class FieldStats:
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = None
+        self.last = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.last = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def summary(self):
+        return dict(count=self.count, mean=self.total / self.count,
+                    max=self.max, last=self.last)
+
+
+class TraceCollector:
+    """Summarises the numeric fields of tracer records per element."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Maps element name to record key to field name to FieldStats
+        self._stats = {}
+
+    def log(self, category, level, file, function, line, obj, message,
+            user_data=None):
+        if (level != Gst.DebugLevel.TRACE or
+                category.get_name() != "GST_TRACER"):
+            return
+        structure = Gst.Structure.from_string(message.get())[0]
+        if structure is not None:
+            self.add_record(structure)
+
+    def add_record(self, structure):
+        element = target = None
+        values = {}
+        for i in range(structure.n_fields()):
+            field = structure.nth_field_name(i)
+            value = structure.get_value(field)
+            if element is None and field in _ELEMENT_FIELDS:
+                element = value
+            elif target is None and field in _TARGET_FIELDS:
+                target = value
+            elif field in _IGNORED_FIELDS or field.endswith("-id"):
+                continue
+            elif isinstance(value, str):
+                value = _parse_time(value)
+                if value is not None:
+                    values[field] = value
+            elif isinstance(value, (int, float)) and not isinstance(
+                    value, bool):
+                values[field] = value
+        if element is None or not values:
+            return
+
+        key = structure.get_name()
+        if target is not None:
+            key = "{} -> {}".format(key, target)
+        with self._lock:
+            fields = self._stats.setdefault(element, {}).setdefault(key, {})
+            for field, value in values.items():
+                stats = fields.get(field)
+                if stats is None:
+                    stats = fields[field] = FieldStats()
+                stats.add(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {element: {key: {field: stats.summary()
+                                    for field, stats in fields.items()}
+                              for key, fields in records.items()}
+                    for element, records in self._stats.items()}
@@ -5,12 +5,17 @@ import sys
 
 import asyncio_glib
 
-# We need to initialise gst-python before importing our own code
+# We need to initialise gst-python before importing our own code,
+# apart from enabling tracers which must happen first.
 import gi
 gi.require_version('Gst', '1.0')
 gi.require_version('GstNet', '1.0')
 from gi.repository import Gst
+from ..common import tracing
+
+tracing.enable(tracing.parse_known_args(sys.argv[1:]))
 Gst.init(None)
+tracing.start()
 
 from . import client
 
@@ -32,3 +37,4 @@ try:
     loop.run_until_complete(task)
 except asyncio.CancelledError:
     pass
+tracing.stop()
@@ -1,6 +1,16 @@
 import argparse
+import json
 
 from . import pipeline
+from ..common import tracing
+
+
+def parse_label(value):
+    stream, sep, label = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(
+            "Expected STREAM=LABEL, got {!r}".format(value))
+    return (stream, label)
 
 
 class Client:
@@ -12,6 +22,11 @@ class Client:
         parser = argparse.ArgumentParser()
         parser.add_argument("--host", type=str)
         parser.add_argument("--port", type=int)
+        parser.add_argument("--name", type=str,
+                            help="The name to give our sources")
+        parser.add_argument("--label", type=parse_label, action="append",
+                            default=[], metavar="STREAM=LABEL",
+                            help="Label a stream (e.g. video_0=wide)")
         parser.add_argument("--video", nargs="?", const="/dev/video0",
                             action="append", default=[], metavar="DEVICE",
                             help="A video source to ingest")
@@ -24,15 +39,29 @@ class Client:
         parser.add_argument("--audio-test", nargs="?", const="sine",
                             action="append", default=[], metavar="WAVE",
                             help="An audio test source")
+        tracing.add_arguments(parser)
+        parser.add_argument("--trace-report", type=str, metavar="FILE",
+                            help="Write the tracer report to FILE on exit")
         return parser.parse_args(argv[1:])
 
     async def run(self, args):
         ingest = pipeline.IngestPipeline(self._loop)
         try:
             await ingest.run((args.host, args.port),
+                             name=args.name,
+                             labels=dict(args.label),
                              video=args.video,
                              video_test=args.video_test,
                              audio=args.audio,
                              audio_test=args.audio_test)
         except pipeline.PipelineError:
             pass
+        finally:
+            if args.trace_report:
+                # The pipeline has been unregistered by now, so use
+                # the report taken before then if there is one.
+                report = ingest.trace_report
+                if report is None:
+                    report = tracing.report()
+                with open(args.trace_report, "w") as fp:
+                    json.dump(report, fp, indent=2)
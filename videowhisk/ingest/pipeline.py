@@ -1,30 +1,72 @@
 import asyncio
 import logging
+import secrets
 import socket
 
 from gi.repository import GLib, Gst, GstNet
 
-from ..common import messages, protocol
+from ..common import handshake, messages, protocol, tcpinfo, tracing
 
 
 log = logging.getLogger(__name__)
 
+# Seconds to wait for the network clock to synchronise before starting
+CLOCK_SYNC_TIMEOUT = 10
+
+# Seconds between clock statistics reports to the server
+CLOCK_STATS_INTERVAL = 5
+
+# Seconds to wait before reconnecting a dropped AV stream
+RECONNECT_DELAY = 0.5
+
+# The messages ControlClient handles, leaving out audio levels and the
+# statistics meant for monitoring tools.
+SUBSCRIBED_MESSAGES = [
+    messages.MixerConfig,
+    messages.AudioSourceAdded, messages.AudioSourceRemoved,
+    messages.VideoSourceAdded, messages.VideoSourceRemoved,
+    messages.AudioMixStatus, messages.AudioMixStatusDelta,
+    messages.VideoMixStatus, messages.SourceStats,
+]
+
 
 class PipelineError(RuntimeError):
     pass
 
 
+class ConnectionLost(PipelineError):
+    pass
+
+
 class ControlClient(protocol.ControlProtocol):
 
     def __init__(self, cfg_future):
         super().__init__()
         self._cfg_future = cfg_future
         self.local_addr = None
+        # The socket our sources are sent over
+        self.av_sock = None
         self._local_sources = set()
 
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.request_encoding()
+        self.subscribe()
+
+    def subscribe(self, channels=None):
+        """Only receive the messages we handle, about channels.
+
+        With channels None, messages about any channel are received.
+        """
+        self.send_message(messages.Subscribe(
+            [cls.message_type for cls in SUBSCRIBED_MESSAGES],
+            sorted(channels) if channels is not None else None))
+
     def message_received(self, msg):
         if isinstance(msg, messages.MixerConfig):
-            self._cfg_future.set_result(msg)
+            # The server resends its configuration when reloaded
+            if not self._cfg_future.done():
+                self._cfg_future.set_result(msg)
         elif isinstance(msg, (messages.VideoSourceAdded,
                               messages.AudioSourceAdded)):
             if (self.local_addr is not None and
@@ -34,15 +76,54 @@ class ControlClient(protocol.ControlProtocol):
                               messages.AudioSourceRemoved)):
             if (self.local_addr is not None and
                 msg.remote_addr == self.local_addr):
-                self._local_sources.remove(msg.channel)
-        elif isinstance(msg, messages.AudioMixStatus):
+                self._local_sources.discard(msg.channel)
+        elif isinstance(msg, (messages.AudioMixStatus,
+                              messages.AudioMixStatusDelta)):
             if msg.active_source in self._local_sources:
                 print("Active audio source")
         elif isinstance(msg, messages.VideoMixStatus):
-            if msg.source_a in self._local_sources:
-                print("Active video A")
-            if msg.source_b in self._local_sources:
-                print("Active video B")
+            for slot, channel in sorted(msg.slots.items()):
+                if channel in self._local_sources:
+                    print("Active video {}".format(slot.upper()))
+        elif isinstance(msg, messages.SourceStats):
+            if (self.local_addr is not None and
+                msg.remote_addr == self.local_addr):
+                print(format_source_stats(msg, tcpinfo.read(self.av_sock)
+                                          if self.av_sock else None))
+
+
+def expected_channels(name, labels, video_count, audio_count):
+    """Return the channels the server will name our streams.
+
+    The server's demuxer names the pads like our muxer does, and the
+    channels are "{name}.{label}", with labels defaulting to the pad
+    names.
+    """
+    pads = (["video_{}".format(i) for i in range(video_count)] +
+            ["audio_{}".format(i) for i in range(audio_count)])
+    labels = labels or {}
+    return {"{}.{}".format(name, labels.get(pad, pad)) for pad in pads}
+
+
+def format_source_stats(msg, info):
+    """Describe the server's view of our streams, and our own.
+
+    As the sender, we know the round trip time and how many segments
+    were retransmitted from info, the TCP_INFO of our socket.
+    """
+    text = "Server receiving {:.0f} kB/s".format(msg.byte_rate / 1000)
+    # Streams are only listed if the server counts their buffers
+    if msg.streams:
+        text += " ({})".format(", ".join(
+            "{} {:.1f}/s".format(channel, stats["rate"])
+            for channel, stats in sorted(msg.streams.items())))
+    if info is not None and "rtt" in info:
+        text += ", rtt {:.1f} ms".format(info["rtt"] / 1000)
+    if info is not None and "total_retrans" in info:
+        text += ", {} retransmits".format(info["total_retrans"])
+    if msg.out_of_order:
+        text += ", {} out of order at server".format(msg.out_of_order)
+    return text
 
 
 def choose_video_caps(supported_caps, target_caps):
@@ -94,39 +175,154 @@ class IngestPipeline:
     def __init__(self, loop):
         self._loop = loop
         self._pipeline = None
+        # Maps element names to the label of the stream they carry
+        self._element_labels = {}
+        # The tracer report taken as the last pipeline was destroyed
+        self.trace_report = None
         self._done = False
         self._done_future = self._loop.create_future()
+        self._clock_stats = None
+        self._max_discontinuity = 0
+        # Lets the server hand our channels back to us if we reconnect
+        self._session = secrets.token_hex(16)
 
-    async def run(self, control_addr, *, video=(), video_test=(),
-                  audio=(), audio_test=()):
+    async def run(self, control_addr, *, name=None, labels=None, video=(),
+                  video_test=(), audio=(), audio_test=()):
         cfg_future = self._loop.create_future()
         _, protocol = await self._loop.create_connection(
             lambda: ControlClient(cfg_future),
             control_addr[0], control_addr[1], )
         cfg = await cfg_future
+        # Without a name, our channels are only known once added
+        if name is not None:
+            protocol.subscribe(expected_channels(
+                name, labels, len(video) + len(video_test),
+                len(audio) + len(audio_test)))
 
-        log.info("Connecting to avsource server at %r", cfg.avsource_addr)
+        log.info("Creating NetClientClock for address %r", cfg.clock_addr)
+        clock = GstNet.NetClientClock.new(
+            'videowhisk', cfg.clock_addr[0], cfg.clock_addr[1], 0)
+        clock_bus = Gst.Bus.new()
+        clock_bus.add_watch(GLib.PRIORITY_DEFAULT, self.on_clock_message)
+        clock.props.bus = clock_bus
+        if not await self.wait_for_sync(clock, CLOCK_SYNC_TIMEOUT):
+            log.warning("Clock not synchronised after %d seconds, "
+                        "starting anyway", CLOCK_SYNC_TIMEOUT)
+
+        report_task = self._loop.create_task(
+            self.report_clock_stats(protocol))
+        try:
+            while True:
+                try:
+                    sock = await self.connect(cfg.avsource_addr, name,
+                                              labels)
+                except OSError as exc:
+                    log.warning("Could not connect to avsource server: %s",
+                                exc)
+                    await asyncio.sleep(RECONNECT_DELAY)
+                    continue
+                protocol.local_addr = sock.getsockname()[:2]
+                protocol.av_sock = sock
+                self.make_pipeline(cfg, sock, clock, labels=labels,
+                                   video=video, video_test=video_test,
+                                   audio=audio, audio_test=audio_test)
+                try:
+                    await self._done_future
+                    return
+                except ConnectionLost as exc:
+                    log.warning("Lost connection to avsource server: %s",
+                                exc)
+                finally:
+                    self.destroy_pipeline()
+                    protocol.av_sock = None
+                    sock.close()
+                await asyncio.sleep(RECONNECT_DELAY)
+                self._done = False
+                self._done_future = self._loop.create_future()
+        finally:
+            report_task.cancel()
+            clock.props.bus = None
+            clock_bus.remove_watch()
+
+    async def connect(self, avsource_addr, name=None, labels=None):
+        """Connect to the avsource server and send our handshake.
+
+        The server names our channels "{name}.{label}", where labels
+        maps the matroskamux pad names (e.g. "video_0") to labels.
+        """
+        header = {"session": self._session}
+        if name is not None:
+            header["name"] = name
+        if labels:
+            header["streams"] = labels
+        log.info("Connecting to avsource server at %r", avsource_addr)
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setblocking(False)
-        await self._loop.sock_connect(sock, cfg.avsource_addr)
-        protocol.local_addr = sock.getsockname()[:2]
-        self._eos_future = self._loop.create_future()
-        self.make_pipeline(cfg, sock, video=video, video_test=video_test,
-                           audio=audio, audio_test=audio_test)
         try:
-            await self._done_future
+            await self._loop.sock_connect(sock, avsource_addr)
+            await self._loop.sock_sendall(sock, handshake.encode(header))
+        except:
+            sock.close()
+            raise
+        return sock
+
+    async def wait_for_sync(self, clock, timeout):
+        """Wait up to timeout seconds for the clock to synchronise.
+
+        Unlike Gst.Clock.wait_for_sync, this does not block the event
+        loop.  Returns whether the clock is synchronised.
+        """
+        fut = self._loop.create_future()
+        def on_synced(clock, synced):
+            if synced:
+                self._loop.call_soon_threadsafe(
+                    lambda: fut.done() or fut.set_result(True))
+        handler_id = clock.connect("synced", on_synced)
+        try:
+            if clock.is_synced():
+                return True
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
         finally:
-            self.destroy_pipeline()
-
-    def make_pipeline(self, cfg, sock, *, video=(), video_test=(),
-                      audio=(), audio_test=()):
-        log.info("Creating NetClientClock for address %r", cfg.clock_addr)
-        clock = GstNet.NetClientClock.new(
-            'videowhisk', cfg.clock_addr[0], cfg.clock_addr[1], 0)
-        clock.wait_for_sync(Gst.CLOCK_TIME_NONE)
+            clock.disconnect(handler_id)
+
+    def on_clock_message(self, bus, msg):
+        structure = msg.get_structure()
+        if (msg.type != Gst.MessageType.ELEMENT or structure is None or
+                structure.get_name() != "gst-netclock-statistics"):
+            return True
+        remote = structure.get_value("remote")
+        local = structure.get_value("local")
+        discontinuity = structure.get_value("discontinuity")
+        self._max_discontinuity = max(self._max_discontinuity,
+                                      abs(discontinuity))
+        self._clock_stats = dict(
+            synced=structure.get_value("synchronised"),
+            rtt=structure.get_value("rtt-average"),
+            offset=remote - local,
+            rate=structure.get_value("rate"))
+        return True
 
-        self._pipeline = Gst.Pipeline()
+    async def report_clock_stats(self, protocol):
+        while True:
+            await asyncio.sleep(CLOCK_STATS_INTERVAL)
+            # The server identifies us by the address we send from
+            if self._clock_stats is None or protocol.local_addr is None:
+                continue
+            protocol.send_message(messages.ClockStats(
+                protocol.local_addr, discontinuity=self._max_discontinuity,
+                **self._clock_stats))
+            self._max_discontinuity = 0
+
+    def make_pipeline(self, cfg, sock, clock, *, labels=None, video=(),
+                      video_test=(), audio=(), audio_test=()):
+        self._pipeline = Gst.Pipeline("ingest")
         self._pipeline.use_clock(clock)
+        self._element_labels = {}
+        tracing.register_pipeline(self._pipeline, self.element_channels)
+        labels = labels or {}
 
         mux = Gst.ElementFactory.make("matroskamux", "mux")
         sink = Gst.ElementFactory.make("fdsink", "sink")
@@ -138,6 +334,11 @@ class IngestPipeline:
         video_caps = Gst.Caps.from_string(cfg.video_caps)
         audio_caps = Gst.Caps.from_string(cfg.audio_caps)
 
+        video_pads = ("video_{}".format(i) for i in range(
+            len(video) + len(video_test)))
+        audio_pads = ("audio_{}".format(i) for i in range(
+            len(audio) + len(audio_test)))
+
         for videosrc in video:
             src = Gst.ElementFactory.make("v4l2src")
             src.props.device = videosrc
@@ -154,31 +355,58 @@ class IngestPipeline:
             convert.link(scale)
             scale.link(rate)
             rate.link_filtered(mux, video_caps)
+            self._label_branch(mux, next(video_pads), labels,
+                               [src, convert, scale, rate])
 
         for videosrc in video_test:
             src = Gst.ElementFactory.make("videotestsrc")
             src.props.pattern = videosrc
             self._pipeline.add(src)
             src.link_filtered(mux, video_caps)
+            self._label_branch(mux, next(video_pads), labels, [src])
 
         for audiosrc in audio:
             src = Gst.ElementFactory.make("alsasrc")
             src.props.device = audiosrc
             self._pipeline.add(src)
             src.link_filtered(mux, audio_caps)
+            self._label_branch(mux, next(audio_pads), labels, [src])
 
         for audiosrc in audio_test:
             src = Gst.ElementFactory.make("audiotestsrc")
             src.props.wave = audiosrc
             self._pipeline.add(src)
             src.link_filtered(mux, audio_caps)
+            self._label_branch(mux, next(audio_pads), labels, [src])
 
         bus = self._pipeline.get_bus()
         bus.add_watch(GLib.PRIORITY_DEFAULT, self.on_bus_message)
 
         self._pipeline.set_state(Gst.State.PLAYING)
 
+    def _label_branch(self, mux, pad_name, labels, elements):
+        """Record the label of the stream elements feed to mux's pad.
+
+        Like the server, streams are labelled by their pad name unless
+        given a label.  The capsfilter added by linking is included.
+        """
+        pad = mux.get_static_pad(pad_name)
+        peer = pad.get_peer() if pad is not None else None
+        if peer is not None:
+            elements = elements + [peer.get_parent_element()]
+        label = labels.get(pad_name, pad_name)
+        for element in elements:
+            self._element_labels[element.get_name()] = label
+
+    def element_channels(self):
+        return dict(self._element_labels)
+
     def destroy_pipeline(self):
+        # The report attributes elements to registered pipelines only
+        report = tracing.report()
+        if report is not None:
+            self.trace_report = report
+        tracing.unregister_pipeline(self._pipeline)
         self._pipeline.set_state(Gst.State.NULL)
         bus = self._pipeline.get_bus()
         bus.remove_watch()
@@ -192,7 +420,11 @@ class IngestPipeline:
             log.warning("Pipeline reported error: %s", error.message)
             if debug:
                 log.info("    %s", debug)
-            self.set_done(PipelineError(error.message))
+            # A write error from the sink means the server went away
+            if msg.src.get_name() == "sink":
+                self.set_done(ConnectionLost(error.message))
+            else:
+                self.set_done(PipelineError(error.message))
         return True
 
     def set_done(self, error):
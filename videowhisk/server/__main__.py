@@ -1,16 +1,32 @@
+import argparse
 import asyncio
 import logging
 import signal
-import sys
 
 import asyncio_glib
 
-# We need to initialise gst-python before importing our own code
+# We need to initialise gst-python before importing our own code,
+# apart from the tracing and instrumentation options.
 import gi
 gi.require_version('Gst', '1.0')
 gi.require_version('GstNet', '1.0')
+gi.require_version('GstController', '1.0')
 from gi.repository import Gst
+from ..common import instrument, tracing
+
+parser = argparse.ArgumentParser(prog="python3 -m videowhisk.server")
+parser.add_argument("config", nargs="*", help="Configuration files")
+tracing.add_arguments(parser)
+instrument.add_arguments(parser)
+args = parser.parse_args()
+
+tracing.enable(args.trace)
 Gst.init(None)
+tracing.start()
+# Instrumented callbacks are wrapped as their modules are imported
+if args.instrument:
+    instrument.enable()
+    instrument.start()
 
 from . import config, server
 
@@ -22,7 +38,12 @@ loop = asyncio.get_event_loop()
 loop.add_signal_handler(signal.SIGINT, loop.stop)
 
 config = config.Config()
+for filename in args.config:
+    config.read_file(filename)
 server = server.Server(config, loop)
+loop.run_until_complete(server.start())
+loop.add_signal_handler(
+    signal.SIGHUP, lambda: loop.create_task(server.reload_config()))
 
 print("ControlServer on port {}".format(server.control.local_port()))
 print("AVSourceServer on port {}".format(server.sources.local_port()))
@@ -30,3 +51,4 @@ print("AVOutputServer on port {}".format(server.outputs.local_port()))
 
 loop.run_forever()
 loop.run_until_complete(server.close())
+tracing.stop()
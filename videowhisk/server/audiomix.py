@@ -1,26 +1,87 @@
+import asyncio
+import logging
+
 from gi.repository import Gst
 
 from . import clock, utils
-from ..common import base_pipeline, messages
+from ..common import base_pipeline, instrument, messages
+
+
+log = logging.getLogger(__name__)
+
+# Number of delta status messages to send between full snapshots
+FULL_STATUS_INTERVAL = 50
+
+# Levels are reported in dB, clamped to this value for silence
+MIN_LEVEL = -100.0
+
+# Key used for the mixer output in AudioLevels messages
+OUTPUT_LEVEL = "output"
+
+# Range of the audiomixer pads' volume property
+MAX_VOLUME = 10.0
+
+
+def _get_levels(structure, field):
+    """Read the per audio channel dB values from a level message."""
+    ok, array = structure.get_array(field)
+    if not ok:
+        return []
+    return [round(max(array.get_nth(i), MIN_LEVEL), 1)
+            for i in range(array.n_values)]
+
 
 class AudioMix(base_pipeline.BasePipeline):
-    def __init__(self, config, bus, loop):
+    def __init__(self, config, bus, loop, frame_stats=None):
         super().__init__("audiomix")
         self._closed = False
         self._loop = loop
         self._config = config
         self._bus = bus
+        self._frame_stats = frame_stats
         bus.add_consumer((messages.AudioSourceMessage,
-                          messages.SetAudioSource), self.handle_message)
+                          messages.SetAudioSource,
+                          messages.SetAudioVolume), self.handle_message)
         self._sources = {}
         self._active_source = None
-        self.make_pipeline()
+        # Cached volume of each source, and changes since the last
+        # status message was sent.
+        self._volumes = {}
+        self._changed_volumes = {}
+        self._removed_sources = set()
+        self._active_source_changed = False
+        self._deltas_since_full_status = 0
+        # Latest RMS and peak levels, indexed by the level element's name
+        self._level_channels = {}
+        self._rms = {}
+        self._peak = {}
+        self._levels_updated = False
+        # Sources being removed from the pipeline
+        self._closing_tasks = set()
+        # Messages wait in the queue until the pipeline is playing
+        self._started = loop.create_future()
+        self._levels_task = self._loop.create_task(self.publish_levels())
+
+    async def start(self):
+        """Build the pipeline in a worker thread and start it playing."""
+        try:
+            await self._loop.run_in_executor(None, self.make_pipeline)
+        except Exception:
+            utils.set_future_result(self._started, False)
+            raise
+        utils.set_future_result(self._started, True)
 
     async def close(self):
         if self._closed:
             return
         self._closed = True
-        self.destroy_pipeline()
+        # Let messages for a mixer that never started be discarded
+        utils.set_future_result(self._started, False)
+        await utils.cancel_task(self._levels_task)
+        for task in list(self._closing_tasks):
+            await utils.cancel_task(task)
+        if self.pipeline is not None:
+            await self.destroy_pipeline_async(self._loop)
 
     def set_clock(self):
         self.pipeline.use_clock(clock.get_clock())
@@ -30,35 +91,84 @@ class AudioMix(base_pipeline.BasePipeline):
         self._mixer = Gst.ElementFactory.make("audiomixer")
         tee = Gst.ElementFactory.make("tee")
         queue = Gst.ElementFactory.make("queue")
+        level = make_level(self._config)
         sink = Gst.ElementFactory.make("interaudiosink")
         sink.props.channel = "audiomix.output"
-        self.pipeline.add(self._mixer, tee, queue, sink)
+        if self._frame_stats is not None:
+            self._frame_stats.watch_sink(sink, "audio")
+        self.pipeline.add(self._mixer, tee, queue, level, sink)
         self._mixer.link_filtered(tee, self._config.audio_caps)
         tee.link(queue)
-        queue.link(sink)
+        queue.link(level)
+        level.link(sink)
+        self._level_channels[level.get_name()] = OUTPUT_LEVEL
+
+        bus = self.pipeline.get_bus()
+        self._bus_element_id = bus.connect(
+            "message::element", self.on_bus_element)
         self.pipeline.set_state(Gst.State.PLAYING)
 
     def destroy_pipeline(self):
+        self.pipeline.get_bus().disconnect(self._bus_element_id)
         # Don't bother closing each source: they should be cleaned up
         # when the pipeline is unrefed.
         self._sources.clear()
+        self._volumes.clear()
+        self._level_channels.clear()
         self._mixer = None
         super().destroy_pipeline()
 
+    def element_channels(self):
+        return {el.get_name(): channel
+                for channel, source in list(self._sources.items())
+                for el in source.elements}
+
+    @instrument.timed
+    def on_bus_element(self, bus, msg):
+        structure = msg.get_structure()
+        if structure is None or structure.get_name() != "level":
+            return
+        channel = self._level_channels.get(msg.src.get_name())
+        if channel is None:
+            return
+        self._rms[channel] = _get_levels(structure, "rms")
+        self._peak[channel] = _get_levels(structure, "peak")
+        self._levels_updated = True
+
+    async def publish_levels(self):
+        """Post the levels of all sources in one message per interval."""
+        interval = self._config.audio_level_interval / Gst.SECOND
+        while True:
+            await asyncio.sleep(interval)
+            if not self._levels_updated:
+                continue
+            self._levels_updated = False
+            await self._bus.post(messages.AudioLevels(
+                dict(self._rms), dict(self._peak)))
+
     async def handle_message(self, queue):
+        if not await self._started:
+            await utils.discard_messages(queue)
         while True:
             message = await queue.get()
             if isinstance(message, messages.AudioSourceAdded):
                 source = AudioMixSource(
                     self._config, self.pipeline, message.channel,
-                    self._mixer, self._loop)
+                    self._mixer, self._loop, self._frame_stats)
                 self._sources[message.channel] = source
+                self._level_channels[source.level_name] = source.channel
+                self._volume_changed(source.channel, source.volume)
             elif isinstance(message, messages.AudioSourceRemoved):
                 source = self._sources.pop(message.channel, None)
                 if source is not None:
-                    await source.close()
+                    self._close_source(source)
+                    del self._level_channels[source.level_name]
+                    self._rms.pop(source.channel, None)
+                    self._peak.pop(source.channel, None)
+                    self._source_removed(source.channel)
                     if self._active_source == source.channel:
                         self._active_source = None
+                        self._active_source_changed = True
             elif isinstance(message, messages.SetAudioSource):
                 if self._active_source != message.active_source and (
                         message.active_source is None or
@@ -66,20 +176,85 @@ class AudioMix(base_pipeline.BasePipeline):
                     if self._active_source is not None:
                         self._sources[self._active_source].mute = True
                     self._active_source = message.active_source
+                    self._active_source_changed = True
                     if self._active_source is not None:
                         self._sources[self._active_source].mute = False
+            elif isinstance(message, messages.SetAudioVolume):
+                source = self._sources.get(message.channel)
+                if not valid_volume(message.volume):
+                    log.warning("Ignoring invalid volume %r for %s",
+                                message.volume, message.channel)
+                elif (source is not None and
+                        self._volumes[source.channel] != message.volume):
+                    source.volume = message.volume
+                    self._volume_changed(source.channel, message.volume)
             queue.task_done()
-            await self._bus.post(self.make_audio_mix_status())
+            status = self.make_audio_mix_status_delta()
+            if status is not None:
+                await self._bus.post(status)
             source = None
 
+    def _close_source(self, source):
+        # Closing waits for the source's data to drain, so don't hold
+        # up other messages in the mean time.
+        task = self._loop.create_task(source.close())
+        self._closing_tasks.add(task)
+        task.add_done_callback(self._closing_tasks.discard)
+
+    def _volume_changed(self, channel, volume):
+        self._volumes[channel] = volume
+        self._changed_volumes[channel] = volume
+        self._removed_sources.discard(channel)
+
+    def _source_removed(self, channel):
+        del self._volumes[channel]
+        self._changed_volumes.pop(channel, None)
+        self._removed_sources.add(channel)
+
     def make_audio_mix_status(self):
-        volumes = {source.channel: source.volume
-                   for source in self._sources.values()}
-        return messages.AudioMixStatus(self._active_source, volumes)
+        return messages.AudioMixStatus(self._active_source, dict(self._volumes))
+
+    def make_audio_mix_status_delta(self):
+        """Return a status message describing changes since the last call.
+
+        Returns None if nothing has changed.  Every
+        FULL_STATUS_INTERVAL messages, a full AudioMixStatus is
+        returned instead so clients can resynchronise.
+        """
+        if not (self._changed_volumes or self._removed_sources or
+                self._active_source_changed):
+            return None
+        if self._deltas_since_full_status >= FULL_STATUS_INTERVAL:
+            status = self.make_audio_mix_status()
+            self._deltas_since_full_status = 0
+        else:
+            status = messages.AudioMixStatusDelta(
+                self._active_source, self._changed_volumes,
+                sorted(self._removed_sources))
+            self._deltas_since_full_status += 1
+        self._changed_volumes = {}
+        self._removed_sources = set()
+        self._active_source_changed = False
+        return status
+
+
+def valid_volume(volume):
+    return (isinstance(volume, (int, float)) and
+            not isinstance(volume, bool) and 0 <= volume <= MAX_VOLUME)
+
+
+def make_level(config):
+    # Channels can be re-added before the old level has been removed,
+    # so leave GStreamer to give it a unique name.
+    level = Gst.ElementFactory.make("level")
+    level.props.interval = config.audio_level_interval
+    level.props.post_messages = True
+    return level
 
 
 class AudioMixSource:
-    def __init__(self, config, pipeline, channel, mixer, loop):
+    def __init__(self, config, pipeline, channel, mixer, loop,
+                 frame_stats=None):
         self._pipeline = pipeline
         self.channel = channel
         self._mixer = mixer
@@ -87,17 +262,26 @@ class AudioMixSource:
 
         self._source = Gst.ElementFactory.make("interaudiosrc")
         self._source.props.channel = "{}.mix".format(channel)
+        if frame_stats is not None:
+            frame_stats.watch_src(self._source, "audio")
         self._filter = Gst.ElementFactory.make("capsfilter")
         self._filter.props.caps = config.audio_caps
+        self._level = make_level(config)
+        self.level_name = self._level.get_name()
         self._queue = Gst.ElementFactory.make("queue")
-        self._pipeline.add(self._source, self._filter, self._queue)
+        self.elements = [self._source, self._filter, self._level,
+                         self._queue]
+        self._pipeline.add(*self.elements)
         self._source.link(self._filter)
-        self._filter.link(self._queue)
+        self._filter.link(self._level)
+        self._level.link(self._queue)
         self._queue.link(self._mixer)
         self._sink_pad = self._queue.get_static_pad("src").get_peer()
         self._sink_pad.props.mute = True
+        self._volume = self._sink_pad.props.volume
 
         self._queue.sync_state_with_parent()
+        self._level.sync_state_with_parent()
         self._filter.sync_state_with_parent()
         self._source.sync_state_with_parent()
 
@@ -106,13 +290,17 @@ class AudioMixSource:
         self._source.get_static_pad("src").add_probe(
             Gst.PadProbeType.BLOCK_DOWNSTREAM, self._source_pad_probe, fut)
         await fut
+        await self._loop.run_in_executor(None, self._remove_elements)
 
-        # Stop the elements and remove them from the pipeline:
-        for el in [self._source, self._filter, self._queue]:
+    def _remove_elements(self):
+        # Stop the elements and remove them from the pipeline.  This
+        # runs in a worker thread, as stopping them can block.
+        for el in self.elements:
             el.set_state(Gst.State.NULL)
             self._pipeline.remove(el)
         self._mixer.release_request_pad(self._sink_pad)
 
+    @instrument.timed
     def _source_pad_probe(self, pad, info, fut):
         pad.remove_probe(info.id)
 
@@ -126,6 +314,7 @@ class AudioMixSource:
         self._filter.get_static_pad("sink").send_event(Gst.Event.new_eos())
         return Gst.PadProbeReturn.OK
 
+    @instrument.timed
     def _queue_pad_probe(self, pad, info, fut):
         # Pass any non-EOS events on
         if info.get_event().type != Gst.EventType.EOS:
@@ -138,4 +327,12 @@ class AudioMixSource:
         return Gst.PadProbeReturn.DROP
 
     mute = utils.forward_prop("_sink_pad.props.mute")
-    volume = utils.forward_prop("_sink_pad.props.volume")
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._sink_pad.props.volume = value
+        self._volume = value
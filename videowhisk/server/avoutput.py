@@ -1,6 +1,11 @@
 import asyncio
+import collections
+import fcntl
+import json
 import logging
 import socket
+import struct
+import termios
 
 from gi.repository import Gst
 try:
@@ -9,18 +14,36 @@ except ImportError:
     from http_parser.pyparser import HttpParser
 
 from . import clock, utils
-from ..common import base_pipeline, messages
+from ..common import base_pipeline, instrument, messages, snapshot
 
 
 log = logging.getLogger(__name__)
 
 
+ClientStats = collections.namedtuple(
+    "ClientStats", ["fileno", "bytes_sent", "connect_duration",
+                    "dropped_buffers", "lag", "bytes_queued"])
+
+
+def _socket_bytes_queued(fileno):
+    """Return the number of unsent bytes in a socket's send queue."""
+    try:
+        data = fcntl.ioctl(fileno, termios.TIOCOUTQ, b"\0\0\0\0")
+    except OSError:
+        return None
+    return struct.unpack("i", data)[0]
+
+
 class AVOutputServer:
 
-    def __init__(self, config, bus, loop):
+    def __init__(self, config, bus, loop, metrics_factory=None,
+                 frame_stats=None):
         self._loop = loop
         self._closed = False
         self._config = config
+        self._frame_stats = frame_stats
+        # Returns the JSON serialisable data served at /metrics
+        self._metrics_factory = metrics_factory
         bus.add_consumer(messages.SourceMessage, self.handle_message)
         self._connections = {}
         self._monitors = {}
@@ -29,14 +52,15 @@ class AVOutputServer:
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._sock.bind(config.avoutput_addr)
         self._sock.listen(100)
+        self._run_task = self._loop.create_task(self.run())
 
-        # Add a special monitor for the mixer output
-        m = OutputMonitor("output", self)
+    async def start(self):
+        """Add the special monitor for the mixer output."""
+        m = await self._loop.run_in_executor(
+            None, OutputMonitor, "output", self)
         self._monitors["output"] = m
         m.start()
 
-        self._run_task = self._loop.create_task(self.run())
-
     async def close(self):
         if self._closed:
             return
@@ -94,6 +118,7 @@ class AVOutputServer:
 class AVMonitorBase(base_pipeline.BasePipeline):
 
     has_video = False
+    monitor_kind = None
 
     def __init__(self, channel, server):
         super().__init__("monitor.{}".format(channel))
@@ -108,13 +133,22 @@ class AVMonitorBase(base_pipeline.BasePipeline):
         if self._closed:
             return
         self._closed = True
-        self.destroy_pipeline()
+        await self.destroy_pipeline_async(self._loop)
         for fileno in self._filenos:
             await self._server._monitor_remove_fd(fileno)
 
     def make_source(self, mux):
         raise NotImplementedError()
 
+    def watch_src(self, src, kind):
+        frame_stats = self._server._frame_stats
+        if frame_stats is not None:
+            frame_stats.watch_src(src, kind)
+
+    def element_channels(self):
+        return {el.get_name(): self._channel
+                for el in self.pipeline.iterate_elements()}
+
     def set_clock(self):
         self.pipeline.use_clock(clock.get_clock())
 
@@ -125,8 +159,8 @@ class AVMonitorBase(base_pipeline.BasePipeline):
         mux.props.writing_app = "videowhisk"
         self._sink = Gst.ElementFactory.make("multifdsink")
         self._sink.props.blocksize = 1048576
-        self._sink.props.buffers_max = 500
-        self._sink.props.sync_method = 1 # "next-keyframe"
+        self.apply_policy(self._server._config.get_monitor_policy(
+            self._channel, self.monitor_kind))
 
         self.pipeline.add(mux, self._sink)
         self.make_source(mux)
@@ -143,6 +177,18 @@ class AVMonitorBase(base_pipeline.BasePipeline):
         self._sink = None
         super().destroy_pipeline()
 
+    def apply_policy(self, policy):
+        """Configure how the multifdsink treats slow clients."""
+        self._sink.props.sync_method = policy.sync_method
+        self._sink.props.recover_policy = policy.recover_policy
+        self._sink.props.units_format = policy.units_format
+        self._sink.props.units_max = policy.units_max
+        self._sink.props.units_soft_max = policy.units_soft_max
+        self._sink.props.buffers_max = policy.buffers_max
+        self._sink.props.time_min = policy.time_min
+        self._sink.props.burst_format = policy.burst_format
+        self._sink.props.burst_value = policy.burst_value
+
     def start(self):
         self.pipeline.set_state(Gst.State.PLAYING)
 
@@ -150,11 +196,42 @@ class AVMonitorBase(base_pipeline.BasePipeline):
         self._filenos.add(fileno)
         self._sink.emit("add", fileno)
 
+    def get_client_stats(self, fileno):
+        """Return a ClientStats tuple describing a client of the monitor.
+
+        The lag is the difference in nanoseconds between the most
+        recent buffer received by the sink and the last buffer sent to
+        the client.
+        """
+        stats = self._sink.emit("get-stats", fileno)
+        if stats is None:
+            return None
+        lag = None
+        last_ts = stats.get_value("last-buffer-ts")
+        sample = self._sink.props.last_sample
+        if (sample is not None and last_ts != Gst.CLOCK_TIME_NONE and
+                sample.get_buffer().pts != Gst.CLOCK_TIME_NONE):
+            lag = max(sample.get_buffer().pts - last_ts, 0)
+        return ClientStats(
+            fileno=fileno,
+            bytes_sent=stats.get_value("bytes-sent"),
+            connect_duration=stats.get_value("connect-duration"),
+            dropped_buffers=stats.get_value("dropped-buffers"),
+            lag=lag,
+            bytes_queued=_socket_bytes_queued(fileno))
+
+    def get_all_client_stats(self):
+        return [self.get_client_stats(fileno)
+                for fileno in sorted(self._filenos)]
+
+    @instrument.timed
     def on_client_removed(self, sink, fileno, status):
         if status == 3:
             log.warning("About to remove fd %d from multifdsink because "
-                        "it is too slow", fileno)
+                        "it is too slow: %r", fileno,
+                        self.get_client_stats(fileno))
 
+    @instrument.timed
     def on_client_fd_removed(self, sink, fileno):
         self._filenos.remove(fileno)
         self._loop.call_soon_threadsafe(
@@ -163,10 +240,13 @@ class AVMonitorBase(base_pipeline.BasePipeline):
 
 class AudioMonitor(AVMonitorBase):
 
+    monitor_kind = "audio"
+
     def make_source(self, mux):
         src = Gst.ElementFactory.make("interaudiosrc")
         src.props.channel = "{}.{}".format(self._channel, "monitor")
-        queue = Gst.ElementFactory.make("queue", "srcqueue")
+        self.watch_src(src, "audio")
+        queue = Gst.ElementFactory.make("queue")
         self.pipeline.add(src, queue)
         src.link_filtered(queue, self._server._config.audio_caps)
         queue.link(mux)
@@ -175,11 +255,13 @@ class AudioMonitor(AVMonitorBase):
 class VideoMonitor(AVMonitorBase):
 
     has_video = True
+    monitor_kind = "video"
 
     def make_source(self, mux):
         src = Gst.ElementFactory.make("intervideosrc")
         src.props.channel = "{}.{}".format(self._channel, "monitor")
-        queue = Gst.ElementFactory.make("queue", "srcqueue")
+        self.watch_src(src, "video")
+        queue = Gst.ElementFactory.make("queue")
         self.pipeline.add(src, queue)
         src.link_filtered(queue, self._server._config.video_caps)
         queue.link(mux)
@@ -188,18 +270,21 @@ class OutputMonitor(AVMonitorBase):
     """A monitor for the output from the audio and video mixers."""
 
     has_video = True
+    monitor_kind = "output"
 
     def make_source(self, mux):
         src = Gst.ElementFactory.make("intervideosrc")
         src.props.channel = "videomix.output"
-        queue = Gst.ElementFactory.make("queue", "vsrcqueue")
+        self.watch_src(src, "video")
+        queue = Gst.ElementFactory.make("queue")
         self.pipeline.add(src, queue)
         src.link_filtered(queue, self._server._config.video_caps)
         queue.link(mux)
 
         src = Gst.ElementFactory.make("interaudiosrc")
         src.props.channel = "audiomix.output"
-        queue = Gst.ElementFactory.make("queue", "asrcqueue")
+        self.watch_src(src, "audio")
+        queue = Gst.ElementFactory.make("queue")
         self.pipeline.add(src, queue)
         src.link_filtered(queue, self._server._config.audio_caps)
         queue.link(mux)
@@ -243,6 +328,20 @@ class AVOutputConnection:
             return
 
         channel = p.get_path().strip("/")
+        head = p.get_method() == "HEAD"
+        if (channel == "metrics" and
+                self._server._metrics_factory is not None):
+            await self.send_json(self._server._metrics_factory(), head)
+            return
+        if channel == "pipelines":
+            await self.send_json(snapshot.snapshot_all(), head)
+            return
+        if channel.startswith("pipelines/") and channel.endswith(".dot"):
+            graph = snapshot.dot_graph(channel[len("pipelines/"):-4])
+            if graph is not None:
+                await self.send_body(b"text/vnd.graphviz",
+                                     graph.encode("UTF-8"), head)
+                return
         monitor = self._server.get_monitor(channel)
         if monitor is None:
             response = (b"HTTP/1.1 404 Not Found\r\n"
@@ -258,7 +357,21 @@ class AVOutputConnection:
         else:
             response += b"Content-Type: audio/x-matroska\r\n\r\n"
         await self._loop.sock_sendall(self._sock, response)
-        if p.get_method() == "HEAD":
+        if head:
             await self.close()
             return
         monitor.add_fd(self._sock.fileno())
+
+    async def send_json(self, data, head):
+        await self.send_body(b"application/json",
+                             json.dumps(data).encode("UTF-8"), head)
+
+    async def send_body(self, content_type, body, head):
+        response = (b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: " + content_type + b"\r\n"
+                    b"Content-Length: " + str(len(body)).encode("ASCII") +
+                    b"\r\n\r\n")
+        if not head:
+            response += body
+        await self._loop.sock_sendall(self._sock, response)
+        await self.close()
@@ -1,39 +1,80 @@
 import asyncio
+import collections
 import logging
+import re
 import socket
+import threading
+import time
 
 from gi.repository import GLib, Gst
 
 from . import clock, utils
-from ..common import base_pipeline, messages
+from ..common import base_pipeline, handshake, instrument, messages, tcpinfo
 
 
 log = logging.getLogger(__name__)
 
+# Seconds to wait for a new connection's handshake
+HANDSHAKE_TIMEOUT = 5
+
+# Names given to connections and streams in the handshake.  They form
+# the channel name "{connection}.{stream}", so may not contain dots.
+_valid_name = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Names of the form given to unnamed connections, and those of other
+# pipelines, which may not be chosen by a client.
+_anonymous_name = re.compile(r"^c[0-9]+$")
+_reserved_names = {"audiomix", "videomix", "ingest", "monitor", "output"}
+
+# The names the demuxer gives its pads, used for unlabelled streams
+_pad_name = re.compile(r"^(audio|video|subtitle)_[0-9]+$")
+
+# The channels of a closed connection that may still be resumed
+DetachedSession = collections.namedtuple(
+    "DetachedSession", ["name", "session", "address", "audio_sources",
+                        "video_sources", "expire_handle"])
+
 
 class AVSourceServer:
 
-    def __init__(self, config, bus, loop):
+    def __init__(self, config, bus, loop, frame_stats=None):
         self._loop = loop
         self._closed = False
         self._config = config
         self._bus = bus
+        self._frame_stats = frame_stats
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.setblocking(False)
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._sock.bind(config.avsource_addr)
         self._sock.listen(100)
         self._connections = {}
+        # Maps session tokens to DetachedSessions
+        self._detached = {}
+        # Maps channel names to the connection or DetachedSession
+        # providing them
+        self._channels = {}
+        self._setup_tasks = set()
+        # Conversion branches are created from the demuxer's streaming
+        # threads, so limit them with a thread safe semaphore.
+        self._converters = threading.BoundedSemaphore(
+            config.convert_sources) if config.convert_sources > 0 else None
         self._run_task = self._loop.create_task(self.run())
+        self._stats_task = self._loop.create_task(self.publish_stats())
 
     async def close(self):
         if self._closed:
             return
         self._closed = True
         await utils.cancel_task(self._run_task)
+        await utils.cancel_task(self._stats_task)
+        for task in list(self._setup_tasks):
+            await utils.cancel_task(task)
         self._sock.close()
         for conn in list(self._connections.values()):
             await conn.close()
+        for session in list(self._detached):
+            await self._expire_session(session)
 
     def local_port(self):
         return self._sock.getsockname()[1]
@@ -44,19 +85,188 @@ class AVSourceServer:
             (sock, address) = await self._loop.sock_accept(self._sock)
             # We never send data to the AV source
             sock.shutdown(socket.SHUT_WR)
-            conn = AVSourceConnection(self, "c{}".format(counter), sock, address)
-            self._connections[conn.name] = conn
-            conn.start()
+            task = self._loop.create_task(self.setup_connection(
+                "c{}".format(counter), sock, address))
+            self._setup_tasks.add(task)
+            task.add_done_callback(self._setup_tasks.discard)
             counter += 1
 
+    async def publish_stats(self):
+        """Post a SourceStats message for each connection per interval."""
+        interval = self._config.source_stats_interval / Gst.SECOND
+        while True:
+            await asyncio.sleep(interval)
+            for conn in list(self._connections.values()):
+                await self._bus.post(conn.make_stats())
+
+    async def setup_connection(self, name, sock, address):
+        try:
+            header = await asyncio.wait_for(
+                handshake.read(self._loop, sock), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, handshake.HandshakeError,
+                OSError) as exc:
+            log.warning("Bad handshake from %r: %s", address, exc)
+            sock.close()
+            return
+        if header is None:
+            header = {}
+        session = header.get("session")
+        try:
+            name, streams = self._check_names(header, name, session)
+        except ValueError as exc:
+            log.warning("Rejecting connection from %r: %s", address, exc)
+            sock.close()
+            return
+
+        # A connection with a known session token takes over the
+        # channels of the old connection, which may not have noticed
+        # it was dropped yet.
+        audio_sources = video_sources = ()
+        if session is not None:
+            for conn in list(self._connections.values()):
+                if conn.session == session:
+                    await conn.close()
+            detached = self._detached.pop(session, None)
+            if detached is not None:
+                detached.expire_handle.cancel()
+                log.info("Connection from %r resumes %s", address,
+                         detached.name)
+                name = detached.name
+                audio_sources = detached.audio_sources
+                video_sources = detached.video_sources
+        # Another handshake may have taken the name while we waited
+        if self._name_in_use(name, session):
+            log.warning("Rejecting connection from %r: "
+                        "source name %r in use", address, name)
+            sock.close()
+            return
+
+        conn = AVSourceConnection(self, name, sock, address, session,
+                                  streams, audio_sources, video_sources)
+        self._connections[conn.name] = conn
+        for channel in conn.audio_sources + conn.video_sources:
+            self._channels[channel] = conn
+        conn.start()
+
+    def _check_names(self, header, name, session):
+        """Return the connection name and stream labels for a handshake.
+
+        Raises ValueError if they are invalid, or the name is used by
+        another session.
+        """
+        streams = header.get("streams", {})
+        if not isinstance(streams, dict):
+            raise ValueError("Stream labels are not an object")
+        for pad, label in streams.items():
+            if not isinstance(label, str) or not _valid_name.match(label):
+                raise ValueError("Invalid stream label {!r}".format(label))
+            # Unlabelled streams are named after their pad
+            if label != pad and (label in streams or
+                                 _pad_name.match(label)):
+                raise ValueError("Stream label {!r} is the name of "
+                                 "another stream".format(label))
+        if len(set(streams.values())) != len(streams):
+            raise ValueError("Duplicate stream labels")
+        if "name" not in header:
+            return name, streams
+
+        name = header["name"]
+        if not isinstance(name, str) or not _valid_name.match(name):
+            raise ValueError("Invalid source name {!r}".format(name))
+        if _anonymous_name.match(name) or name in _reserved_names:
+            raise ValueError("Source name {!r} is reserved".format(name))
+        if self._name_in_use(name, session):
+            raise ValueError("Source name {!r} in use".format(name))
+        return name, streams
+
+    def _name_in_use(self, name, session):
+        """Return whether another session owns the connection name."""
+        owners = list(self._connections.values())
+        owners.extend(self._detached.values())
+        return any(owner.name == name and (
+                       session is None or owner.session != session)
+                   for owner in owners)
+
+    def find_connection(self, name):
+        """Return the active connection with the given name, or None."""
+        return self._connections.get(name)
+
+    def is_source_address(self, address):
+        """Return whether a connection is sending from address."""
+        return any(tuple(conn.address[:2]) == address
+                   for conn in self._connections.values())
+
+    def find_source(self, channel):
+        """Return the connection providing a channel, or None.
+
+        The result is a DetachedSession if its client disconnected but
+        may still resume the channel.
+        """
+        return self._channels.get(channel)
+
     def _connection_closed(self, conn):
         del self._connections[conn.name]
 
+    def _detach(self, conn):
+        """Keep the channels of a closed connection for the grace period.
+
+        If a new connection resumes the session in time it takes over
+        the channels, so the mixers never see them removed.
+        """
+        handle = self._loop.call_later(
+            self._config.source_grace_period / Gst.SECOND,
+            lambda: self._loop.create_task(self._expire_session(conn.session)))
+        detached = DetachedSession(
+            conn.name, conn.session, conn.address, list(conn.audio_sources),
+            list(conn.video_sources), handle)
+        self._detached[conn.session] = detached
+        for channel in detached.audio_sources + detached.video_sources:
+            self._channels[channel] = detached
+
+    async def _expire_session(self, session):
+        detached = self._detached.pop(session, None)
+        if detached is None:
+            return
+        detached.expire_handle.cancel()
+        await self._post_removed(detached.address, detached.audio_sources,
+                                 detached.video_sources)
+
+    async def _post_removed(self, address, audio_sources, video_sources):
+        for channel in audio_sources + video_sources:
+            self._channels.pop(channel, None)
+        for channel in audio_sources:
+            await self._bus.post(messages.AudioSourceRemoved(
+                channel, address[:2]))
+        for channel in video_sources:
+            await self._bus.post(messages.VideoSourceRemoved(
+                channel, address[:2]))
+
+    def acquire_converter(self):
+        """Reserve one of the source conversion branches, if any are free.
+
+        This may be called from any thread.
+        """
+        if self._converters is None:
+            return False
+        return self._converters.acquire(blocking=False)
+
+    def release_converter(self):
+        self._converters.release()
+
+    def converted_sources(self):
+        """Return a dict mapping converted channels to their input caps."""
+        converted = {}
+        for conn in self._connections.values():
+            converted.update(conn.converted_sources)
+        return converted
+
     def make_source_messages(self):
         """Return a list of {Audio,Video}SourceAdded messages for sources."""
+        # Detached sessions still have their channels in the mixers
+        sources = list(self._connections.values())
+        sources.extend(self._detached.values())
         msgs = []
-        for name in sorted(self._connections.keys()):
-            conn = self._connections[name]
+        for conn in sorted(sources, key=lambda conn: conn.name):
             for channel in conn.video_sources:
                 msgs.append(messages.VideoSourceAdded(
                     channel, conn.address[:2]))
@@ -67,43 +277,73 @@ class AVSourceServer:
 
 
 class AVSourceConnection(base_pipeline.BasePipeline):
-    def __init__(self, server, name, sock, address):
+    def __init__(self, server, name, sock, address, session=None,
+                 streams=None, audio_sources=(), video_sources=()):
         super().__init__(name)
         self._server = server
         self._loop = server._loop
-        self._closed = False
+        self._close_task = None
         self.name = name
         self._sock = sock
         self.address = address
-        self.audio_sources = []
-        self.video_sources = []
+        self.session = session
+        # Maps demuxer pad names to the labels used in channel names
+        self.streams = streams or {}
+        # Maps the names of elements handling a single channel to it
+        self._element_channels = {}
+        # Channels resumed from a previous connection are already
+        # known to the mixers.
+        self.audio_sources = list(audio_sources)
+        self.video_sources = list(video_sources)
+        # Maps channels that need conversion to their input caps
+        self.converted_sources = {}
+        self._converters = 0
+        # Bytes received on the socket according to TCP_INFO, and
+        # buffers received per channel, counted by pad probes
+        self.bytes_read = 0
+        self.stream_buffers = {}
+        self._last_stats = (time.monotonic(), 0, {})
         self.make_pipeline()
 
     async def close(self):
-        if self._closed:
-            return
-        self._closed = True
-        self.destroy_pipeline()
+        # Anyone closing a connection that is already closing waits for
+        # it to finish, so its channels have been detached or removed
+        # by the time this returns.
+        if self._close_task is None:
+            self._close_task = self._loop.create_task(self._close())
+        await asyncio.shield(self._close_task)
+
+    async def _close(self):
+        # The socket can only be closed once fdsrc has stopped
+        await self.destroy_pipeline_async(self._loop)
         self._sock.close()
         self._server._connection_closed(self)
-        for channel in self.audio_sources:
-            await self._server._bus.post(messages.AudioSourceRemoved(
-                channel, self.address[:2]))
-        for channel in self.video_sources:
-            await self._server._bus.post(messages.VideoSourceRemoved(
-                channel, self.address[:2]))
+        for i in range(self._converters):
+            self._server.release_converter()
+        self._converters = 0
+        if (self.session is not None and not self._server._closed and
+                self._server._config.source_grace_period > 0):
+            self._server._detach(self)
+        else:
+            await self._server._post_removed(
+                self.address, self.audio_sources, self.video_sources)
 
     def set_clock(self):
         self.pipeline.use_clock(clock.get_clock())
 
+    def element_channels(self):
+        return dict(self._element_channels)
+
     def make_pipeline(self):
         super().make_pipeline()
-        fdsrc = Gst.ElementFactory.make("fdsrc", "fdsrc")
+        # Elements are left with their unique default names, so tracer
+        # records can be traced back to the connection.
+        fdsrc = Gst.ElementFactory.make("fdsrc")
         fdsrc.props.fd = self._sock.fileno()
         fdsrc.props.blocksize = 1048576
-        queue = Gst.ElementFactory.make("queue", "srcqueue")
+        queue = Gst.ElementFactory.make("queue")
 
-        self._demux = Gst.ElementFactory.make("matroskademux", "demux")
+        self._demux = Gst.ElementFactory.make("matroskademux")
         self._demux_signal_id = self._demux.connect('pad-added', self.on_demux_pad_added)
 
         self.pipeline.add(fdsrc, queue, self._demux)
@@ -118,6 +358,39 @@ class AVSourceConnection(base_pipeline.BasePipeline):
     def start(self):
         self.pipeline.set_state(Gst.State.PLAYING)
 
+    @instrument.timed
+    def _stream_probe(self, pad, info, channel):
+        self.stream_buffers[channel] += 1
+        return Gst.PadProbeReturn.OK
+
+    def make_stats(self):
+        """Return a SourceStats message with rates since the last call."""
+        now = time.monotonic()
+        last_time, last_bytes, last_buffers = self._last_stats
+        elapsed = max(now - last_time, 1e-9)
+        buffers = dict(self.stream_buffers)
+        streams = {
+            channel: dict(
+                buffers=count,
+                rate=(count - last_buffers.get(channel, 0)) / elapsed)
+            for channel, count in sorted(buffers.items())}
+        rtt = out_of_order = None
+        info = tcpinfo.read(self._sock)
+        # The kernel counts the bytes received, rather than a probe
+        if info is not None and "bytes_received" in info:
+            self.bytes_read = info["bytes_received"]
+        byte_rate = (self.bytes_read - last_bytes) / elapsed
+        self._last_stats = (now, self.bytes_read, buffers)
+        if info is not None:
+            # The server only sends ACKs, so only the receiver's
+            # estimate of the round trip time is kept up to date.
+            if "rcv_rtt" in info:
+                rtt = info["rcv_rtt"] * Gst.USECOND
+            out_of_order = info.get("rcv_ooopack")
+        return messages.SourceStats(
+            self.name, self.address[:2], self.bytes_read, byte_rate,
+            streams, rtt, out_of_order)
+
     def on_bus_eos(self):
         self._loop.call_soon_threadsafe(
             self._loop.create_task, self.close())
@@ -129,36 +402,93 @@ class AVSourceConnection(base_pipeline.BasePipeline):
         self._loop.call_soon_threadsafe(
             self._loop.create_task, self.close())
 
+    @instrument.timed
     def on_demux_pad_added(self, demux, src_pad):
+        config = self._server._config
         caps = src_pad.query_caps(None)
-        if caps.can_intersect(self._server._config.audio_caps):
-            channel = "{}.{}".format(self.name, src_pad.get_name())
-            log.info("Creating audio source %s", channel)
-            self.make_sink(src_pad, "interaudiosink", channel)
-            self._loop.call_soon_threadsafe(
-                self._loop.create_task,
-                self.audio_source_added(channel))
-        elif caps.can_intersect(self._server._config.video_caps):
-            channel = "{}.{}".format(self.name, src_pad.get_name())
-            log.info("Creating video source %s", channel)
-            self.make_sink(src_pad, "intervideosink", channel)
-            self._loop.call_soon_threadsafe(
-                self._loop.create_task,
-                self.video_source_added(channel))
+        pad_name = src_pad.get_name()
+        channel = "{}.{}".format(self.name,
+                                 self.streams.get(pad_name, pad_name))
+        # Counting buffers runs Python for each one, so is opt-in
+        if config.stream_stats:
+            self.stream_buffers[channel] = 0
+            src_pad.add_probe(Gst.PadProbeType.BUFFER, self._stream_probe,
+                              channel)
+        media_type = None
+        if not caps.is_empty():
+            media_type = caps.get_structure(0).get_name()
+        if caps.can_intersect(config.audio_caps):
+            self.add_audio_source(src_pad, channel)
+        elif caps.can_intersect(config.video_caps):
+            self.add_video_source(src_pad, channel)
+        elif (media_type in ("audio/x-raw", "video/x-raw") and
+              self._server.acquire_converter()):
+            self._converters += 1
+            log.info("Converting %s from %s", channel, caps.to_string())
+            self.converted_sources[channel] = caps.to_string()
+            if media_type == "audio/x-raw":
+                src_pad = self.make_converter(
+                    src_pad, ["audioconvert", "audioresample"],
+                    config.audio_caps, channel)
+                self.add_audio_source(src_pad, channel)
+            else:
+                src_pad = self.make_converter(
+                    src_pad, ["videoconvert", "videoscale", "videorate"],
+                    config.video_caps, channel)
+                self.add_video_source(src_pad, channel)
         else:
             # By not connecting to the pad, we'll trigger a bus error
             # that will close the connection.
             log.warning("Got unknown pad with caps %s", caps.to_string())
 
+    def add_audio_source(self, src_pad, channel):
+        log.info("Creating audio source %s", channel)
+        self.make_sink(src_pad, "interaudiosink", channel)
+        self._loop.call_soon_threadsafe(
+            self._loop.create_task,
+            self.audio_source_added(channel))
+
+    def add_video_source(self, src_pad, channel):
+        log.info("Creating video source %s", channel)
+        self.make_sink(src_pad, "intervideosink", channel)
+        self._loop.call_soon_threadsafe(
+            self._loop.create_task,
+            self.video_source_added(channel))
+
+    def make_converter(self, src_pad, factories, caps, channel):
+        """Link src_pad to a chain of elements converting it to caps.
+
+        Returns the source pad of the chain.
+        """
+        elements = [Gst.ElementFactory.make(f) for f in factories]
+        capsfilter = Gst.ElementFactory.make("capsfilter")
+        capsfilter.props.caps = caps
+        elements.append(capsfilter)
+        for el in elements:
+            self.pipeline.add(el)
+            self._element_channels[el.get_name()] = channel
+        for upstream, downstream in zip(elements, elements[1:]):
+            upstream.link(downstream)
+        for el in reversed(elements):
+            el.sync_state_with_parent()
+        src_pad.link(elements[0].get_static_pad("sink"))
+        return capsfilter.get_static_pad("src")
+
     def make_sink(self, src_pad, sinktype, channel):
         tee = Gst.ElementFactory.make("tee")
         self.pipeline.add(tee)
+        self._element_channels[tee.get_name()] = channel
         src_pad.link(tee.get_static_pad("sink"))
         for output in ["monitor", "mix"]:
             queue = Gst.ElementFactory.make("queue")
             sink = Gst.ElementFactory.make(sinktype)
             sink.props.channel = "{}.{}".format(channel, output)
+            if self._server._frame_stats is not None:
+                self._server._frame_stats.watch_sink(
+                    sink, "audio" if sinktype == "interaudiosink" else "video")
             self.pipeline.add(queue, sink)
+            self._element_channels[queue.get_name()] = channel
+            self._element_channels[sink.get_name()] = channel
             tee.link(queue)
             queue.link(sink)
             queue.sync_state_with_parent()
@@ -166,11 +496,17 @@ class AVSourceConnection(base_pipeline.BasePipeline):
         tee.sync_state_with_parent()
 
     async def audio_source_added(self, channel):
+        if channel in self.audio_sources:
+            return
         self.audio_sources.append(channel)
+        self._server._channels[channel] = self
         await self._server._bus.post(messages.AudioSourceAdded(
             channel, self.address[:2]))
 
     async def video_source_added(self, channel):
+        if channel in self.video_sources:
+            return
         self.video_sources.append(channel)
+        self._server._channels[channel] = self
         await self._server._bus.post(messages.VideoSourceAdded(
             channel, self.address[:2]))
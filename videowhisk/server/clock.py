@@ -1,5 +1,23 @@
+import collections
+import time
+
 from gi.repository import Gst, GstNet
 
+from ..common import messages
+
+
+# Number of reports kept for each ingest client
+CLOCK_STATS_HISTORY = 60
+
+# Seconds after which an ingest client that stopped reporting is dropped
+CLOCK_STATS_TIMEOUT = 60
+
+
+ClockQuality = collections.namedtuple(
+    "ClockQuality", ["remote_addr", "synced", "samples", "rtt_average",
+                     "rtt_max", "offset", "drift_ppm", "max_discontinuity",
+                     "age"])
+
 
 def get_clock():
     return Gst.SystemClock.obtain()
@@ -21,3 +39,65 @@ class ClockServer:
     def local_port(self):
         assert not self._closed
         return self._provider.props.port
+
+
+class ClockMonitor:
+    """Aggregates the clock statistics reported by ingest clients."""
+
+    def __init__(self, bus):
+        # Maps remote addresses to deques of (receive time, ClockStats)
+        self._history = {}
+        bus.add_consumer(messages.ClockStats, self.handle_message)
+
+    async def handle_message(self, queue):
+        while True:
+            message = await queue.get()
+            self.add_stats(message, time.monotonic())
+            queue.task_done()
+
+    def add_stats(self, stats, now):
+        self._prune(now)
+        history = self._history.get(stats.remote_addr)
+        if history is None:
+            history = collections.deque(maxlen=CLOCK_STATS_HISTORY)
+            self._history[stats.remote_addr] = history
+        history.append((now, stats))
+
+    def _prune(self, now):
+        # Clients that reconnect report from a new address, so forget
+        # addresses that stopped reporting.
+        for remote_addr, history in list(self._history.items()):
+            if now - history[-1][0] > CLOCK_STATS_TIMEOUT:
+                del self._history[remote_addr]
+
+    def get_clock_quality(self, now=None):
+        """Return a ClockQuality for each ingest client, by address.
+
+        drift_ppm is the rate at which the offset between the client's
+        local clock and the server clock changes over the reports
+        kept, which the network clock has to keep correcting.
+        """
+        if now is None:
+            now = time.monotonic()
+        self._prune(now)
+        quality = {}
+        for remote_addr, history in list(self._history.items()):
+            last_time, last = history[-1]
+            first_time, first = history[0]
+            drift_ppm = 0.0
+            if last_time > first_time:
+                drift_ppm = ((last.offset - first.offset) /
+                             (last_time - first_time) / 1000)
+            rtts = [stats.rtt for (t, stats) in history]
+            quality[remote_addr] = ClockQuality(
+                remote_addr=remote_addr,
+                synced=last.synced,
+                samples=len(history),
+                rtt_average=sum(rtts) // len(rtts),
+                rtt_max=max(rtts),
+                offset=last.offset,
+                drift_ppm=drift_ppm,
+                max_discontinuity=max(abs(stats.discontinuity)
+                                      for (t, stats) in history),
+                age=now - last_time)
+        return quality
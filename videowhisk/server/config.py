@@ -5,16 +5,53 @@ import collections
 from gi.repository import Gst
 
 
-CompositeMode = collections.namedtuple("CompositeMode", ["name", "a", "b"])
+# slots maps slot names (e.g. "a", "b") to CompositeInput geometry
+CompositeMode = collections.namedtuple("CompositeMode", ["name", "slots"])
 CompositeInput = collections.namedtuple(
     "CompositeInput", ["xpos", "width", "ypos", "height", "zorder", "alpha"])
+MonitorPolicy = collections.namedtuple(
+    "MonitorPolicy", ["sync_method", "recover_policy", "units_format",
+                      "units_max", "units_soft_max", "buffers_max",
+                      "time_min", "burst_format", "burst_value"])
+
+
+# Enumeration values used by multifdsink's properties
+_sync_methods = {
+    "latest": 0,
+    "next-keyframe": 1,
+    "latest-keyframe": 2,
+    "burst": 3,
+    "burst-keyframe": 4,
+    "burst-with-keyframe": 5,
+}
+_recover_policies = {
+    "none": 0,
+    "latest": 1,
+    "soft-limit": 2,
+    "keyframe": 3,
+}
+_unit_formats = {
+    "buffers": Gst.Format.BUFFERS,
+    "bytes": Gst.Format.BYTES,
+    "time": Gst.Format.TIME,
+}
+# Values of the aggregator's start-time-selection property
+_start_time_selections = {"zero", "first", "set"}
 
 
 def _decode_composite_mode(name, section, video_width, video_height):
-    """Decode a composite mode configuration section"""
-    a = _decode_composite_input(section, "a.", video_width, video_height)
-    b = _decode_composite_input(section, "b.", video_width, video_height)
-    return CompositeMode(name, a, b)
+    """Decode a composite mode configuration section
+
+    Each input slot is configured by properties prefixed with the
+    slot name, such as "a.left" or "c.zorder".
+    """
+    slot_names = sorted({key.split(".", 1)[0] for key in section.keys()
+                         if "." in key})
+    slots = collections.OrderedDict(
+        (slot, _decode_composite_input(
+            section, slot + ".", video_width, video_height))
+        for slot in slot_names)
+    return CompositeMode(name, slots)
 
 
 def _decode_composite_input(section, prefix, video_width, video_height):
@@ -54,6 +91,48 @@ def _decode_dimension(section, start_prop, length_prop, end_prop, total):
     else:
         return start, length
 
+def _decode_monitor_policy(section, defaults):
+    """Decode a multifdsink client buffering policy.
+
+    Limits are expressed in the units given by units_format and
+    burst_format, with time values given in milliseconds.  A limit of
+    -1 means there is no limit.  Properties not set in the section
+    are taken from defaults.
+    """
+    def get(prop):
+        value = section.get(prop)
+        if value is None:
+            value = defaults[prop]
+        return value
+
+    units_format = _decode_enum(get, "units_format", _unit_formats)
+    burst_format = _decode_enum(get, "burst_format", _unit_formats)
+    return MonitorPolicy(
+        sync_method=_decode_enum(get, "sync_method", _sync_methods),
+        recover_policy=_decode_enum(get, "recover_policy", _recover_policies),
+        units_format=units_format,
+        units_max=_decode_units(get, "units_max", units_format),
+        units_soft_max=_decode_units(get, "units_soft_max", units_format),
+        buffers_max=int(get("buffers_max")),
+        time_min=_decode_units(get, "time_min", Gst.Format.TIME),
+        burst_format=burst_format,
+        burst_value=_decode_units(get, "burst_value", burst_format))
+
+def _decode_enum(get, prop, values):
+    """Decode a value that must be one of a fixed set of names."""
+    value = get(prop)
+    if value not in values:
+        raise ValueError("{} should be one of {}".format(
+            prop, ", ".join(sorted(values))))
+    return values[value]
+
+def _decode_units(get, prop, format):
+    """Decode a limit, converting milliseconds to nanoseconds for time."""
+    value = int(get(prop))
+    if value >= 0 and format == Gst.Format.TIME:
+        value *= Gst.MSECOND
+    return value
+
 def _decode_value(value, total):
     """Decode a value that might be a percentage."""
     if value is None:
@@ -70,16 +149,48 @@ class Config:
         self._cfg = configparser.ConfigParser(
             interpolation=configparser.ExtendedInterpolation())
         self._cfg.read(os.path.join(os.path.dirname(__file__), "default.cfg"))
+        # Configuration read on top of the defaults, for reload()
+        self._inputs = []
         self._update()
 
     def read_file(self, filename):
         self._cfg.read(filename)
+        self._inputs.append(("read_file", filename))
         self._update()
 
     def read_string(self, data):
         self._cfg.read_string(data)
+        self._inputs.append(("read_string", data))
         self._update()
 
+    def reload(self):
+        """Re-read the configuration files and apply live changes.
+
+        Only the composite modes are updated: other settings take
+        effect when the server is restarted.  Changing the caps would
+        require every source to renegotiate, and the video mixer needs
+        a composite mode to show, so either raises ValueError.
+        Returns the names of composite modes that were added, removed
+        or changed.
+        """
+        new = Config()
+        for method, arg in self._inputs:
+            getattr(new, method)(arg)
+        for attr in ["video_caps", "audio_caps", "mix_caps"]:
+            if not getattr(new, attr).is_equal(getattr(self, attr)):
+                raise ValueError(
+                    "Can not change {} without a restart".format(attr))
+        if not new.composite_modes:
+            raise ValueError("No composite modes are enabled")
+
+        names = set(self.composite_modes) | set(new.composite_modes)
+        changed = {name for name in names
+                   if (self.composite_modes.get(name) !=
+                       new.composite_modes.get(name))}
+        self._cfg = new._cfg
+        self.composite_modes = new.composite_modes
+        return changed
+
     def _update(self):
         server = self._cfg["server"]
         self.audio_caps = Gst.Caps.from_string(server["audio_caps"])
@@ -93,6 +204,32 @@ class Config:
         self.clock_addr = (host, server.getint("clock_port"))
         self.avsource_addr = (host, server.getint("avsource_port"))
         self.avoutput_addr = (host, server.getint("avoutput_port"))
+        self.audio_level_interval = (
+            server.getint("audio_level_interval") * Gst.MSECOND)
+        self.frame_stats = server.getboolean("frame_stats")
+        self.frame_stats_interval = (
+            server.getint("frame_stats_interval") * Gst.MSECOND)
+        self.source_stats_interval = (
+            server.getint("source_stats_interval") * Gst.MSECOND)
+        self.stream_stats = server.getboolean("stream_stats")
+
+        # The compositor blends in mix_caps, which only differ from
+        # video_caps in their format.
+        self.mix_caps = self.video_caps.copy()
+        mix_format = server["mix_format"]
+        if mix_format:
+            self.mix_caps.set_value("format", mix_format)
+        self.mix_threads = server.getint("mix_threads")
+        self.convert_threads = server.getint("convert_threads")
+        self.mix_latency = server.getint("mix_latency") * Gst.MSECOND
+        self.convert_sources = server.getint("convert_sources")
+        self.source_grace_period = (
+            server.getint("source_grace_period") * Gst.MSECOND)
+        self.mix_start_time_selection = server["mix_start_time_selection"]
+        if self.mix_start_time_selection not in _start_time_selections:
+            raise ValueError(
+                "mix_start_time_selection should be one of {}".format(
+                    ", ".join(sorted(_start_time_selections))))
 
         struct = self.video_caps.get_structure(0)
         video_width = struct.get_value("width")
@@ -108,3 +245,27 @@ class Config:
                 continue
             self.composite_modes[mode] = _decode_composite_mode(
                 mode, section, video_width, video_height)
+
+        # Sections named "monitor.<name>" override the defaults in
+        # "monitor" for a particular monitor channel or kind of monitor.
+        defaults = self._cfg["monitor"]
+        self.monitor_policies = {
+            None: _decode_monitor_policy(defaults, defaults),
+        }
+        for section_name in self._cfg.sections():
+            if not section_name.startswith("monitor."):
+                continue
+            name = section_name[len("monitor."):]
+            self.monitor_policies[name] = _decode_monitor_policy(
+                self._cfg[section_name], defaults)
+
+    def get_monitor_policy(self, *names):
+        """Return the first monitor policy matching one of names.
+
+        Falls back to the default policy if no specific policy exists.
+        """
+        for name in names:
+            policy = self.monitor_policies.get(name)
+            if policy is not None:
+                return policy
+        return self.monitor_policies[None]
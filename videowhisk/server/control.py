@@ -10,14 +10,39 @@ log = logging.getLogger(__name__)
 
 _allowed_types = (
     messages.SetAudioSource,
+    messages.SetAudioVolume,
     messages.SetVideoSource,
+    messages.SetVideoLayout,
+    messages.ReloadConfig,
+    messages.ClockStats,
 )
 
 
+class Subscription:
+    """A filter on the messages sent to a control connection."""
+    __slots__ = ("message_types", "channels")
+
+    def __init__(self, message_types=None, channels=None):
+        self.message_types = (frozenset(message_types)
+                              if message_types is not None else None)
+        self.channels = frozenset(channels) if channels is not None else None
+
+    def matches(self, message):
+        if (self.message_types is not None and
+                message.message_type not in self.message_types):
+            return False
+        if self.channels is not None:
+            channel = getattr(message, "channel", None)
+            if channel is not None and channel not in self.channels:
+                return False
+        return True
+
+
 class ControlServerProtocol(protocol.ControlProtocol):
     def __init__(self, server):
         super().__init__()
         self.server = server
+        self.subscription = None
 
     def connection_made(self, transport):
         super().connection_made(transport)
@@ -28,30 +53,43 @@ class ControlServerProtocol(protocol.ControlProtocol):
             log.warning("Error on lost connection: %r", exc)
         self.server.connection_lost(self)
 
+    def wants_message(self, message):
+        return self.subscription is None or self.subscription.matches(message)
+
     def message_received(self, msg):
+        if isinstance(msg, messages.Subscribe):
+            self.subscription = Subscription(msg.message_types, msg.channels)
+            return
         if not isinstance(msg, _allowed_types):
             log.warning("Received unexpected message on control channel: %r", msg)
             return
+        if (isinstance(msg, messages.ClockStats) and
+                not self.server.accepts_clock_stats(self, msg)):
+            log.warning("Ignoring clock stats for %r from %r",
+                        msg.remote_addr,
+                        self.transport.get_extra_info("peername"))
+            return
         self.server._loop.create_task(self.server._bus.post(msg))
 
 
 class ControlServer:
 
-    def __init__(self, config, bus, initial_message_factory, loop):
+    def __init__(self, config, bus, initial_message_factory, loop,
+                 is_source_address=None):
         self._config = config
         self._bus = bus
         self._initial_message_factory = initial_message_factory
+        # Returns whether an AV source is connected from an address
+        self._is_source_address = is_source_address
         self._loop = loop
         self._closed = False
 
         bus.add_consumer(messages.Message, self.handle_message)
 
         self._connections = set()
-        hostname, port = config.control_addr
-        self._server = loop.run_until_complete(loop.create_server(
-            self.make_protocol, hostname, port))
+        self._server = None
 
-    async def start_server(self):
+    async def start(self):
         hostname, port = self._config.control_addr
         self._server = await self._loop.create_server(
             self.make_protocol, hostname, port)
@@ -60,8 +98,9 @@ class ControlServer:
         if self._closed:
             return
         self._closed = True
-        self._server.close()
-        await self._server.wait_closed()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
         for protocol in list(self._connections):
             if protocol.transport is not None:
                 protocol.transport.close()
@@ -69,6 +108,23 @@ class ControlServer:
     def local_port(self):
         return self._server.sockets[0].getsockname()[1]
 
+    def accepts_clock_stats(self, protocol, stats):
+        """Return whether a client may report stats for an address.
+
+        Clients report the clock of the AV source they send from, so
+        the address must be that of a connected source on the same
+        host as the client.
+        """
+        if self._is_source_address is None:
+            return False
+        if (not isinstance(stats.remote_addr, (list, tuple)) or
+                len(stats.remote_addr) < 2):
+            return False
+        remote_addr = tuple(stats.remote_addr[:2])
+        peername = protocol.transport.get_extra_info("peername")
+        return (peername is not None and remote_addr[0] == peername[0] and
+                self._is_source_address(remote_addr))
+
     def make_protocol(self):
         protocol = ControlServerProtocol(self)
         self._connections.add(protocol)
@@ -77,8 +133,22 @@ class ControlServer:
     async def handle_message(self, queue):
         while True:
             message = await queue.get()
+            if isinstance(message, messages.MixerConfig):
+                # Addresses depend on the connection, so send each
+                # client its own copy.
+                self.send_mixer_config()
+                queue.task_done()
+                continue
+            # Encode the message once for each encoding in use
+            encoded = {}
             for protocol in self._connections:
-                protocol.send_message(message)
+                if not protocol.wants_message(message):
+                    continue
+                data = encoded.get(protocol.encoding)
+                if data is None:
+                    data = protocol.encode_message(message)
+                    encoded[protocol.encoding] = data
+                protocol.send_encoded(data)
             queue.task_done()
 
     def send_initial_messages(self, protocol):
@@ -86,5 +156,14 @@ class ControlServer:
         for message in messages:
             protocol.send_message(message)
 
+    def send_mixer_config(self):
+        for protocol in self._connections:
+            if protocol.transport is None:
+                continue
+            for message in self._initial_message_factory(protocol.transport):
+                if (isinstance(message, messages.MixerConfig) and
+                        protocol.wants_message(message)):
+                    protocol.send_message(message)
+
     def connection_lost(self, protocol):
         self._connections.discard(protocol)
@@ -0,0 +1,175 @@
+"""Frame accounting at the inter element boundaries between pipelines.
+
+Every inter channel (such as "c0.video_0.mix" or "videomix.output")
+has a sink in the producing pipeline and a source in the consuming
+one.  intervideosrc repeats the last frame when the producer falls
+behind, and drops frames when it runs ahead, while interaudiosrc
+outputs silence when it runs out of samples and interaudiosink
+discards samples that aren't consumed in time.  None of this is
+reported by the elements, so buffers are counted at both ends: over
+time, the source outputting more than the sink received means
+repeats, and less means drops.  Buffers flagged as gaps are counted
+separately.
+
+The probes run Python for every buffer on the streaming threads, so
+a server only counts buffers when frame_stats is enabled in its
+config.  Video is counted in frames, and audio in nanoseconds.
+"""
+
+import asyncio
+
+from gi.repository import Gst
+
+from ..common import messages
+
+# Imbalance between the two ends that is put down to buffers being
+# counted at slightly different times, in frames or multiples of the
+# longest audio buffer.
+TOLERANCE = 2
+
+
+class InterChannel:
+    """Buffer counts for both ends of an inter channel.
+
+    Each counter is only written by the streaming thread of one end.
+    """
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.sink_count = 0
+        self.src_count = 0
+        self.gap_count = 0
+        self.repeated = 0
+        self.dropped = 0
+        self._max_duration = 0
+        self._last_sink = 0
+        self._last_src = 0
+        self._balance = 0
+        self._was_active = False
+
+    def _amount(self, buf):
+        if self.kind == "video":
+            return 1
+        if buf.duration == Gst.CLOCK_TIME_NONE:
+            return 0
+        if buf.duration > self._max_duration:
+            self._max_duration = buf.duration
+        return buf.duration
+
+    def sink_probe(self, pad, info):
+        self.sink_count += self._amount(info.get_buffer())
+        return Gst.PadProbeReturn.OK
+
+    def src_probe(self, pad, info):
+        buf = info.get_buffer()
+        if buf.has_flags(Gst.BufferFlags.GAP):
+            self.gap_count += self._amount(buf)
+        else:
+            self.src_count += self._amount(buf)
+        return Gst.PadProbeReturn.OK
+
+    def update(self):
+        """Account for the buffers counted since the last update.
+
+        Only intervals where both ends were running, and were already
+        running in the previous interval, are compared: an end that
+        just started or stopped would otherwise look like drops or
+        repeats.
+        """
+        sink_delta = self.sink_count - self._last_sink
+        src_delta = self.src_count - self._last_src
+        self._last_sink = self.sink_count
+        self._last_src = self.src_count
+        active = sink_delta > 0 and src_delta > 0
+        if active and self._was_active:
+            self._balance += src_delta - sink_delta
+            tolerance = TOLERANCE * (
+                1 if self.kind == "video" else self._max_duration)
+            if self._balance > tolerance:
+                self.repeated += self._balance
+                self._balance = 0
+            elif self._balance < -tolerance:
+                self.dropped -= self._balance
+                self._balance = 0
+        self._was_active = active
+
+    def summary(self):
+        if self.kind == "video":
+            return dict(kind=self.kind, frames=self.src_count,
+                        repeated=self.repeated, dropped=self.dropped,
+                        gaps=self.gap_count)
+        # interaudiosrc fills underruns with gaps, and a surplus from
+        # the sink has been discarded.
+        return dict(kind=self.kind, duration=self.src_count,
+                    underrun=self.gap_count + self.repeated,
+                    overrun=self.dropped)
+
+
+class FrameStatsMonitor:
+    """Counts buffers on a server's inter channels.
+
+    The accounting is published periodically as FrameStats.
+    """
+
+    def __init__(self, config, bus, loop):
+        self._config = config
+        self._bus = bus
+        self._loop = loop
+        self._closed = False
+        self._channels = {}
+        bus.add_consumer(messages.SourceMessage, self.handle_message)
+        self._run_task = self._loop.create_task(self.run())
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._run_task.cancel()
+        try:
+            await self._run_task
+        except asyncio.CancelledError:
+            pass
+
+    def get_channel(self, name, kind):
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = InterChannel(name, kind)
+        return channel
+
+    def watch_sink(self, element, kind):
+        """Count the buffers an intervideosink or interaudiosink receives."""
+        channel = self.get_channel(element.props.channel, kind)
+        element.get_static_pad("sink").add_probe(
+            Gst.PadProbeType.BUFFER, channel.sink_probe)
+
+    def watch_src(self, element, kind):
+        """Count the buffers an intervideosrc or interaudiosrc outputs."""
+        channel = self.get_channel(element.props.channel, kind)
+        element.get_static_pad("src").add_probe(
+            Gst.PadProbeType.BUFFER, channel.src_probe)
+
+    def remove_channel(self, name):
+        self._channels.pop(name, None)
+
+    def report(self):
+        return {name: channel.summary()
+                for name, channel in sorted(self._channels.items())}
+
+    async def handle_message(self, queue):
+        while True:
+            message = await queue.get()
+            if isinstance(message, (messages.AudioSourceRemoved,
+                                    messages.VideoSourceRemoved)):
+                for output in ["mix", "monitor"]:
+                    self.remove_channel(
+                        "{}.{}".format(message.channel, output))
+            queue.task_done()
+
+    async def run(self):
+        interval = self._config.frame_stats_interval / Gst.SECOND
+        while True:
+            await asyncio.sleep(interval)
+            for channel in list(self._channels.values()):
+                channel.update()
+            await self._bus.post(messages.FrameStats(self.report()))
@@ -2,6 +2,7 @@ import asyncio
 import logging
 
 from . import utils
+from ..common import instrument
 
 
 log = logging.getLogger(__name__)
@@ -43,7 +44,12 @@ class MessageBus:
 
     def add_consumer(self, types, consumer):
         queue = asyncio.Queue(loop=self._loop)
-        task = self._loop.create_task(consumer(queue))
+        if instrument.enabled():
+            coro = instrument.timed_consumer(
+                "MessageBus:" + consumer.__qualname__, consumer, queue)
+        else:
+            coro = consumer(queue)
+        task = self._loop.create_task(coro)
         self._consumers.append(Consumer(queue, task, types))
 
 
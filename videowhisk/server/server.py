@@ -1,6 +1,30 @@
+import asyncio
+import configparser
+import logging
+
+from gi.repository import Gst
 
 from . import messagebus, clock, control, avsource, audiomix, videomix, avoutput
-from ..common import messages
+from . import interstats
+from ..common import instrument, messages, tracing
+
+
+log = logging.getLogger(__name__)
+
+# Elements created for each source and monitor.  Loading their plugins
+# at startup saves doing so when the first source connects.
+PREWARM_FACTORIES = [
+    "fdsrc", "matroskademux", "tee", "queue", "capsfilter", "videoconvert",
+    "videoscale", "intervideosink", "interaudiosink", "intervideosrc",
+    "interaudiosrc", "level", "matroskamux", "multifdsink",
+]
+
+
+def prewarm_factories(names):
+    for name in names:
+        factory = Gst.ElementFactory.find(name)
+        if factory is None or factory.load() is None:
+            log.warning("Could not load element factory %s", name)
 
 
 class Server:
@@ -11,36 +35,108 @@ class Server:
         self.config = config
         self.bus = messagebus.MessageBus(loop)
         self.clock = clock.ClockServer(self.config)
-        self.audiomix = audiomix.AudioMix(config, self.bus, loop)
-        self.videomix = videomix.VideoMix(config, self.bus, loop)
-        self.outputs = avoutput.AVOutputServer(config, self.bus, loop)
-        self.sources = avsource.AVSourceServer(config, self.bus, loop)
+        self.clock_monitor = clock.ClockMonitor(self.bus)
+        # Frame accounting costs a Python probe call per buffer
+        self.frame_stats = None
+        if config.frame_stats:
+            self.frame_stats = interstats.FrameStatsMonitor(
+                config, self.bus, loop)
+        self.audiomix = audiomix.AudioMix(
+            config, self.bus, loop, self.frame_stats)
+        self.videomix = videomix.VideoMix(
+            config, self.bus, loop, self.frame_stats)
+        self.outputs = avoutput.AVOutputServer(
+            config, self.bus, loop, self.make_metrics, self.frame_stats)
+        self.sources = avsource.AVSourceServer(
+            config, self.bus, loop, self.frame_stats)
         self.control = control.ControlServer(
-            config, self.bus, self.make_initial_messages, loop)
+            config, self.bus, self.make_initial_messages, loop,
+            self.sources.is_source_address)
+        self.bus.add_consumer(messages.ReloadConfig, self.handle_message)
+        self._prewarm = None
+
+    async def start(self):
+        """Start accepting connections, then bring up the mixers.
+
+        The AVSourceServer is listening once constructed, and control
+        clients can connect as soon as the ControlServer has started.
+        The mixer pipelines are built in worker threads and brought to
+        PLAYING concurrently, while messages for them wait in their
+        queues.  Plugins needed by later sources are loaded in the
+        background.
+        """
+        await self.control.start()
+        self._prewarm = self.loop.run_in_executor(
+            None, prewarm_factories, PREWARM_FACTORIES)
+        await asyncio.gather(self.audiomix.start(), self.videomix.start(),
+                             self.outputs.start())
 
     async def close(self):
+        if self._prewarm is not None:
+            await self._prewarm
         await self.control.close()
         await self.outputs.close()
         await self.audiomix.close()
         await self.videomix.close()
         await self.sources.close()
+        if self.frame_stats is not None:
+            await self.frame_stats.close()
         await self.clock.close()
         await self.bus.close()
 
+    async def handle_message(self, queue):
+        while True:
+            message = await queue.get()
+            if isinstance(message, messages.ReloadConfig):
+                await self.reload_config()
+            queue.task_done()
+
+    async def reload_config(self):
+        """Re-read the configuration, applying composite mode changes.
+
+        The video mixer and control clients are sent a new MixerConfig
+        if anything changed.
+        """
+        try:
+            changed = self.config.reload()
+        except (OSError, ValueError, configparser.Error) as exc:
+            log.error("Could not reload configuration: %s", exc)
+            return
+        if not changed:
+            log.info("Configuration reloaded with no changes")
+            return
+        log.info("Configuration reloaded, composite modes changed: %s",
+                 ", ".join(sorted(changed)))
+        await self.bus.post(self.make_mixer_config(self.config.control_addr[0]))
+
+    def make_mixer_config(self, local_addr):
+        return messages.MixerConfig(
+            control_addr=(local_addr, self.control.local_port()),
+            clock_addr=(local_addr, self.clock.local_port()),
+            avsource_addr=(local_addr, self.sources.local_port()),
+            avoutput_uri="http://{}:{}".format(
+                local_addr, self.outputs.local_port()),
+            composite_modes=sorted(self.config.composite_modes.keys()),
+            video_caps=self.config.video_caps.to_string(),
+            audio_caps=self.config.audio_caps.to_string())
+
+    def make_metrics(self):
+        """Return the data served by the AVOutputServer at /metrics."""
+        clocks = self.clock_monitor.get_clock_quality()
+        frames = None
+        if self.frame_stats is not None:
+            frames = self.frame_stats.report()
+        return dict(clocks={"{}:{}".format(*addr): quality._asdict()
+                            for addr, quality in sorted(clocks.items())},
+                    converted_sources=self.sources.converted_sources(),
+                    tracers=tracing.report(),
+                    callbacks=instrument.report(),
+                    frames=frames)
+
     def make_initial_messages(self, transport):
         # Use the local address matching the connection to the client
         local_addr = transport.get_extra_info("sockname")[0]
-        msgs = [
-            messages.MixerConfig(
-                control_addr=(local_addr, self.control.local_port()),
-                clock_addr=(local_addr, self.clock.local_port()),
-                avsource_addr=(local_addr, self.sources.local_port()),
-                avoutput_uri="http://{}:{}".format(
-                    local_addr, self.outputs.local_port()),
-                composite_modes=sorted(self.config.composite_modes.keys()),
-                video_caps=self.config.video_caps.to_string(),
-                audio_caps=self.config.audio_caps.to_string())
-        ]
+        msgs = [self.make_mixer_config(local_addr)]
         msgs.extend(self.sources.make_source_messages())
         msgs.append(self.videomix.make_video_mix_status())
         msgs.append(self.audiomix.make_audio_mix_status())
@@ -19,6 +19,27 @@ async def cancel_task(task):
         log.exception("Task %r failed", task)
 
 
+def set_future_result(fut, result):
+    """Set the result of a future, unless it is already done.
+
+    This is intended for use with loop.call_soon_threadsafe, where the
+    future may have been cancelled in the mean time.
+    """
+    if not fut.done():
+        fut.set_result(result)
+
+
+async def discard_messages(queue):
+    """Consume a message bus queue without handling the messages.
+
+    For consumers that can't handle messages, so the bus can still be
+    closed.
+    """
+    while True:
+        await queue.get()
+        queue.task_done()
+
+
 def forward_prop(dest_prop):
     assert '.' in dest_prop
     parent, prop_name = dest_prop.rsplit('.', 1)
@@ -1,44 +1,176 @@
-from gi.repository import Gst
+import asyncio
+import logging
+import math
+
+from gi.repository import Gst, GstController
 
 from . import clock, config, utils
-from ..common import messages
+from ..common import instrument, messages, tracing
+
+
+log = logging.getLogger(__name__)
+
+# Output frames between scheduling a layout change and it taking effect
+SWITCH_DELAY_FRAMES = 2
+
+# Seconds to wait for the mixer output to reach a scheduled switch
+SWITCH_TIMEOUT = 1.0
+
+# Pad settings for sources that are not shown
+HIDDEN = config.CompositeInput(
+    xpos=0, width=0, ypos=0, height=0, zorder=0, alpha=0.0)
+
+# Supported ways of animating a layout change
+TRANSITIONS = ("cut", "fade", "slide")
+
+# Longest transition in milliseconds: longer durations are shortened
+MAX_TRANSITION_DURATION = 60000
+
+
+def transition_keyframes(transition, current, target, start, duration,
+                         width):
+    """Return (timestamp, settings) keyframes animating a source.
+
+    current holds the source's settings at start, and target those it
+    should have once the transition is complete.  The compositor
+    interpolates linearly between keyframes.  Sources that stay on
+    screen move to their new position, while sources entering or
+    leaving the screen fade or slide (in from the right, out to the
+    left) depending on the transition.
+    """
+    if transition not in TRANSITIONS or transition == "cut" or duration <= 0:
+        return [(start, target)]
+    end = start + duration
+    was_visible = current.alpha > 0
+    visible = target.alpha > 0
+    if was_visible and visible:
+        return [(start, current), (end, target)]
+    elif visible:
+        if transition == "fade":
+            initial = target._replace(alpha=0.0)
+        else:
+            initial = target._replace(xpos=target.xpos + width)
+        return [(start, initial), (end, target)]
+    elif was_visible:
+        if transition == "fade":
+            final = current._replace(alpha=0.0)
+        else:
+            final = current._replace(xpos=current.xpos - width)
+        return [(start, current), (end - 1, final), (end, target)]
+    return [(start, target)]
+
+
+def scale_size(settings_list, width, height):
+    """Return the frame size needed to draw a source at all of settings.
+
+    Sizes are capped at the full width and height, and None is
+    returned if the source is hidden in all of settings.
+    """
+    sizes = [(settings.width or width, settings.height or height)
+             for settings in settings_list if settings.alpha > 0]
+    if not sizes:
+        return None
+    return (min(max(w for (w, h) in sizes), width),
+            min(max(h for (w, h) in sizes), height))
 
 
 class VideoMix:
-    def __init__(self, config, bus, loop):
+    def __init__(self, config, bus, loop, frame_stats=None):
         self._closed = False
         self._loop = loop
         self._config = config
         self._bus = bus
+        self._frame_stats = frame_stats
         bus.add_consumer((messages.VideoSourceMessage,
-                          messages.SetVideoSource), self.handle_message)
+                          messages.SetVideoSource,
+                          messages.SetVideoLayout,
+                          messages.MixerConfig), self.handle_message)
         self._sources = {}
         self._composite_mode = "fullscreen"
-        self._source_a = None
-        self._source_b = None
-        self.make_pipeline()
+        # Maps slot names of the composite mode to channels
+        mode = config.composite_modes.get(self._composite_mode)
+        self._slots = dict.fromkeys(mode.slots) if mode is not None else {}
+        self._switch_time = None
+        # Waits for the mixer to output the latest layout switch
+        self._switch_task = None
+        ok, num, den = config.video_caps.get_structure(0).get_fraction(
+            "framerate")
+        self._frame_duration = Gst.util_uint64_scale_int(Gst.SECOND, den, num)
+        ok, self._width = config.video_caps.get_structure(0).get_int("width")
+        ok, self._height = config.video_caps.get_structure(0).get_int(
+            "height")
+        self._pipeline = None
+        # Sources being removed from the pipeline
+        self._closing_tasks = set()
+        # Messages wait in the queue until the pipeline is playing
+        self._started = loop.create_future()
+
+    async def start(self):
+        """Build the pipeline in a worker thread and start it playing."""
+        try:
+            await self._loop.run_in_executor(None, self.make_pipeline)
+        except Exception:
+            utils.set_future_result(self._started, False)
+            raise
+        utils.set_future_result(self._started, True)
 
     async def close(self):
         if self._closed:
             return
         self._closed = True
-        self.destroy_pipeline()
+        # Let messages for a mixer that never started be discarded
+        utils.set_future_result(self._started, False)
+        if self._switch_task is not None:
+            await utils.cancel_task(self._switch_task)
+        for task in list(self._closing_tasks):
+            await utils.cancel_task(task)
+        if self._pipeline is not None:
+            # Stopping the pipeline can block, so do it in a worker
+            # thread.
+            await self._loop.run_in_executor(
+                None, self._pipeline.set_state, Gst.State.NULL)
+            self.destroy_pipeline()
 
     def make_pipeline(self):
         self._pipeline = Gst.Pipeline("videomix")
         self._pipeline.use_clock(clock.get_clock())
-        self._mixer = Gst.ElementFactory.make("compositor")
+        self._mixer = self.make_mixer(self._config)
         tee = Gst.ElementFactory.make("tee")
         queue = Gst.ElementFactory.make("queue")
         sink = Gst.ElementFactory.make("intervideosink")
         sink.props.channel = "videomix.output"
+        if self._frame_stats is not None:
+            self._frame_stats.watch_sink(sink, "video")
         self._pipeline.add(self._mixer, tee, queue, sink)
-        self._mixer.link_filtered(tee, self._config.video_caps)
+        if self._config.mix_caps.is_equal(self._config.video_caps):
+            self._mixer.link_filtered(tee, self._config.video_caps)
+        else:
+            # Blend in the mixing format, and convert to the output
+            # format in a separate element.
+            convert = Gst.ElementFactory.make("videoconvert")
+            convert.props.n_threads = self._config.convert_threads
+            self._pipeline.add(convert)
+            self._mixer.link_filtered(convert, self._config.mix_caps)
+            convert.link_filtered(tee, self._config.video_caps)
         tee.link(queue)
         queue.link(sink)
+        tracing.register_pipeline(self._pipeline, self.element_channels)
         self._pipeline.set_state(Gst.State.PLAYING)
 
+    @staticmethod
+    def make_mixer(config):
+        """Create a compositor configured from the mixer settings."""
+        mixer = Gst.ElementFactory.make("compositor")
+        mixer.props.latency = config.mix_latency
+        Gst.util_set_object_arg(
+            mixer, "start-time-selection", config.mix_start_time_selection)
+        # Parallel blending needs GStreamer 1.20
+        if mixer.find_property("max-threads") is not None:
+            mixer.props.max_threads = config.mix_threads
+        return mixer
+
     def destroy_pipeline(self):
+        tracing.unregister_pipeline(self._pipeline)
         self._pipeline.set_state(Gst.State.NULL)
         # Don't bother closing each source: they should be cleaned up
         # when the pipeline is unrefed.
@@ -46,114 +178,322 @@ class VideoMix:
         self._mixer = None
         self._pipeline = None
 
+    def element_channels(self):
+        return {el.get_name(): channel
+                for channel, source in list(self._sources.items())
+                for el in source.elements}
+
     async def handle_message(self, queue):
+        if not await self._started:
+            await utils.discard_messages(queue)
         while True:
             message = await queue.get()
             if isinstance(message, messages.VideoSourceAdded):
                 source = VideoMixSource(
                     self._config, self._pipeline, message.channel,
-                    self._mixer, self._loop)
+                    self._mixer, self._loop, self._frame_stats)
                 self._sources[message.channel] = source
             elif isinstance(message, messages.VideoSourceRemoved):
                 source = self._sources.pop(message.channel, None)
                 if source is not None:
-                    if self._source_a == source.channel:
-                        self._source_a = None
-                    if self._source_b == source.channel:
-                        self._source_b = None
-                    await source.close()
+                    for slot, channel in self._slots.items():
+                        if channel == source.channel:
+                            self._slots[slot] = None
+                    self._close_source(source)
             elif isinstance(message, messages.SetVideoSource):
-                self.handle_source_change(message)
+                await self.handle_source_change(message)
+            elif isinstance(message, messages.SetVideoLayout):
+                await self.handle_layout_change(message)
+            elif isinstance(message, messages.MixerConfig):
+                await self.handle_config_change()
             queue.task_done()
-            await self._bus.post(self.make_video_mix_status())
+            # A pending switch posts the status once it takes effect
+            if self._switch_task is None:
+                await self._bus.post(self.make_video_mix_status())
             source = None
 
-    def handle_source_change(self, message):
+    def _close_source(self, source):
+        # Closing waits for the source's data to drain, so don't hold
+        # up other messages in the mean time.
+        task = self._loop.create_task(source.close())
+        self._closing_tasks.add(task)
+        task.add_done_callback(self._closing_tasks.discard)
+
+    async def handle_source_change(self, message):
+        # Unknown sources (including None) leave the slot unchanged.
+        slots = {}
+        if message.source_a in self._sources:
+            slots["a"] = message.source_a
+        if message.source_b in self._sources:
+            slots["b"] = message.source_b
+        transition = message.transition
+        duration = message.duration
+        if (not isinstance(duration, (int, float)) or
+                isinstance(duration, bool) or not math.isfinite(duration) or
+                duration < 0):
+            log.warning("Invalid transition duration %r, cutting instead",
+                        duration)
+            transition, duration = "cut", 0
+        duration = min(duration, MAX_TRANSITION_DURATION)
+        self.set_layout(message.composite_mode, slots, transition,
+                        round(duration * Gst.MSECOND))
+
+    async def handle_layout_change(self, message):
+        info = self._config.composite_modes.get(message.composite_mode)
+        if info is None:
+            log.warning("Ignoring layout for unknown composite mode %r",
+                        message.composite_mode)
+            return
+        if not isinstance(message.slots, dict) or not all(
+                slot in info.slots and
+                (channel is None or isinstance(channel, str))
+                for (slot, channel) in message.slots.items()):
+            log.warning("Ignoring invalid layout %r for composite mode %s",
+                        message.slots, message.composite_mode)
+            return
+        # Unknown sources leave the slot unchanged, while None clears it.
+        slots = {slot: channel for (slot, channel) in message.slots.items()
+                 if channel is None or channel in self._sources}
+        self.set_layout(message.composite_mode, slots)
+
+    async def handle_config_change(self):
+        # The composite modes have been reloaded: redraw the current
+        # mode if its geometry changed, or fall back to fullscreen if
+        # it was removed.
+        modes = self._config.composite_modes
+        composite_mode = self._composite_mode
+        if composite_mode not in modes:
+            composite_mode = ("fullscreen" if "fullscreen" in modes
+                              else sorted(modes)[0])
+        self.set_layout(composite_mode, {}, force=True)
+
+    def set_layout(self, composite_mode, slots, transition="cut",
+                   duration=0, force=False):
+        """Change the composite mode and the sources shown in its slots.
+
+        Slots not mentioned in slots keep their current source.  The
+        change is animated using the named transition over duration
+        nanoseconds.  With force, the layout is reapplied even if
+        unchanged.
+        """
         # Validate requested changes, defaulting to current state.
-        new_composite_mode = message.composite_mode
-        if new_composite_mode not in self._config.composite_modes:
-            new_composite_mode = self._composite_mode
-        new_source_a = message.source_a
-        if new_source_a not in self._sources:
-            new_source_a = self._source_a
-        new_source_b = message.source_b
-        if new_source_b not in self._sources:
-            new_source_b = self._source_b
-        if new_source_b == new_source_a:
-            new_source_b = None
+        if composite_mode not in self._config.composite_modes:
+            composite_mode = self._composite_mode
+        info = self._config.composite_modes[composite_mode]
+        new_slots = {}
+        used = set()
+        for slot in info.slots:
+            channel = slots.get(slot, self._slots.get(slot))
+            # A source can only be shown in one slot
+            if channel in used:
+                channel = None
+            if channel is not None:
+                used.add(channel)
+            new_slots[slot] = channel
 
         # If nothing has changed, we're done.
-        if (new_composite_mode == self._composite_mode and
-            new_source_a == self._source_a and
-            new_source_b == self._source_b):
+        if (not force and composite_mode == self._composite_mode and
+            new_slots == self._slots):
             return
 
-        # Reset sources no longer in use
-        old_sources = {self._source_a, self._source_b}.difference(
-            {new_source_a, new_source_b})
-        for source in old_sources:
-            if source is not None:
-                self._sources[source].reset_pad()
+        # Work out all pad settings before touching the compositor,
+        # then apply them in one batch.
+        updates = []
+        old_sources = set(self._slots.values()).difference(used)
+        for channel in old_sources:
+            if channel is not None:
+                updates.append((self._sources[channel], HIDDEN))
+        for slot, channel in new_slots.items():
+            if channel is not None:
+                updates.append((self._sources[channel], info.slots[slot]))
+        self._composite_mode = composite_mode
+        self._slots = new_slots
+        self._switch_time = None
+        self.apply_updates(updates, transition, duration)
 
-        info = self._config.composite_modes[new_composite_mode]
+    def apply_updates(self, updates, transition="cut", duration=0):
+        """Apply a batch of (source, settings) pad updates.
 
-        # Update source_a
-        if new_source_a is not None:
-            self._sources[new_source_a].apply(info.a)
+        All the updates are scheduled to start on the same output
+        frame, so no frame is rendered with a mix of old and new
+        settings.  Transitions are then animated by the compositor's
+        control bindings in the streaming thread, and are cancelled
+        by the next call from the point it takes effect.  Rather than
+        holding up other messages until then, _switch_task records
+        the stream time of the first frame rendered with the new
+        settings and posts the status.  If the mixer is not producing
+        output, the updates are applied immediately instead.
 
-        # Update source_b
-        if new_source_b is not None:
-            self._sources[new_source_b].apply(info.b)
+        Hidden sources have zero alpha, which the compositor skips,
+        so they cost no blending work.  Visible sources are scaled to
+        their slot size before reaching the compositor: frames are
+        enlarged before the switch and shrunk once any transition is
+        complete, so the compositor never has to scale frames up.
+        """
+        # Only the latest switch is waited for, and its sources scaled
+        # down afterwards.
+        if self._switch_task is not None:
+            self._switch_task.cancel()
+            self._switch_task = None
+        if not updates:
+            return
+        srcpad = self._mixer.get_static_pad("src")
+        ok, position = srcpad.query_position(Gst.Format.TIME)
+        if not ok or position < 0:
+            for source, settings in updates:
+                source.apply(settings)
+                self._scale_source(source, [settings])
+            return
 
-        self._composite_mode = new_composite_mode
-        self._source_a = new_source_a
-        self._source_b = new_source_b
+        # The compositor syncs the controlled pad properties for each
+        # output frame, so pick a time a few frames ahead of the
+        # frame currently being produced.
+        switch_time = position + SWITCH_DELAY_FRAMES * self._frame_duration
+        fut = self._loop.create_future()
+        probe_id = srcpad.add_probe(
+            Gst.PadProbeType.BUFFER,
+            lambda pad, info: self._switch_probe(info, switch_time, fut))
+        for source, settings in updates:
+            current = source.settings_at(switch_time)
+            keyframes = transition_keyframes(
+                transition, current, settings, switch_time, duration,
+                self._width)
+            self._scale_source(
+                source, [s for (t, s) in keyframes], grow_only=True)
+            source.schedule(keyframes)
+        self._switch_task = self._loop.create_task(self._wait_for_switch(
+            updates, duration, srcpad, probe_id, fut, switch_time))
+
+    async def _wait_for_switch(self, updates, duration, srcpad, probe_id,
+                               fut, switch_time):
+        # The probe completes fut and removes itself once the output
+        # reaches switch_time, even if a newer switch cancelled us.
+        # Unlike wait_for, wait doesn't cancel fut, so fut.done() shows
+        # whether the probe is already gone.
+        await asyncio.wait([fut], timeout=SWITCH_TIMEOUT)
+        if fut.done():
+            self._switch_time = fut.result()
+        else:
+            fut.cancel()
+            srcpad.remove_probe(probe_id)
+            log.warning("Timed out waiting for layout switch at %d",
+                        switch_time)
+        self._switch_task = None
+        for source, settings in updates:
+            # Skip sources removed in the mean time
+            if self._sources.get(source.channel) is source:
+                self._scale_source(source, [settings],
+                                   delay=duration / Gst.SECOND)
+        await self._bus.post(self.make_video_mix_status())
+
+    def _scale_source(self, source, settings_list, grow_only=False,
+                      delay=0):
+        # Hidden sources keep their current size, to avoid
+        # renegotiating when they are shown again.
+        size = scale_size(settings_list, self._width, self._height)
+        if size is None:
+            return
+        if grow_only:
+            width, height = source.scale_size
+            size = (max(size[0], width), max(size[1], height))
+        source.scale_to(size, delay)
+
+    @instrument.timed
+    def _switch_probe(self, info, switch_time, fut):
+        pts = info.get_buffer().pts
+        if pts == Gst.CLOCK_TIME_NONE or pts < switch_time:
+            return Gst.PadProbeReturn.OK
+        self._loop.call_soon_threadsafe(utils.set_future_result, fut, pts)
+        return Gst.PadProbeReturn.REMOVE
 
     def make_video_mix_status(self):
         return messages.VideoMixStatus(
-            self._composite_mode, self._source_a, self._source_b)
+            self._composite_mode, self._slots.get("a"), self._slots.get("b"),
+            dict(self._slots), self._switch_time)
 
 
 class VideoMixSource:
-    def __init__(self, config, pipeline, channel, mixer, loop):
+    def __init__(self, config, pipeline, channel, mixer, loop,
+                 frame_stats=None):
         self._pipeline = pipeline
         self.channel = channel
         self._mixer = mixer
         self._loop = loop
+        self._video_caps = config.video_caps
+        struct = config.video_caps.get_structure(0)
+        self.scale_size = (struct.get_value("width"),
+                           struct.get_value("height"))
+        self._scale_handle = None
 
         self._source = Gst.ElementFactory.make("intervideosrc")
         self._source.props.channel = "{}.mix".format(channel)
+        if frame_stats is not None:
+            frame_stats.watch_src(self._source, "video")
+        # Repeat the last frame while a disconnected source may resume
+        self._source.props.timeout = max(
+            self._source.props.timeout, config.source_grace_period)
         self._filter = Gst.ElementFactory.make("capsfilter")
         self._filter.props.caps = config.video_caps
         self._queue = Gst.ElementFactory.make("queue")
-        self._pipeline.add(self._source, self._filter, self._queue)
+        # Sources shown in small slots are scaled down in their own
+        # streaming thread, rather than by the compositor.
+        self._scale = Gst.ElementFactory.make("videoscale")
+        # Fill slots whose aspect ratio differs from the output's,
+        # rather than letterboxing the source within them.
+        self._scale.props.add_borders = False
+        self._scale_filter = Gst.ElementFactory.make("capsfilter")
+        self._scale_filter.props.caps = config.video_caps
+        self.elements = [self._source, self._filter, self._queue,
+                         self._scale, self._scale_filter]
+        self._pipeline.add(*self.elements)
         self._source.link(self._filter)
         self._filter.link(self._queue)
-        self._queue.link(self._mixer)
-        self._sink_pad = self._queue.get_static_pad("src").get_peer()
+        self._queue.link(self._scale)
+        self._scale.link(self._scale_filter)
+        self._scale_filter.link(self._mixer)
+        self._sink_pad = self._scale_filter.get_static_pad("src").get_peer()
+        # Control sources let us change several pad properties on
+        # exactly the same output frame, and animate them.
+        self._control_sources = {}
+        for prop in HIDDEN._fields:
+            cs = GstController.InterpolationControlSource()
+            cs.props.mode = GstController.InterpolationMode.LINEAR
+            self._sink_pad.add_control_binding(
+                GstController.DirectControlBinding.new_absolute(
+                    self._sink_pad, prop, cs))
+            self._control_sources[prop] = cs
         self.reset_pad()
 
+        self._scale_filter.sync_state_with_parent()
+        self._scale.sync_state_with_parent()
         self._queue.sync_state_with_parent()
         self._filter.sync_state_with_parent()
         self._source.sync_state_with_parent()
 
     async def close(self):
+        if self._scale_handle is not None:
+            self._scale_handle.cancel()
+            self._scale_handle = None
         fut = self._loop.create_future()
         self._source.get_static_pad("src").add_probe(
             Gst.PadProbeType.BLOCK_DOWNSTREAM, self._source_pad_probe, fut)
         await fut
+        await self._loop.run_in_executor(None, self._remove_elements)
 
-        # Stop the elements and remove them from the pipeline:
-        for el in [self._source, self._filter, self._queue]:
+    def _remove_elements(self):
+        # Stop the elements and remove them from the pipeline.  This
+        # runs in a worker thread, as stopping them can block.
+        for el in self.elements:
             el.set_state(Gst.State.NULL)
             self._pipeline.remove(el)
         self._mixer.release_request_pad(self._sink_pad)
 
+    @instrument.timed
     def _source_pad_probe(self, pad, info, fut):
         pad.remove_probe(info.id)
 
         # Set new probe to wait for end of stream
-        self._queue.get_static_pad("src").add_probe(
+        self._scale_filter.get_static_pad("src").add_probe(
             Gst.PadProbeType.BLOCK | Gst.PadProbeType.EVENT_DOWNSTREAM,
             self._queue_pad_probe, fut)
 
@@ -162,6 +502,7 @@ class VideoMixSource:
         self._filter.get_static_pad("sink").send_event(Gst.Event.new_eos())
         return Gst.PadProbeReturn.OK
 
+    @instrument.timed
     def _queue_pad_probe(self, pad, info, fut):
         # Pass any non-EOS events on
         if info.get_event().type != Gst.EventType.EOS:
@@ -174,20 +515,74 @@ class VideoMixSource:
         return Gst.PadProbeReturn.DROP
 
     def reset_pad(self):
-        self.xpos = 0
-        self.width = 0
-        self.ypos = 0
-        self.height = 0
-        self.alpha = 0.0
-        self.zorder = 0
+        self.apply(HIDDEN)
+
+    def scale_to(self, size, delay=0):
+        """Scale frames to size (width, height) before they are mixed.
+
+        With a delay in seconds, the change is made later unless it is
+        replaced by another call in the mean time.  Changing the size
+        renegotiates caps, so this is a no-op if the size is unchanged.
+        """
+        if self._scale_handle is not None:
+            self._scale_handle.cancel()
+            self._scale_handle = None
+        if delay > 0:
+            self._scale_handle = self._loop.call_later(
+                delay, self.scale_to, size)
+            return
+        if size == self.scale_size:
+            return
+        self.scale_size = size
+        caps = self._video_caps.copy()
+        caps.set_value("width", size[0])
+        caps.set_value("height", size[1])
+        self._scale_filter.props.caps = caps
 
     def apply(self, settings):
-        self.xpos = settings.xpos
-        self.width = settings.width
-        self.ypos = settings.ypos
-        self.height = settings.height
-        self.alpha = settings.alpha
-        self.zorder = settings.zorder
+        """Apply pad settings immediately."""
+        for cs in self._control_sources.values():
+            cs.unset_all()
+        for prop, value in zip(settings._fields, settings):
+            self._sink_pad.set_property(prop, value)
+
+    def settings_at(self, timestamp):
+        """Return the pad settings in effect at timestamp."""
+        values = {}
+        for prop, cs in self._control_sources.items():
+            ok, value = cs.get_value(timestamp)
+            if not ok:
+                value = self._sink_pad.get_property(prop)
+            if isinstance(getattr(HIDDEN, prop), int):
+                value = int(round(value))
+            values[prop] = value
+        return HIDDEN._replace(**values)
+
+    def schedule(self, keyframes):
+        """Animate the pad settings through (timestamp, settings) keyframes.
+
+        Changes scheduled from the first keyframe onwards are
+        replaced, so a transition in progress is cancelled from that
+        point.
+        """
+        start = keyframes[0][0]
+        current = self.settings_at(start)
+        for prop, cs in self._control_sources.items():
+            earlier = []
+            for point in cs.get_all():
+                if point.timestamp < start:
+                    earlier.append(point.timestamp)
+                else:
+                    cs.unset(point.timestamp)
+            # Only the last earlier point is needed to interpolate
+            # up to the start of the new keyframes.
+            for timestamp in earlier[:-1]:
+                cs.unset(timestamp)
+            # Hold the current value until start, rather than
+            # interpolating towards the first keyframe.
+            cs.set(start - 1, getattr(current, prop))
+            for timestamp, settings in keyframes:
+                cs.set(timestamp, getattr(settings, prop))
 
     xpos = utils.forward_prop("_sink_pad.props.xpos")
     width = utils.forward_prop("_sink_pad.props.width")